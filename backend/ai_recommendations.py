@@ -11,7 +11,7 @@ def recommend_visualizations(df):
         recommendations.append(('time_series', 'Line Chart'))
     
     # Check for categorical data
-    categorical_columns = df.select_dtypes(include=['object']).columns
+    categorical_columns = df.select_dtypes(include=['object', 'category']).columns
     if len(categorical_columns) > 0:
         recommendations.append(('categorical', 'Bar Chart'))
     
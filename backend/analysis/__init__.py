@@ -1,3 +1,3 @@
-from .main import analyze_data
+from .main import ANALYSIS_SECTIONS, analyze_data, analyze_sections, build_section, section_outputs
 
-__all__ = ['analyze_data']
\ No newline at end of file
+__all__ = ['ANALYSIS_SECTIONS', 'analyze_data', 'analyze_sections', 'build_section', 'section_outputs']
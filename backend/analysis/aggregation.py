@@ -0,0 +1,258 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Histograms and binned pair counts take at most this many bins per axis
+QUERY_MAX_BINS = int(os.environ.get("QUERY_MAX_BINS", 1000))
+# Groups a group-by returns unless the request asks for another limit
+GROUP_LIMIT = int(os.environ.get("QUERY_GROUP_LIMIT", 50))
+# Columns binned against each other in one pair counts query, every pair is returned
+PAIR_COLUMN_LIMIT = int(os.environ.get("QUERY_PAIR_COLUMN_LIMIT", 12))
+AGGREGATIONS = ('count', 'sum', 'mean', 'min', 'max', 'std', 'box')
+GROUP_ORDERS = ('size', 'key')
+
+def _code_dtype(n_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def _category_values(categories):
+    # Group keys as JSON values: dates as ISO strings, numbers and strings as they are
+    if isinstance(categories, pd.DatetimeIndex):
+        return [value.isoformat() for value in categories]
+    return categories.tolist()
+
+class CategoryIndex:
+    # A column dictionary-encoded once per dataset version: every row's code and the distinct
+    # values the codes point to, in sorted order. Group-bys bin the codes with bincount instead
+    # of hashing the values again. Missing values get code -1.
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+
+    @property
+    def n_categories(self):
+        return len(self.categories)
+
+def build_category_index(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Stored as an Arrow dictionary, the codes are already there
+        series = series.cat.remove_unused_categories()
+        if not series.cat.ordered:
+            series = series.cat.reorder_categories(series.cat.categories.sort_values())
+        codes, categories = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, categories = pd.factorize(series, sort=True)
+    return CategoryIndex(codes.astype(_code_dtype(len(categories))), _category_values(categories))
+
+def group_codes(indexes, n_rows):
+    # One code per distinct combination of the indexes' values, with each combination's
+    # category positions in the indexes. Rows missing any of the values get -1; no indexes
+    # puts every row in one group.
+    if not indexes:
+        return np.zeros(n_rows, dtype=np.int64), np.empty((1, 0), dtype=np.int64)
+    codes = indexes[0].codes.astype(np.int64)
+    keys = np.arange(indexes[0].n_categories)[:, None]
+    for index in indexes[1:]:
+        valid = (codes >= 0) & (index.codes >= 0)
+        combined = codes[valid] * index.n_categories + index.codes[valid]
+        # Only combinations in the data get a code, so codes stay below the row count
+        present, inverse = np.unique(combined, return_inverse=True)
+        codes = np.full(n_rows, -1, dtype=np.int64)
+        codes[valid] = inverse
+        keys = np.column_stack([keys[present // index.n_categories], present % index.n_categories])
+    return codes, keys
+
+def _sorted_groups(codes, values, n_groups):
+    # Values sorted by group and then value, with every group's start and end in the sorted order
+    order = np.lexsort((values, codes))
+    sorted_codes, sorted_values = codes[order], values[order]
+    starts = np.searchsorted(sorted_codes, np.arange(n_groups), side='left')
+    ends = np.searchsorted(sorted_codes, np.arange(n_groups), side='right')
+    return sorted_codes, sorted_values, starts, ends
+
+def _at(sorted_values, positions, empty):
+    # Values at the given sorted positions, NaN for empty groups (whose positions point anywhere)
+    if not len(sorted_values):
+        return np.full(len(positions), np.nan)
+    return np.where(empty, np.nan, sorted_values[np.clip(positions, 0, len(sorted_values) - 1)])
+
+def _quantiles(sorted_values, starts, counts, q):
+    # Linear interpolation between the closest ranks, like np.quantile
+    last = starts + np.maximum(counts - 1, 0)
+    position = starts + q * np.maximum(counts - 1, 0)
+    lower = np.floor(position).astype(np.int64)
+    low_values = _at(sorted_values, lower, counts == 0)
+    high_values = _at(sorted_values, np.minimum(lower + 1, last), counts == 0)
+    return low_values + (high_values - low_values) * (position - lower)
+
+def _box(sorted_codes, sorted_values, starts, ends, n_groups):
+    # Tukey box per group: quartiles, whiskers at the most extreme values within 1.5 IQR of the
+    # box and the number of values beyond them. Values are sorted within each group, so the
+    # values below the lower fence are the first ones of their group.
+    counts = ends - starts
+    q1 = _quantiles(sorted_values, starts, counts, 0.25)
+    median = _quantiles(sorted_values, starts, counts, 0.5)
+    q3 = _quantiles(sorted_values, starts, counts, 0.75)
+    low_fence, high_fence = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+    below = np.bincount(sorted_codes[sorted_values < low_fence[sorted_codes]], minlength=n_groups)
+    above = np.bincount(sorted_codes[sorted_values > high_fence[sorted_codes]], minlength=n_groups)
+    return {"q1": q1, "median": median, "q3": q3, "whisker_low": _at(sorted_values, starts + below, counts == 0),
+            "whisker_high": _at(sorted_values, ends - 1 - above, counts == 0), "outliers": below + above}
+
+def aggregate_groups(codes, n_groups, values=None, aggregations=('count',), quantiles=()):
+    # Per-group aggregates of values (float64, NaN where missing) over the rows with a code.
+    # Sums, means and deviations are bincounts; min, max, quantiles and boxes share one sort.
+    valid = codes >= 0
+    results = {"size": np.bincount(codes[valid], minlength=n_groups)}
+    if values is None:
+        return results
+    present = valid & ~np.isnan(values)
+    group, value = codes[present], values[present]
+    count = np.bincount(group, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        total = np.bincount(group, weights=value, minlength=n_groups)
+        mean = total / count
+        if 'count' in aggregations:
+            results['count'] = count
+        if 'sum' in aggregations:
+            results['sum'] = total
+        if 'mean' in aggregations:
+            results['mean'] = mean
+        if 'std' in aggregations:
+            # Sample standard deviation like pandas, from deviations to the group means
+            squares = np.bincount(group, weights=(value - mean[group]) ** 2, minlength=n_groups)
+            results['std'] = np.sqrt(squares / (count - 1))
+    if {'min', 'max', 'box'} & set(aggregations) or quantiles:
+        sorted_codes, sorted_values, starts, ends = _sorted_groups(group, value, n_groups)
+        empty = ends == starts
+        if 'min' in aggregations:
+            results['min'] = _at(sorted_values, starts, empty)
+        if 'max' in aggregations:
+            results['max'] = _at(sorted_values, ends - 1, empty)
+        if quantiles:
+            results['quantiles'] = {str(q): _quantiles(sorted_values, starts, ends - starts, q) for q in quantiles}
+        if 'box' in aggregations:
+            results['box'] = _box(sorted_codes, sorted_values, starts, ends, n_groups)
+    return results
+
+def _json_values(values):
+    if isinstance(values, dict):
+        return {key: _json_values(value) for key, value in values.items()}
+    if values.dtype.kind == 'f':
+        return [None if np.isnan(value) else value for value in values.tolist()]
+    return values.tolist()
+
+def group_by(indexes, n_rows, values=None, aggregations=('count',), quantiles=(), order='size', limit=GROUP_LIMIT):
+    # Aggregates per combination of the indexes' values, the largest groups first (or in key
+    # order) and at most `limit` of them. Rows in the groups left out are counted in other_size.
+    unknown = [aggregation for aggregation in aggregations if aggregation not in AGGREGATIONS]
+    if unknown:
+        raise ValueError(f"Unknown aggregations: {unknown}")
+    if order not in GROUP_ORDERS:
+        raise ValueError(f"Unknown group order: {order}")
+    if any(not 0 <= q <= 1 for q in quantiles):
+        raise ValueError("Quantiles must be between 0 and 1")
+    if values is None and (set(aggregations) - {'count'} or quantiles):
+        raise ValueError("Aggregations other than count need a value column")
+
+    codes, keys = group_codes(indexes, n_rows)
+    results = aggregate_groups(codes, len(keys), values, aggregations, quantiles)
+    size = results["size"]
+    groups = _ordered_groups(size, order)
+    kept = groups[:max(limit, 0)]
+
+    def select(value):
+        return {key: select(item) for key, item in value.items()} if isinstance(value, dict) else value[kept]
+
+    return {
+        "keys": _group_keys(indexes, keys[kept]),
+        **{name: _json_values(select(value)) for name, value in results.items()},
+        "total_groups": int(len(groups)),
+        "other_size": int(size[groups[len(kept):]].sum()),
+        "missing_keys": int(n_rows - size.sum()),
+    }
+
+def _ordered_groups(size, order):
+    # Groups holding rows, the largest first or in key order
+    groups = np.flatnonzero(size > 0)
+    if order == 'size':
+        groups = groups[np.argsort(-size[groups], kind='stable')]
+    return groups
+
+def _group_keys(indexes, keys):
+    return [[index.categories[position] for index, position in zip(indexes, key)] for key in keys.tolist()]
+
+def bin_edges(values, bins=30, value_range=None, edges=None):
+    # Explicit edges, or `bins` equal-width bins over value_range (default: the values' extent)
+    if edges is not None:
+        edges = np.asarray(edges, dtype=np.float64)
+        if len(edges) < 2 or np.any(np.diff(edges) <= 0):
+            raise ValueError("Bin edges must be increasing and at least two")
+    else:
+        if not 1 <= bins <= QUERY_MAX_BINS:
+            raise ValueError(f"Bins must be between 1 and {QUERY_MAX_BINS}")
+        finite = values[~np.isnan(values)]
+        low, high = value_range if value_range is not None else (None, None)
+        low = (float(finite.min()) if len(finite) else 0.0) if low is None else low
+        high = (float(finite.max()) if len(finite) else 1.0) if high is None else high
+        if high < low:
+            raise ValueError("The bin range is empty")
+        if high == low:
+            low, high = low - 0.5, high + 0.5
+        edges = np.linspace(low, high, bins + 1)
+    if len(edges) - 1 > QUERY_MAX_BINS:
+        raise ValueError(f"At most {QUERY_MAX_BINS} bins")
+    return edges
+
+def bin_values(values, edges):
+    # Each value's bin, the last bin closed like np.histogram; -1 for missing values and values
+    # outside the edges
+    index = np.searchsorted(edges, values, side='right') - 1
+    index[values == edges[-1]] = len(edges) - 2
+    index[(index < 0) | (index >= len(edges) - 1) | np.isnan(values)] = -1
+    return index
+
+def histogram(values, edges, indexes=(), limit=GROUP_LIMIT):
+    # Bin counts of the values, plus the values below and above the edges and the missing ones.
+    # With indexes, one row of counts for each of the `limit` largest groups.
+    n_bins = len(edges) - 1
+    index = bin_values(values, edges)
+    result = {}
+    codes, keys = group_codes(list(indexes), len(values))
+    if indexes:
+        size = np.bincount(codes[codes >= 0], minlength=len(keys))
+        kept = _ordered_groups(size, 'size')[:max(limit, 0)]
+        # Rows of the groups left out get no row of counts; the extra last slot keeps -1 at -1
+        positions = np.full(len(keys) + 1, -1, dtype=np.int64)
+        positions[kept] = np.arange(len(kept))
+        codes = positions[codes]
+        result.update(groups=_group_keys(indexes, keys[kept]), group_sizes=size[kept].tolist())
+    n_groups = len(keys) if not indexes else len(result["groups"])
+    inside = (index >= 0) & (codes >= 0)
+    counts = np.bincount(codes[inside] * n_bins + index[inside], minlength=n_groups * n_bins).reshape(n_groups, n_bins)
+    return {
+        "edges": edges.tolist(),
+        "counts": counts.tolist() if indexes else counts[0].tolist(),
+        "below": int((values < edges[0]).sum()),
+        "above": int((values > edges[-1]).sum()),
+        "missing": int(np.isnan(values).sum()),
+        **result,
+    }
+
+def pair_counts(columns):
+    # 2-D bin counts of every pair of the given columns ({name: (values, edges)}); each column is
+    # binned once, then each pair is one bincount over rows where both have a bin
+    binned = {name: (bin_values(values, edges), edges) for name, (values, edges) in columns.items()}
+    names = list(binned)
+    pairs = []
+    for i, x in enumerate(names):
+        x_index, x_edges = binned[x]
+        for y in names[i + 1:]:
+            y_index, y_edges = binned[y]
+            both = (x_index >= 0) & (y_index >= 0)
+            n_y = len(y_edges) - 1
+            counts = np.bincount(x_index[both] * n_y + y_index[both], minlength=(len(x_edges) - 1) * n_y)
+            pairs.append({"x": x, "y": y, "counts": counts.reshape(-1, n_y).tolist(), "total": int(both.sum())})
+    return {"edges": {name: edges.tolist() for name, (_, edges) in binned.items()}, "pairs": pairs}
@@ -1,33 +1,89 @@
 import numpy as np
 import pandas as pd
+import scipy.sparse
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
-from sklearn.impute import SimpleImputer
-
-def perform_pca(df):
-    numeric_df = df.select_dtypes(include=[np.number])
-    if not numeric_df.empty and numeric_df.shape[1] > 1:
-        imputer = SimpleImputer(strategy='mean')
-        imputed_data = imputer.fit_transform(numeric_df)
-        
-        scaler = StandardScaler()
-        scaled_data = scaler.fit_transform(imputed_data)
-        pca = PCA(n_components=2)
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from .features import build_analysis_context, sparse_block
+from .sampling import approximation_info, needs_sampling, proportion_error_bounds, sample_rows
+
+# The sample is split into this many folds to estimate how stable the explained variance is
+PCA_ERROR_FOLDS = 5
+
+def _scaled_numeric(df, context, rows=None):
+    # The standardized block of the analysis context, for the given rows of a sample.
+    # Dense columns are scaled with the statistics of every row.
+    sparse = context.groups['sparse']
+    if len(context.numeric) + len(sparse) <= 1:
+        return None
+    if sparse:
+        return _scaled_sparse(df if rows is None else df.iloc[rows], context, sparse, rows)
+    standardized = context.standardized()
+    return standardized if rows is None else standardized[rows]
+
+def _scaled_sparse(df, context, sparse, rows):
+    # Sparse columns are scaled but not centred, which would fill them in. Neither k-means
+    # distances nor PCA (which centres sparse input implicitly) change when a column is shifted.
+    blocks = []
+    if context.numeric:
+        standardized = context.standardized()
+        blocks.append(scipy.sparse.csr_matrix(standardized if rows is None else standardized[rows]))
+    blocks.append(StandardScaler(with_mean=False).fit_transform(sparse_block(df, sparse).tocsr()))
+    scaled = scipy.sparse.hstack(blocks, format='csr')
+    # Too few features for a sparse solver
+    return scaled.toarray() if scaled.shape[1] <= 2 else scaled
+
+def _pca(data, **kwargs):
+    # ARPACK is the solver that takes sparse input without densifying it
+    if scipy.sparse.issparse(data):
+        kwargs.update(svd_solver='arpack', random_state=42)
+    return PCA(n_components=2, **kwargs)
+
+def perform_pca(df, context=None):
+    context = context if context is not None else build_analysis_context(df)
+    if not needs_sampling(df):
+        scaled_data = _scaled_numeric(df, context)
+        if scaled_data is None:
+            return None, [], None
+        pca = _pca(scaled_data)
         pca_result = pca.fit_transform(scaled_data)
         pca_data = pd.DataFrame(data=pca_result, columns=['PC1', 'PC2']).to_dict(orient='records')
-        return pca_data, pca.explained_variance_ratio_.tolist()
-    return None, []
-
-def perform_clustering(df):
-    numeric_df = df.select_dtypes(include=[np.number])
-    if not numeric_df.empty and numeric_df.shape[1] > 1:
-        imputer = SimpleImputer(strategy='mean')
-        imputed_data = imputer.fit_transform(numeric_df)
-        
-        scaler = StandardScaler()
-        scaled_data = scaler.fit_transform(imputed_data)
+        return pca_data, pca.explained_variance_ratio_.tolist(), None
+
+    # Large datasets: randomized PCA on a sample, points are returned for the sampled rows only
+    rows, method = sample_rows(df)
+    scaled_data = _scaled_numeric(df, context, rows)
+    if scaled_data is None:
+        return None, [], None
+    pca = _pca(scaled_data, svd_solver='randomized', random_state=42)
+    pca_result = pca.fit_transform(scaled_data)
+    pca_data = pd.DataFrame(data=pca_result, columns=['PC1', 'PC2']).to_dict(orient='records')
+
+    # Standard error of the explained variance ratio from fits on disjoint folds of the sample
+    fold_ratios = [
+        _pca(scaled_data, svd_solver='randomized', random_state=42).fit(scaled_data[fold]).explained_variance_ratio_
+        for fold in np.array_split(np.arange(scaled_data.shape[0]), PCA_ERROR_FOLDS)
+    ]
+    standard_error = np.std(fold_ratios, axis=0, ddof=1) / np.sqrt(PCA_ERROR_FOLDS)
+    approximation = approximation_info(len(df), len(rows), method, rows, explained_variance_error=(1.96 * standard_error).tolist())
+    return pca_data, pca.explained_variance_ratio_.tolist(), approximation
+
+def perform_clustering(df, context=None):
+    context = context if context is not None else build_analysis_context(df)
+    if not needs_sampling(df):
+        scaled_data = _scaled_numeric(df, context)
+        if scaled_data is None:
+            return None, None
         kmeans = KMeans(n_clusters=3, random_state=42)
         clusters = kmeans.fit_predict(scaled_data)
-        return clusters.tolist()
-    return None
\ No newline at end of file
+        return clusters.tolist(), None
+
+    # Large datasets: mini-batch k-means on the same sample PCA uses, so the labels line up with pca_data
+    rows, method = sample_rows(df)
+    scaled_data = _scaled_numeric(df, context, rows)
+    if scaled_data is None:
+        return None, None
+    kmeans = MiniBatchKMeans(n_clusters=3, random_state=42, batch_size=1024, n_init=3)
+    clusters = kmeans.fit_predict(scaled_data)
+    approximation = approximation_info(len(df), len(rows), method, rows, cluster_shares=proportion_error_bounds(clusters, len(df)))
+    return clusters.tolist(), approximation
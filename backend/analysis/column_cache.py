@@ -0,0 +1,40 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from result_cache import RESULT_CACHE_DIRECTORY, ResultCache
+
+COLUMN_CACHE_MEMORY_BYTES = int(os.environ.get("COLUMN_CACHE_MEMORY_BYTES", 128 * 1024 * 1024))
+COLUMN_CACHE_DISK_BYTES = int(os.environ.get("COLUMN_CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+
+# Per-column results are keyed on the column's values, so changing one column's options only
+# recomputes that column. The disk tier lets pool workers reuse each other's results. Lookups
+# made inside pool workers are counted in those processes and don't reach /metrics.
+column_cache = ResultCache(os.path.join(RESULT_CACHE_DIRECTORY, "columns"), COLUMN_CACHE_MEMORY_BYTES, COLUMN_CACHE_DISK_BYTES,
+                           name="column")
+
+def column_fingerprint(series):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(series.dtype).encode('utf-8'))
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufcmM':
+        # Plain arrays are hashed as their bytes, several times faster than hash_pandas_object
+        digest.update(np.ascontiguousarray(series.to_numpy()).view(np.uint8))
+    else:
+        digest.update(pd.util.hash_pandas_object(series, index=False).values.tobytes())
+    return digest.hexdigest()
+
+def memoize_columns(stage, df, columns, compute, context=''):
+    # compute(missing_columns) must return {column: result} for the columns it is given
+    if not (column_cache.memory_bytes or column_cache.disk_bytes):
+        # Caching is off, the columns would be fingerprinted for nothing
+        results = compute(list(columns))
+        return {column: results[column] for column in columns if column in results}
+    keys = {column: f"{stage}{context}-{column_fingerprint(df[column])}" for column in columns}
+    cached = column_cache.get_many(list(keys.values()))
+    results = {column: cached[keys[column]] for column in columns if keys[column] in cached}
+    missing = [column for column in columns if column not in results]
+    if missing:
+        computed = compute(missing)
+        column_cache.put_many({keys[column]: result for column, result in computed.items()})
+        results.update(computed)
+    return {column: results[column] for column in columns if column in results}
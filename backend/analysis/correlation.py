@@ -1,20 +1,99 @@
+import os
 import numpy as np
 import pandas as pd
+from .features import build_analysis_context, sparse_block
+
+TOP_CORRELATIONS = int(os.environ.get("TOP_CORRELATIONS", 5))
+# Pairs weaker than this are never reported as top correlations
+TOP_CORRELATION_THRESHOLD = float(os.environ.get("TOP_CORRELATION_THRESHOLD", 0.0))
+
+def compute_correlation_matrix(df, context=None):
+    context = context if context is not None else build_analysis_context(df)
+    sparse = context.groups['sparse']
+    if len(context.numeric) + len(sparse) > 1:
+        if sparse:
+            numeric = [column for column in df.columns if column in context.positions or column in set(sparse)]
+            return sparse_correlation_matrix(df[numeric], sparse)
+        return dense_correlation_matrix(context)
+    return None
+
+def dense_correlation_matrix(context):
+    # Complete columns correlate through one product of the standardized block; with missing
+    # values each pair uses the rows where both are present, as DataFrame.corr does
+    columns = context.numeric
+    if any(context.missing[column] for column in columns):
+        return pd.DataFrame(context.values(), columns=columns).corr()
+    standardized = context.standardized()
+    correlation = (standardized.T @ standardized) / context.n_rows
+    # Constant columns have no correlation, like DataFrame.corr
+    constant = ~np.any(standardized != 0, axis=0)
+    correlation[constant, :] = np.nan
+    correlation[:, constant] = np.nan
+    np.fill_diagonal(correlation, np.where(constant, np.nan, 1.0))
+    return pd.DataFrame(np.clip(correlation, -1, 1), index=columns, columns=columns)
+
+def sparse_correlation_matrix(numeric_df, sparse):
+    # Pearson correlations like DataFrame.corr, without densifying the sparse columns: pairs with
+    # a sparse column come from sums and cross products over its non-zeros. Sparse columns are
+    # complete; for dense columns each pair only uses the rows where the dense value is present.
+    dense = [column for column in numeric_df.columns if column not in set(sparse)]
+    X = sparse_block(numeric_df, sparse)
+    n = X.shape[0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sums = np.asarray(X.sum(axis=0)).ravel()
+        covariance = (X.T @ X).toarray() - np.outer(sums, sums) / n
+        variance = np.diag(covariance).copy()
+        sparse_corr = covariance / np.sqrt(np.outer(variance, variance))
+
+        values = numeric_df[dense].to_numpy(dtype=np.float64, na_value=np.nan)
+        present = ~np.isnan(values)
+        values = np.where(present, values, 0.0)
+        counts = present.sum(axis=0)
+        present = present.astype(np.float64)
+        x_sums = np.asarray(X.T @ present)
+        x_squares = np.asarray(X.multiply(X).T @ present)
+        y_sums = values.sum(axis=0)
+        cross = np.asarray(X.T @ values) - x_sums * y_sums / counts
+        x_variance = x_squares - x_sums ** 2 / counts
+        y_variance = (values ** 2).sum(axis=0) - y_sums ** 2 / counts
+        mixed_corr = cross / np.sqrt(x_variance * y_variance)
+
+    matrix = pd.DataFrame(np.nan, index=numeric_df.columns, columns=numeric_df.columns)
+    matrix.loc[dense, dense] = numeric_df[dense].corr().to_numpy() if dense else np.empty((0, 0))
+    matrix.loc[sparse, sparse] = np.clip(sparse_corr, -1, 1)
+    matrix.loc[sparse, dense] = np.clip(mixed_corr, -1, 1)
+    matrix.loc[dense, sparse] = np.clip(mixed_corr, -1, 1).T
+    for i, column in enumerate(sparse):
+        if variance[i] > 0:
+            matrix.loc[column, column] = 1.0
+    return matrix
+
+def correlation_to_dict(correlation_matrix):
+    if correlation_matrix is None:
+        return {}
+    return correlation_matrix.to_dict()
 
 def get_correlation(df):
-    numeric_df = df.select_dtypes(include=[np.number])
-    if not numeric_df.empty and numeric_df.shape[1] > 1:
-        return numeric_df.corr().to_dict()
-    return {}
+    return correlation_to_dict(compute_correlation_matrix(df))
 
-def get_top_correlations(correlation_matrix, n=5):
-    if not correlation_matrix:
+def get_top_correlations(correlation_matrix, n=TOP_CORRELATIONS, threshold=TOP_CORRELATION_THRESHOLD):
+    if correlation_matrix is None or len(correlation_matrix) == 0 or n <= 0:
         return []
-    correlation_matrix = pd.DataFrame(correlation_matrix)
-    
-    corr_pairs = []
-    for i in range(len(correlation_matrix.columns)):
-        for j in range(i+1, len(correlation_matrix.columns)):
-            corr_pairs.append((correlation_matrix.index[i], correlation_matrix.columns[j], correlation_matrix.iloc[i, j]))
-    
-    return sorted(corr_pairs, key=lambda x: abs(x[2]), reverse=True)[:n]
\ No newline at end of file
+    if isinstance(correlation_matrix, dict):
+        correlation_matrix = pd.DataFrame(correlation_matrix)
+
+    # Every pair above the diagonal once, without building Python tuples for all of them
+    values = correlation_matrix.to_numpy()
+    rows, cols = np.triu_indices(values.shape[0], k=1)
+    pair_values = values[rows, cols]
+    magnitudes = np.abs(pair_values)
+    candidates = np.flatnonzero(~np.isnan(magnitudes) & (magnitudes >= threshold))
+
+    if len(candidates) > n:
+        candidates = candidates[np.argpartition(-magnitudes[candidates], n - 1)[:n]]
+    # Strongest first, ties keep matrix order
+    candidates = candidates[np.lexsort((candidates, -magnitudes[candidates]))]
+
+    index = correlation_matrix.index
+    columns = correlation_matrix.columns
+    return [(index[rows[k]], columns[cols[k]], float(pair_values[k])) for k in candidates]
@@ -1,25 +1,57 @@
 import pandas as pd
-import numpy as np
+from .column_cache import memoize_columns
+from .features import build_analysis_context
+from .streaming_stats import ColumnSketch, block_sketches, column_kind
 
-def get_summary(df):
-    summary = {}
-    for column in df.columns:
-        col_summary = {}
-        if pd.api.types.is_numeric_dtype(df[column]):
-            col_summary['type'] = 'numerical'
-            col_summary.update(df[column].describe().to_dict())
-            col_summary['skewness'] = df[column].skew()
-            col_summary['kurtosis'] = df[column].kurtosis()
-        elif pd.api.types.is_datetime64_any_dtype(df[column]):
-            col_summary['type'] = 'datetime'
-            col_summary['min'] = df[column].min().isoformat()
-            col_summary['max'] = df[column].max().isoformat()
-        else:
-            col_summary['type'] = 'categorical'
-            col_summary['unique_values'] = df[column].nunique()
-            col_summary['top_values'] = df[column].value_counts().head(5).to_dict()
-        summary[column] = col_summary
-    return summary
+def summarize_column(series):
+    # The exact per-column path, kept for boolean columns: the sketches count them as categories
+    # while the summary has always described them as numbers
+    col_summary = {}
+    if pd.api.types.is_numeric_dtype(series):
+        col_summary['type'] = 'numerical'
+        col_summary.update(series.describe().to_dict())
+        col_summary['skewness'] = series.skew()
+        col_summary['kurtosis'] = series.kurtosis()
+    elif pd.api.types.is_datetime64_any_dtype(series):
+        col_summary['type'] = 'datetime'
+        col_summary['min'] = series.min().isoformat()
+        col_summary['max'] = series.max().isoformat()
+    else:
+        col_summary['type'] = 'categorical'
+        col_summary['unique_values'] = series.nunique()
+        # Categorical columns count their unused categories too
+        counts = series.value_counts()
+        col_summary['top_values'] = counts[counts > 0].head(5).to_dict()
+    return col_summary
+
+def get_summary(df, context=None):
+    # Built from the streaming sketches over the data in memory: the dense numeric columns are
+    # read from the context's block all at once, other columns one pass each. Quantiles and
+    # distinct counts keep every value, so the summary is exact.
+    context = context if context is not None else build_analysis_context(df)
+    boolean = set(context.groups['boolean'])
+
+    def compute(columns):
+        numeric = [column for column in columns if column in context.positions]
+        sketches = block_sketches(context.values(numeric), numeric)
+        results = {}
+        for column in columns:
+            if column in sketches:
+                results[column] = sketches[column].summary()
+            elif column in boolean:
+                results[column] = summarize_column(df[column])
+            else:
+                series = df[column]
+                sketch = ColumnSketch(column_kind(series), distinct_limit=len(series))
+                sketch.update(series)
+                results[column] = sketch.summary()
+        return results
+
+    return memoize_columns('summary', df, df.columns, compute)
+
+def summarize(df, context=None):
+    # The summary stage: computed from every value, so there is no approximation to report
+    return get_summary(df, context), None
 
 def get_column_types(df):
     column_types = {}
@@ -32,13 +64,18 @@ def get_column_types(df):
             column_types[column] = 'categorical'
     return column_types
 
-def calculate_general_statistics(df):
+def get_missing_values(df, context=None):
+    context = context if context is not None else build_analysis_context(df)
+    return dict(context.missing)
+
+def calculate_general_statistics(df, context=None):
+    context = context if context is not None else build_analysis_context(df)
     total_rows = len(df)
     total_columns = len(df.columns)
-    numeric_columns = len(df.select_dtypes(include=[np.number]).columns)
-    categorical_columns = len(df.select_dtypes(include=['object']).columns)
-    datetime_columns = len(df.select_dtypes(include=['datetime64']).columns)
-    missing_values = df.isnull().sum().sum()
+    numeric_columns = len(context.numeric) + len(context.groups['sparse'])
+    categorical_columns = len(context.groups['categorical'])
+    datetime_columns = len(context.groups['datetime'])
+    missing_values = sum(context.missing.values())
     total_cells = total_rows * total_columns
     
     return {
@@ -0,0 +1,238 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Rows per bucket at the finest pyramid level; each coarser level doubles it
+LOD_LEAF_SIZE = int(os.environ.get("LOD_LEAF_SIZE", 64))
+# Cells per axis of the finest density grid; coarser levels halve it down to DENSITY_MIN_BINS
+DENSITY_GRID_BINS = int(os.environ.get("DENSITY_GRID_BINS", 1024))
+DENSITY_MIN_BINS = 8
+# Scatter viewports holding at most this many points get the points instead of a density grid
+SCATTER_POINT_LIMIT = int(os.environ.get("SCATTER_POINT_LIMIT", 5000))
+LINE_METHODS = ('minmax', 'lttb')
+
+def axis_values(series):
+    # Chart coordinates as float64: numbers as they are, dates (or date strings) as epoch milliseconds
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=np.float64, na_value=np.nan), 'number'
+    dates = series if pd.api.types.is_datetime64_any_dtype(series) else pd.to_datetime(series, errors='coerce')
+    if dates.notna().sum() == 0:
+        raise ValueError(f"Column {series.name} is neither numeric nor a date")
+    if getattr(dates.dt, 'tz', None) is not None:
+        dates = dates.dt.tz_convert(None)
+    values = dates.to_numpy(dtype='datetime64[ms]').astype(np.int64).astype(np.float64)
+    values[dates.isna().to_numpy()] = np.nan
+    return values, 'datetime'
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, from each bucket in
+    # between, the point forming the largest triangle with the previous pick and the next bucket's mean
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+def _group_extremes(groups, x, y, pick_max):
+    # Per group, the x and y of its smallest (or largest) y, for groups given as sorted ids
+    order = np.lexsort((-y if pick_max else y, groups))
+    first = np.flatnonzero(np.r_[True, groups[order][1:] != groups[order][:-1]])
+    chosen = order[first]
+    return x[chosen], y[chosen]
+
+class SeriesPyramid:
+    # Min/max summaries of a series sorted by x, at bucket sizes LOD_LEAF_SIZE, 2x, 4x, ...
+    # A viewport query reads the level whose buckets are just finer than a pixel, so zooming
+    # and panning never touch more than a few buckets per pixel.
+    def __init__(self, x, y, x_type='number', order=None):
+        self.n = len(x)
+        self.x_type = x_type
+        # Row positions in x order when the column was not already sorted
+        self.order = order
+        self.levels = []
+        if self.n == 0:
+            return
+        self.x_range = (float(x[0]), float(x[-1]))
+        size = LOD_LEAF_SIZE
+        starts = np.arange(0, self.n, size)
+        groups = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, self.n]))
+        min_x, min_y = _group_extremes(groups, x, y, pick_max=False)
+        max_x, max_y = _group_extremes(groups, x, y, pick_max=True)
+        first_x = x[starts]
+        while True:
+            self.levels.append({"size": size, "first_x": first_x, "min_x": min_x, "min_y": min_y,
+                                "max_x": max_x, "max_y": max_y})
+            if len(first_x) <= 1:
+                break
+            # Each coarser level merges pairs of buckets
+            pairs = np.arange(len(first_x)) // 2
+            min_x, min_y = _group_extremes(pairs, min_x, min_y, pick_max=False)
+            max_x, max_y = _group_extremes(pairs, max_x, max_y, pick_max=True)
+            first_x = first_x[::2]
+            size *= 2
+
+    def row_range(self, start, end):
+        # Approximate sorted-row range of the viewport, to the nearest leaf bucket
+        leaf = self.levels[0]["first_x"]
+        lo = max(int(np.searchsorted(leaf, start, side='right')) - 1, 0) * LOD_LEAF_SIZE
+        hi = min(int(np.searchsorted(leaf, end, side='right')) * LOD_LEAF_SIZE, self.n)
+        return lo, hi
+
+    def extremes(self, start, end, buckets):
+        # Min and max points of about `buckets` equal-width x slices of the viewport
+        lo, hi = self.row_range(start, end)
+        wanted = max((hi - lo) // buckets, 1)
+        level = next((level for level in reversed(self.levels) if level["size"] <= wanted), self.levels[0])
+        first, last = lo // level["size"], -(-hi // level["size"])
+        columns = {key: level[key][first:last] for key in ("min_x", "min_y", "max_x", "max_y")}
+        x = np.concatenate([columns["min_x"], columns["max_x"]])
+        y = np.concatenate([columns["min_y"], columns["max_y"]])
+        return minmax_buckets(x, y, start, end, buckets)
+
+def minmax_buckets(x, y, start, end, buckets):
+    # The lowest and highest point of each of `buckets` equal-width x slices of [start, end]
+    keep = (x >= start) & (x <= end)
+    x, y = x[keep], y[keep]
+    if len(x) <= 2 * buckets:
+        order = np.argsort(x, kind='stable')
+        return x[order], y[order]
+    slices = np.minimum(((x - start) / max(end - start, np.finfo(float).tiny) * buckets).astype(np.int64), buckets - 1)
+    min_x, min_y = _group_extremes(slices, x, y, pick_max=False)
+    max_x, max_y = _group_extremes(slices, x, y, pick_max=True)
+    # Slices whose min and max are the same point send it once
+    distinct = (min_x != max_x) | (min_y != max_y)
+    x, y = np.concatenate([min_x, max_x[distinct]]), np.concatenate([min_y, max_y[distinct]])
+    order = np.argsort(x, kind='stable')
+    return x[order], y[order]
+
+def build_series_pyramid(x_series, y_series):
+    if x_series is None:
+        x, x_type = np.arange(len(y_series), dtype=np.float64), 'index'
+    else:
+        x, x_type = axis_values(x_series)
+    y, _ = axis_values(y_series)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    rows = np.flatnonzero(valid)
+    order = None
+    if len(rows) > 1 and np.any(np.diff(x[rows]) < 0):
+        rows = rows[np.argsort(x[rows], kind='stable')]
+        order = rows
+    elif not valid.all():
+        order = rows
+    return SeriesPyramid(x[rows], y[rows], x_type, order)
+
+def downsample_series(pyramid, raw_loader, start=None, end=None, pixels=1000, method='minmax'):
+    # raw_loader(lo, hi) returns the sorted x and y of rows lo..hi, read only when the viewport
+    # holds few enough rows to send them as they are
+    if method not in LINE_METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    empty = {"x": [], "y": [], "x_type": pyramid.x_type, "viewport_points": 0, "method": "raw"}
+    if pyramid.n == 0:
+        return empty
+    start = pyramid.x_range[0] if start is None else start
+    end = pyramid.x_range[1] if end is None else end
+    # A viewport entirely to one side of the data holds none of its rows
+    if start > end or start > pyramid.x_range[1] or end < pyramid.x_range[0]:
+        return empty
+    lo, hi = pyramid.row_range(start, end)
+
+    # Min/max keeps up to 2 points per pixel, LTTB picks 1 per pixel from twice as many min/max
+    # candidates. Viewports too narrow for the leaf buckets to give that many are read raw.
+    buckets = pixels if method == 'minmax' else 2 * pixels
+    if hi - lo <= buckets * LOD_LEAF_SIZE:
+        x, y = raw_loader(lo, hi)
+        keep = (x >= start) & (x <= end)
+        x, y, used = x[keep], y[keep], "raw"
+        if len(x) > 2 * buckets:
+            x, y, used = *minmax_buckets(x, y, start, end, buckets), "minmax"
+    else:
+        x, y = pyramid.extremes(start, end, buckets)
+        used = "minmax"
+    if method == 'lttb' and len(x) > pixels:
+        chosen = lttb(x, y, pixels)
+        x, y, used = x[chosen], y[chosen], "lttb"
+    return {"x": x.tolist(), "y": y.tolist(), "x_type": pyramid.x_type,
+            # Rows in the viewport, to the nearest leaf bucket
+            "viewport_points": int(hi - lo), "method": used}
+
+class DensityPyramid:
+    # Point counts on a DENSITY_GRID_BINS square grid over the data extent, and 2x2-pooled
+    # coarser grids down to DENSITY_MIN_BINS
+    def __init__(self, x, y, x_type='number', y_type='number'):
+        self.x_type, self.y_type = x_type, y_type
+        self.n = len(x)
+        self.x_range = (float(x.min()), float(x.max())) if self.n else (0.0, 1.0)
+        self.y_range = (float(y.min()), float(y.max())) if self.n else (0.0, 1.0)
+        counts, _, _ = np.histogram2d(x, y, bins=DENSITY_GRID_BINS, range=[self._padded(self.x_range), self._padded(self.y_range)])
+        self.levels = [counts.astype(np.int64)]
+        while self.levels[-1].shape[0] > DENSITY_MIN_BINS:
+            grid = self.levels[-1]
+            self.levels.append(grid.reshape(grid.shape[0] // 2, 2, grid.shape[1] // 2, 2).sum(axis=(1, 3)))
+
+    @staticmethod
+    def _padded(value_range):
+        low, high = value_range
+        return (low, high) if high > low else (low - 0.5, high + 0.5)
+
+    def _cells(self, value_range, low, high, bins):
+        range_low, range_high = self._padded(value_range)
+        width = (range_high - range_low) / bins
+        first = int(np.clip(np.floor((low - range_low) / width), 0, bins))
+        last = int(np.clip(np.ceil((high - range_low) / width), first, bins))
+        return first, last, range_low + width * np.arange(first, last + 1)
+
+    def query(self, x_min, x_max, y_min, y_max, bins):
+        # The coarsest level that still has at least `bins` cells across the viewport on the
+        # wider axis, or None when the viewport is zoomed in past the finest grid
+        for grid in reversed(self.levels):
+            resolution = grid.shape[0]
+            x_first, x_last, x_edges = self._cells(self.x_range, x_min, x_max, resolution)
+            y_first, y_last, y_edges = self._cells(self.y_range, y_min, y_max, resolution)
+            if max(x_last - x_first, y_last - y_first) >= bins:
+                return grid[x_first:x_last, y_first:y_last], x_edges, y_edges
+        return None
+
+def build_density_pyramid(x_series, y_series):
+    x, x_type = axis_values(x_series)
+    y, y_type = axis_values(y_series)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    return DensityPyramid(x[valid], y[valid], x_type, y_type)
+
+def scatter_density(pyramid, raw_loader, x_min=None, x_max=None, y_min=None, y_max=None, bins=200):
+    # raw_loader() returns all x and y, read only when the viewport is zoomed in past the
+    # finest grid or holds few enough points to send them as they are
+    x_min = pyramid.x_range[0] if x_min is None else x_min
+    x_max = pyramid.x_range[1] if x_max is None else x_max
+    y_min = pyramid.y_range[0] if y_min is None else y_min
+    y_max = pyramid.y_range[1] if y_max is None else y_max
+    response = {"x_type": pyramid.x_type, "y_type": pyramid.y_type, "total_points": pyramid.n}
+
+    cells = pyramid.query(x_min, x_max, y_min, y_max, bins)
+    if cells is not None and cells[0].sum() > SCATTER_POINT_LIMIT:
+        counts, x_edges, y_edges = cells
+        response.update(mode="density", x_edges=x_edges.tolist(), y_edges=y_edges.tolist(), counts=counts.tolist())
+        return response
+
+    x, y = raw_loader()
+    inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+    x, y = x[inside], y[inside]
+    if len(x) <= SCATTER_POINT_LIMIT:
+        response.update(mode="points", x=x.tolist(), y=y.tolist())
+        return response
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins, range=[DensityPyramid._padded((x_min, x_max)),
+                                                                       DensityPyramid._padded((y_min, y_max))])
+    response.update(mode="density", x_edges=x_edges.tolist(), y_edges=y_edges.tolist(), counts=counts.astype(np.int64).tolist())
+    return response
@@ -1,24 +1,44 @@
-import pandas as pd
+import os
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
+from .features import build_design_matrix
+from .sampling import approximation_info
 
-def get_feature_importance(df):
-    numeric_columns = df.select_dtypes(include=[np.number]).columns
-    categorical_columns = df.select_dtypes(include=['object']).columns
+# Each tree is fit on a bootstrap sample of at most this many rows, which bounds the cost on large files
+FEATURE_IMPORTANCE_MAX_SAMPLES = int(os.environ.get("FEATURE_IMPORTANCE_MAX_SAMPLES", 10000))
+FEATURE_IMPORTANCE_JOBS = int(os.environ.get("FEATURE_IMPORTANCE_JOBS", -1))
+
+def get_feature_importance(df, design=None):
+    design = design if design is not None else build_design_matrix(df)
     importance = {}
-    
-    for column in numeric_columns:
-        X = df.drop(columns=[column])
-        y = df[column]
-        
-        # Handle categorical features
-        X_encoded = pd.get_dummies(X, columns=categorical_columns)
+    if not design.targets:
+        return importance, None
+
+    # Random forests work in float32, converting once avoids a copy per target
+    X = design.matrix(dtype=np.float32)
+    all_features = np.arange(design.n_features)
+    max_samples = FEATURE_IMPORTANCE_MAX_SAMPLES if design.n_rows > FEATURE_IMPORTANCE_MAX_SAMPLES else None
+    importance_error = {}
+
+    for column, position in design.targets.items():
+        features = np.delete(all_features, position)
+        y = np.asarray(design.arrays['dense'][:, position])
         
         # Use Random Forest for feature importance
-        rf = RandomForestRegressor(n_estimators=100, random_state=42)
-        rf.fit(X_encoded, y)
+        rf = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=FEATURE_IMPORTANCE_JOBS, max_samples=max_samples)
+        rf.fit(X[:, features], y)
         
-        feature_importance = dict(zip(X_encoded.columns, rf.feature_importances_))
+        feature_importance = dict(zip([design.feature_names[j] for j in features], rf.feature_importances_))
         importance[column] = feature_importance
-    
-    return importance
\ No newline at end of file
+
+        if max_samples is not None:
+            # 95% half-width of the mean importance across trees, the widest over all features
+            tree_importances = np.array([tree.feature_importances_ for tree in rf.estimators_])
+            standard_error = tree_importances.std(axis=0, ddof=1) / np.sqrt(len(rf.estimators_))
+            importance_error[column] = float(1.96 * standard_error.max())
+
+    approximation = None
+    if max_samples is not None:
+        approximation = approximation_info(design.n_rows, max_samples, "bootstrap sample per tree",
+                                           importance_error=importance_error)
+    return importance, approximation
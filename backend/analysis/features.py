@@ -0,0 +1,179 @@
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from .worker_pool import SharedArrays
+
+# Below this many cells the one-hot block is densified, sparse input is much slower for
+# tree ensembles and BLAS; above it memory scales with the number of non-zeros instead
+DENSE_CELL_LIMIT = int(os.environ.get("DESIGN_MATRIX_DENSE_CELL_LIMIT", 50_000_000))
+
+def sparse_columns(df):
+    # Columns preprocessing keeps as pandas sparse arrays, e.g. one-hot encoded categories
+    return [column for column in df.columns if isinstance(df[column].dtype, pd.SparseDtype)]
+
+def dense_numeric_columns(df):
+    # Numeric columns analysed one by one; sparse indicator columns are left out, they would
+    # have to be densified and their outliers or seasonality mean nothing
+    sparse = set(sparse_columns(df))
+    return [column for column in df.select_dtypes(include=[np.number]).columns if column not in sparse]
+
+def sparse_block(df, columns):
+    # The given sparse columns as one CSC matrix, built from their non-zeros only
+    if not columns:
+        return scipy.sparse.csc_matrix((len(df), 0))
+    return df[columns].sparse.to_coo().tocsc()
+
+class AnalysisContext:
+    # Column groups and the dense numeric block, built once per request and read by every stage
+    # instead of each one scanning dtypes and copying the numeric columns again. 'values' keeps
+    # missing cells as NaN; 'standardized' is mean-imputed and scaled to unit variance with
+    # constant columns only centred, like SimpleImputer + StandardScaler.
+    def __init__(self, arrays, groups, missing):
+        self.arrays = arrays
+        # numeric (dense numbers, not boolean), sparse, boolean, categorical and datetime columns
+        self.groups = groups
+        self.missing = missing
+        self.positions = {column: i for i, column in enumerate(groups['numeric'])}
+
+    @property
+    def numeric(self):
+        return self.groups['numeric']
+
+    @property
+    def n_rows(self):
+        return self.arrays['values'].shape[0]
+
+    def _columns(self, name, columns):
+        block = self.arrays[name]
+        if columns is None or list(columns) == self.numeric:
+            return block
+        return block[:, [self.positions[column] for column in columns]]
+
+    def values(self, columns=None):
+        return self._columns('values', columns)
+
+    def standardized(self, columns=None):
+        return self._columns('standardized', columns)
+
+    def imputed(self, columns=None):
+        values = self.values(columns)
+        means = self._columns('mean', columns) if columns is not None else self.arrays['mean']
+        return np.where(np.isnan(values), means, values)
+
+    def close(self):
+        self.arrays.close()
+
+def build_analysis_context(df):
+    sparse = sparse_columns(df)
+    groups = {
+        'numeric': dense_numeric_columns(df),
+        'sparse': sparse,
+        'boolean': df.select_dtypes(include=['bool']).columns.tolist(),
+        'categorical': df.select_dtypes(include=['object', 'category']).columns.tolist(),
+        'datetime': df.select_dtypes(include=['datetime64']).columns.tolist(),
+    }
+    values = np.asfortranarray(df[groups['numeric']].to_numpy(dtype=np.float64, na_value=np.nan))
+    missing_cells = np.isnan(values)
+    with warnings.catch_warnings():
+        # All-missing columns have no mean, they are imputed with 0
+        warnings.simplefilter('ignore', RuntimeWarning)
+        means = np.nanmean(values, axis=0) if len(values) else np.zeros(values.shape[1])
+    means = np.where(np.isnan(means), 0.0, means)
+
+    standardized = np.where(missing_cells, means, values)
+    standardized -= means
+    scale = np.sqrt((standardized ** 2).mean(axis=0)) if len(values) else np.ones(values.shape[1])
+    standardized /= np.where(scale == 0, 1.0, scale)
+
+    # Missing counts of the numeric columns come from the block, sparse columns only need their
+    # stored values checked, the rest are counted once here
+    missing = dict(zip(groups['numeric'], missing_cells.sum(axis=0).tolist()))
+    for column in sparse:
+        missing[column] = int(pd.isna(df[column].array.sp_values).sum())
+    others = [column for column in df.columns if column not in missing]
+    missing.update({column: int(count) for column, count in df[others].isnull().sum().items()})
+    missing = {column: missing[column] for column in df.columns}
+
+    arrays = {'values': values, 'standardized': np.asfortranarray(standardized), 'mean': means.reshape(1, -1)}
+    return AnalysisContext(SharedArrays(arrays), groups, missing)
+
+class DesignMatrix:
+    # Numeric and boolean columns as a dense mean-imputed block; sparse columns and one-hot
+    # encoded object columns as a sparse block. Built once per request and column-sliced per
+    # target by regression and feature importance, instead of each target re-running
+    # pd.get_dummies on the whole frame.
+    def __init__(self, arrays, feature_names, targets):
+        self.arrays = arrays
+        self.feature_names = feature_names
+        # Numeric (non-boolean) columns that are analysed as targets, mapped to their feature position
+        self.targets = targets
+
+    @property
+    def n_rows(self):
+        return self.arrays['dense'].shape[0]
+
+    @property
+    def n_features(self):
+        return len(self.feature_names)
+
+    def matrix(self, dtype=np.float64):
+        dense = np.asarray(self.arrays['dense'], dtype=dtype)
+        if 'sparse_indices' not in self.arrays:
+            return dense
+        sparse = scipy.sparse.csc_matrix(
+            (np.asarray(self.arrays['sparse_data'], dtype=dtype),
+             self.arrays['sparse_indices'], self.arrays['sparse_indptr']),
+            shape=(self.n_rows, self.n_features - dense.shape[1]),
+        )
+        if self.n_rows * self.n_features <= DENSE_CELL_LIMIT:
+            return np.hstack([dense, sparse.toarray()])
+        return scipy.sparse.hstack([scipy.sparse.csc_matrix(dense), sparse], format='csc')
+
+    def close(self):
+        self.arrays.close()
+
+def build_design_matrix(df, context=None):
+    context = context if context is not None else build_analysis_context(df)
+    categorical_columns = context.groups['categorical']
+    sparse = context.groups['sparse']
+    # Sparse columns are features only, indicator columns make poor regression targets
+    target_columns = context.numeric
+    boolean = set(context.groups['boolean'])
+    dense_columns = [column for column in df.columns if column in context.positions or column in boolean]
+
+    # Numeric columns come mean-imputed from the context, boolean ones are complete
+    dense = np.empty((context.n_rows, len(dense_columns)), order='F')
+    for i, column in enumerate(dense_columns):
+        if column in boolean:
+            dense[:, i] = df[column].to_numpy(dtype=np.float64)
+    numeric_positions = [i for i, column in enumerate(dense_columns) if column not in boolean]
+    if numeric_positions:
+        dense[:, numeric_positions] = context.imputed([dense_columns[i] for i in numeric_positions])
+    arrays = {'dense': dense}
+    feature_names = list(dense_columns)
+
+    # Sparse columns keep their non-zeros, then one-hot columns in CSC form: each category's
+    # column lists the rows holding it. Categories are sorted and missing values get no column,
+    # like pd.get_dummies.
+    block = sparse_block(df, sparse)
+    data, indices, indptr = [block.data], [block.indices.astype(np.int64)], block.indptr.astype(np.int64).tolist()
+    feature_names.extend(sparse)
+    for column in categorical_columns:
+        codes, categories = pd.factorize(df[column], sort=True)
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        starts = np.searchsorted(sorted_codes, np.arange(len(categories) + 1))
+        indices.append(order[starts[0]:].astype(np.int64))
+        data.append(np.ones(len(indices[-1])))
+        indptr.extend((indptr[-1] + starts[1:] - starts[0]).tolist())
+        feature_names.extend(f"{column}_{category}" for category in categories)
+    if categorical_columns or sparse:
+        arrays['sparse_data'] = np.concatenate(data).astype(np.float64)
+        arrays['sparse_indices'] = np.concatenate(indices)
+        arrays['sparse_indptr'] = np.asarray(indptr, dtype=np.int64)
+
+    positions = {name: i for i, name in enumerate(dense_columns)}
+    targets = {column: positions[column] for column in target_columns}
+    return DesignMatrix(SharedArrays(arrays), feature_names, targets)
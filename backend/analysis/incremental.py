@@ -0,0 +1,228 @@
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from .features import dense_numeric_columns, sparse_columns
+from .outlier_detection import OUTLIER_METHOD, ZSCORE_THRESHOLD
+from .sampling import approximation_info
+from .streaming_stats import ColumnSketch, column_kind
+
+# The history is folded into a new state this many rows at a time, so sparse columns are only
+# densified a chunk at a time
+STATE_CHUNK_ROWS = int(os.environ.get("INCREMENTAL_STATE_CHUNK_ROWS", 100_000))
+# Values within this many standard deviations of the z-score threshold are remembered, so the
+# outliers can be found again after appends have moved the threshold by up to that much
+OUTLIER_WATCH_MARGIN = float(os.environ.get("OUTLIER_WATCH_MARGIN", 0.5))
+# Pipeline outputs an AnalysisState can provide, outliers only for the z-score method
+INCREMENTAL_OUTPUTS = ('summary', 'summary_approximation', 'missing_values', 'general_statistics', 'correlation_matrix', 'outliers')
+
+def _missing_counts(df):
+    # Sparse columns only need their stored values checked
+    sparse = set(sparse_columns(df))
+    counts = {}
+    for column in df.columns:
+        values = df[column].array.sp_values if column in sparse else df[column]
+        counts[column] = int(pd.isna(values).sum())
+    return counts
+
+class CorrelationStatistics:
+    # Pairwise-complete Pearson correlations from sums that add up across batches: for every pair
+    # the rows where both are present, the sums and squares of each over those rows and the cross
+    # products. Values are shifted by the first batch's means so the sums don't cancel out.
+    def __init__(self, shift):
+        k = len(shift)
+        self.shift = shift
+        self.counts = np.zeros((k, k))
+        self.sums = np.zeros((k, k))
+        self.squares = np.zeros((k, k))
+        self.products = np.zeros((k, k))
+
+    def update(self, values):
+        present = ~np.isnan(values)
+        centered = np.where(present, values - self.shift, 0.0)
+        present = present.astype(np.float64)
+        self.counts += present.T @ present
+        # sums[i, j]: column i summed over the rows where column j is present too
+        self.sums += centered.T @ present
+        self.squares += (centered * centered).T @ present
+        self.products += centered.T @ centered
+
+    def correlation(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            counts = self.counts
+            covariance = self.products - self.sums * self.sums.T / counts
+            variance = self.squares - self.sums ** 2 / counts
+            # Columns without spread over a pair's rows have no correlation, like DataFrame.corr
+            constant = variance <= 1e-12 * np.abs(self.squares)
+            variance = np.where(constant, np.nan, variance)
+            correlation = covariance / np.sqrt(variance * variance.T)
+        correlation[counts < 2] = np.nan
+        diagonal = np.diag(correlation).copy()
+        np.fill_diagonal(correlation, np.where(np.isnan(diagonal), np.nan, 1.0))
+        return np.clip(correlation, -1, 1)
+
+class OutlierWatch:
+    # Z-score outliers of one column across appends. Every value outside [lower, upper] is kept,
+    # an interval the outlier bounds must stay outside of: while they do, the outliers are among
+    # the kept values and the history is never scanned again.
+    def __init__(self):
+        self.lower = np.inf
+        self.upper = -np.inf
+        self.rows = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0)
+
+    def add(self, values, offset):
+        rows = np.flatnonzero((values < self.lower) | (values > self.upper))
+        self.rows = np.concatenate([self.rows, rows + offset])
+        self.values = np.concatenate([self.values, values[rows]])
+
+    def covers(self, lower, upper):
+        return lower <= self.lower and self.upper <= upper
+
+    def narrow(self, lower, upper):
+        # Only values outside a wider interval can be dropped, the dropped ones can't come back
+        if np.isnan(lower) or np.isnan(upper):
+            return
+        self.lower, self.upper = min(self.lower, lower), max(self.upper, upper)
+        kept = (self.values < self.lower) | (self.values > self.upper)
+        self.rows, self.values = self.rows[kept], self.values[kept]
+
+class AnalysisState:
+    # Mergeable statistics of one preprocessed dataset version: column sketches for the summary
+    # (exact moments, sketched quantiles and top values), missing counts, correlation sums and
+    # z-score outlier candidates. Appending rows costs the size of the batch, not the history.
+    def __init__(self, df, key, content_hash=None):
+        self.key = key
+        self.content_hash = content_hash
+        self.columns = list(df.columns)
+        self.rows = 0
+        sparse = sparse_columns(df)
+        self.groups = {
+            'numeric': dense_numeric_columns(df),
+            'sparse': sparse,
+            'categorical': df.select_dtypes(include=['object', 'category']).columns.tolist(),
+            'datetime': df.select_dtypes(include=['datetime64']).columns.tolist(),
+        }
+        self.correlated = [column for column in df.columns if column in set(self.groups['numeric'] + sparse)]
+        self.missing = {column: 0 for column in self.columns}
+        self.sketches = {column: ColumnSketch(column_kind(df[column])) for column in self.columns}
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            shift = np.nanmean(self._block(df, self.correlated), axis=0) if len(df) else np.zeros(len(self.correlated))
+        self.correlation = CorrelationStatistics(np.where(np.isnan(shift), 0.0, shift))
+        self.watches = {column: OutlierWatch() for column in self.groups['numeric']}
+        # False once the outlier bounds moved past what the watches kept, until reset_outliers
+        self.outliers_valid = True
+
+    @staticmethod
+    def _block(df, columns):
+        return df[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    def _accumulate(self, df):
+        self.rows += len(df)
+        for column, count in _missing_counts(df).items():
+            self.missing[column] += count
+        for column in self.columns:
+            self.sketches[column].update(df[column])
+        if self.correlated:
+            self.correlation.update(self._block(df, self.correlated))
+
+    def _bounds(self, column, threshold=ZSCORE_THRESHOLD):
+        # Population standard deviation, like detect_outliers
+        moments = self.sketches[column].moments
+        if moments.n == 0:
+            return np.nan, np.nan
+        std = np.sqrt(moments.m2 / moments.n)
+        return moments.mean - threshold * std, moments.mean + threshold * std
+
+    def reset_outliers(self, df):
+        # Rebuilds the outlier candidates from the whole preprocessed dataset
+        self.watches = {}
+        for column in self.groups['numeric']:
+            watch = OutlierWatch()
+            watch.narrow(*self._bounds(column, ZSCORE_THRESHOLD - OUTLIER_WATCH_MARGIN))
+            watch.add(df[column].to_numpy(dtype=np.float64, na_value=np.nan), 0)
+            self.watches[column] = watch
+        self.outliers_valid = True
+
+    def update(self, df):
+        if list(df.columns) != self.columns:
+            raise ValueError("The new rows were preprocessed into different columns")
+        offset = self.rows
+        self._accumulate(df)
+        if not self.outliers_valid:
+            return self
+        for column, watch in self.watches.items():
+            lower, upper = self._bounds(column)
+            if not np.isnan(lower) and not watch.covers(lower, upper):
+                self.outliers_valid = False
+                self.watches = {}
+                return self
+            watch.add(df[column].to_numpy(dtype=np.float64, na_value=np.nan), offset)
+            watch.narrow(*self._bounds(column, ZSCORE_THRESHOLD - OUTLIER_WATCH_MARGIN))
+        return self
+
+    def summary(self):
+        return {column: self.sketches[column].summary() for column in self.columns}
+
+    def summary_approximation(self):
+        # Every row is read, but quartiles and distinct counts of the summary come from sketches
+        # instead of describe() and nunique()
+        return approximation_info(self.rows, self.rows, "streaming sketches kept up to date by appends",
+                                  approximate_statistics=['25%', '50%', '75%', 'unique_values'])
+
+    def general_statistics(self):
+        # Same keys as calculate_general_statistics in data_summary.py
+        return {
+            "totalRows": self.rows,
+            "totalColumns": len(self.columns),
+            "numericColumns": len(self.groups['numeric']) + len(self.groups['sparse']),
+            "categoricalColumns": len(self.groups['categorical']),
+            "datetimeColumns": len(self.groups['datetime']),
+            "missingValues": int(sum(self.missing.values())),
+            "totalCells": self.rows * len(self.columns),
+        }
+
+    def correlation_matrix(self):
+        if len(self.correlated) < 2:
+            return None
+        return pd.DataFrame(self.correlation.correlation(), index=self.correlated, columns=self.correlated)
+
+    def outliers(self):
+        # Same result per column as detect_outliers with the z-score method
+        results = {}
+        for column, watch in self.watches.items():
+            lower, upper = self._bounds(column)
+            total = self.sketches[column].moments.n
+            flagged = (watch.values < lower) | (watch.values > upper) if total >= 2 else np.zeros(len(watch.values), dtype=bool)
+            results[column] = {
+                "method": 'zscore',
+                "indices": watch.rows[flagged].tolist(),
+                "values": watch.values[flagged].tolist(),
+                "num_outliers": int(flagged.sum()),
+                "total": int(total),
+                "lower": None if np.isnan(lower) else float(lower),
+                "upper": None if np.isnan(upper) else float(upper),
+            }
+        return results
+
+    def outputs(self, outlier_method=None):
+        # Pipeline outputs for run_pipeline's known, so their stages are not run again
+        outputs = {
+            'summary': self.summary(),
+            'summary_approximation': self.summary_approximation(),
+            'missing_values': dict(self.missing),
+            'general_statistics': self.general_statistics(),
+            'correlation_matrix': self.correlation_matrix(),
+        }
+        if (outlier_method or OUTLIER_METHOD) == 'zscore' and self.outliers_valid:
+            outputs['outliers'] = self.outliers()
+        return outputs
+
+def build_analysis_state(df, key, content_hash=None):
+    # One pass over a preprocessed dataset, a chunk at a time
+    state = AnalysisState(df.iloc[:STATE_CHUNK_ROWS], key, content_hash)
+    for start in range(0, len(df), STATE_CHUNK_ROWS):
+        state._accumulate(df.iloc[start:start + STATE_CHUNK_ROWS])
+    state.reset_outliers(df)
+    return state
@@ -1,96 +1,57 @@
-import importlib
 import time
-from multiprocessing import Pool
 import logging
+from .pipeline import run_pipeline
 
 logger = logging.getLogger(__name__)
 
-def lazy_import(module_name, function_name):
-    module = importlib.import_module(module_name)
-    return getattr(module, function_name)
-
-def analyze_data(df):
+# Sections of the analysis response, in response order
+ANALYSIS_SECTIONS = [
+    "summary", "column_types", "correlation", "top_correlations", "pca_data", "clusters", "time_series_analysis",
+    "insights", "missing_values", "recommended_visualizations", "pca_result", "pca_explained_variance",
+    "general_statistics", "outliers", "outlier_summary", "feature_importance", "regression_insights", "approximations",
+]
+# Sections sent under a different name than the pipeline output they come from
+SECTION_ALIASES = {"pca_result": "pca_data"}
+# Stages that can report an approximation: pca, clusters and feature importance run on a sample
+# of a large dataset and report its size and error bounds, the summary when it comes from sketches
+# kept up to date by appends
+APPROXIMATED_STAGES = ("pca", "clusters", "feature_importance", "summary")
+
+def section_outputs(section):
+    if section == "approximations":
+        return [f"{name}_approximation" for name in APPROXIMATED_STAGES]
+    return [SECTION_ALIASES.get(section, section)]
+
+def build_section(section, results):
+    if section == "approximations":
+        return {
+            name: results[f"{name}_approximation"]
+            for name in APPROXIMATED_STAGES
+            if results[f"{name}_approximation"] is not None
+        }
+    return results[SECTION_ALIASES.get(section, section)]
+
+def analyze_sections(df, sections, known=None, outlier_method=None):
+    # Only the stages the requested sections need, skipping those whose outputs are in known.
+    # Returns every pipeline output available afterwards, so callers can keep them for later requests.
+    targets = [output for section in sections for output in section_outputs(section)]
+    return run_pipeline(df, targets=targets, parameters={'outlier_method': outlier_method}, known=known)
+
+def analyze_data(df, include_timings=False, outlier_method=None, progress=None, cancel=None, known=None):
+    # known holds pipeline outputs available already (e.g. statistics kept up to date by appends)
     start_time = time.time()
-    
-    # Lazy imports with absolute path
-    get_summary = lazy_import('analysis.data_summary', 'get_summary')
-    get_column_types = lazy_import('analysis.data_summary', 'get_column_types')
-    calculate_general_statistics = lazy_import('analysis.data_summary', 'calculate_general_statistics')
-    get_correlation = lazy_import('analysis.correlation', 'get_correlation')
-    get_top_correlations = lazy_import('analysis.correlation', 'get_top_correlations')
-    perform_pca = lazy_import('analysis.clustering', 'perform_pca')
-    perform_clustering = lazy_import('analysis.clustering', 'perform_clustering')
-    analyze_time_series = lazy_import('analysis.time_series', 'analyze_time_series')
-    detect_outliers = lazy_import('analysis.outlier_detection', 'detect_outliers')
-    summarize_outliers = lazy_import('analysis.outlier_detection', 'summarize_outliers')
-    get_feature_importance = lazy_import('analysis.feature_importance', 'get_feature_importance')
-    perform_regression_analysis = lazy_import('analysis.regression', 'perform_regression_analysis')
-    generate_insights = lazy_import('analysis.utils', 'generate_insights')
-    recommend_visualizations = lazy_import('analysis.utils', 'recommend_visualizations')
-
-    logger.info(f"Imports took {time.time() - start_time:.2f} seconds")
-    logger.info(f"Analyzing data with columns: {df.columns.tolist()}")
-
-    def timed_execution(func, *args, **kwargs):
-        start = time.time()
-        result = func(*args, **kwargs)
-        logger.info(f"{func.__name__} took {time.time() - start:.2f} seconds")
-        return result
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Analyzing data with columns: %s", df.columns.tolist())
 
-    # Run some analyses in parallel
-    with Pool(processes=4) as pool:
-        summary_future = pool.apply_async(get_summary, (df,))
-        column_types_future = pool.apply_async(get_column_types, (df,))
-        correlation_future = pool.apply_async(get_correlation, (df,))
-        general_statistics_future = pool.apply_async(calculate_general_statistics, (df,))
-
-        summary = summary_future.get()
-        column_types = column_types_future.get()
-        correlation = correlation_future.get()
-        general_statistics = general_statistics_future.get()
-
-    top_correlations = timed_execution(get_top_correlations, correlation)
-    
-    # Only perform PCA and clustering if the dataset is not too large
-    if len(df) <= 10000:
-        pca_data, pca_explained_variance = timed_execution(perform_pca, df)
-        clusters = timed_execution(perform_clustering, df)
-    else:
-        pca_data, pca_explained_variance, clusters = None, None, None
-    
-    time_series_analysis = timed_execution(analyze_time_series, df)
-    outliers = timed_execution(detect_outliers, df)
-    outlier_summary = timed_execution(summarize_outliers, outliers)
-    
-    # Skip feature importance analysis for datasets with more than 10,000 rows
-    feature_importance = None
-    if len(df) <= 10000:
-        feature_importance = timed_execution(get_feature_importance, df)
-    
-    regression_insights = timed_execution(perform_regression_analysis, df)
-    insights = timed_execution(generate_insights, df, summary, correlation, clusters, time_series_analysis, outlier_summary, feature_importance, regression_insights)
-    missing_values = df.isnull().sum().to_dict()
-    
-    recommended_visualizations = timed_execution(recommend_visualizations, df, column_types)
+    # Independent stages run concurrently, see analysis/pipeline.py for the stage graph
+    timings = {}
+    results = run_pipeline(df, timings=timings, parameters={'outlier_method': outlier_method}, known=known,
+                           progress=progress, cancel=cancel)
 
     logger.info(f"Total analysis took {time.time() - start_time:.2f} seconds")
-    
-    return {
-        "summary": summary,
-        "column_types": column_types,
-        "correlation": correlation,
-        "top_correlations": top_correlations,
-        "pca_data": pca_data,
-        "clusters": clusters,
-        "time_series_analysis": time_series_analysis,
-        "insights": insights,
-        "missing_values": missing_values,
-        "recommended_visualizations": recommended_visualizations,
-        "pca_result": pca_data,
-        "pca_explained_variance": pca_explained_variance,
-        "general_statistics": general_statistics,
-        "outliers": outliers,
-        "outlier_summary": outlier_summary,
-        "feature_importance": feature_importance,
-        "regression_insights": regression_insights
-    }
\ No newline at end of file
+
+    response = {section: build_section(section, results) for section in ANALYSIS_SECTIONS}
+    if include_timings:
+        timings["total"] = {"wall": round(time.time() - start_time, 4)}
+        response["timings"] = timings
+    return response
@@ -1,37 +1,87 @@
+import os
+import warnings
 import numpy as np
 from sklearn.ensemble import IsolationForest
-from scipy import stats
-
-def detect_outliers(df):
-    numeric_columns = df.select_dtypes(include=[np.number]).columns
-    outliers = {}
-    for column in numeric_columns:
-        column_data = df[column].dropna()
-        
-        if column_data.isnull().any():
-            # Skip outlier detection for columns with missing values
-            outliers[column] = []
-            continue
-        
-        if len(column_data) > 1:  # Ensure we have at least 2 non-null values
-            # Use Z-score method for outlier detection
-            z_scores = np.abs(stats.zscore(column_data))
-            outliers[column] = (z_scores > 3).tolist()  # Mark as outlier if |z-score| > 3
+from .column_cache import memoize_columns
+from .features import build_analysis_context
+
+OUTLIER_METHODS = ('zscore', 'iqr', 'isolation_forest')
+OUTLIER_METHOD = os.environ.get("OUTLIER_METHOD", "zscore")
+ZSCORE_THRESHOLD = 3.0
+IQR_MULTIPLIER = 1.5
+ISOLATION_FOREST_SEED = 42
+# Share of points an isolation forest flags, 'auto' flags far too many on a single column
+ISOLATION_FOREST_CONTAMINATION = 0.01
+
+def _zscore_bounds(values):
+    # Population standard deviation, like scipy.stats.zscore
+    mean = np.nanmean(values, axis=0)
+    std = np.nanstd(values, axis=0)
+    return mean - ZSCORE_THRESHOLD * std, mean + ZSCORE_THRESHOLD * std
+
+def _iqr_bounds(values):
+    q1, q3 = np.nanpercentile(values, [25, 75], axis=0)
+    iqr = q3 - q1
+    return q1 - IQR_MULTIPLIER * iqr, q3 + IQR_MULTIPLIER * iqr
+
+def _isolation_forest_mask(values):
+    mask = np.zeros(values.shape, dtype=bool)
+    for i in range(values.shape[1]):
+        present = np.flatnonzero(~np.isnan(values[:, i]))
+        if len(present) > 1:
+            forest = IsolationForest(contamination=ISOLATION_FOREST_CONTAMINATION, random_state=ISOLATION_FOREST_SEED)
+            mask[present, i] = forest.fit_predict(values[present, i].reshape(-1, 1)) == -1
+    return mask
+
+def detect_block_outliers(values, method=OUTLIER_METHOD):
+    # values is a 2-D float block with NaN for missing cells. Returns one compact result per column:
+    # outlier row positions and values, counts, and the bounds a value had to fall outside of.
+    if method not in OUTLIER_METHODS:
+        raise ValueError(f"Unknown outlier method: {method}")
+    counts = np.count_nonzero(~np.isnan(values), axis=0)
+    with warnings.catch_warnings():
+        # All-missing columns produce NaN bounds, which compare as no outliers
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if method == 'isolation_forest':
+            mask = _isolation_forest_mask(values)
+            # Isolation forests have no value thresholds, report the range of the inliers instead
+            inliers = np.where(mask, np.nan, values)
+            lower, upper = np.nanmin(inliers, axis=0), np.nanmax(inliers, axis=0)
         else:
-            outliers[column] = []
-    
-    return outliers
+            lower, upper = _zscore_bounds(values) if method == 'zscore' else _iqr_bounds(values)
+            mask = (values < lower) | (values > upper)
+    # At least 2 non-null values are needed to call anything an outlier
+    mask[:, counts < 2] = False
+
+    results = []
+    for i in range(values.shape[1]):
+        rows = np.flatnonzero(mask[:, i])
+        results.append({
+            "method": method,
+            "indices": rows.tolist(),
+            "values": values[rows, i].tolist(),
+            "num_outliers": len(rows),
+            "total": int(counts[i]),
+            "lower": None if np.isnan(lower[i]) else float(lower[i]),
+            "upper": None if np.isnan(upper[i]) else float(upper[i]),
+        })
+    return results
+
+def detect_outliers(df, method=None, context=None):
+    method = method or OUTLIER_METHOD
+    analysis_context = context if context is not None else build_analysis_context(df)
+
+    def compute(columns):
+        return dict(zip(columns, detect_block_outliers(analysis_context.values(columns), method)))
+
+    return memoize_columns('outliers', df, analysis_context.numeric, compute, context=method)
 
 def summarize_outliers(outliers):
     summary = {}
-    for column, outlier_mask in outliers.items():
-        if outlier_mask:
-            num_outliers = sum(outlier_mask)
-            total_points = len(outlier_mask)
-            summary[column] = {
-                "num_outliers": num_outliers,
-                "percentage": (num_outliers / total_points) * 100
-            }
-        else:
-            summary[column] = {"num_outliers": 0, "percentage": 0}
-    return summary
\ No newline at end of file
+    for column, result in outliers.items():
+        num_outliers = result["num_outliers"]
+        summary[column] = {
+            "num_outliers": num_outliers,
+            "percentage": (num_outliers / result["total"]) * 100 if result["total"] else 0
+        }
+    return summary
@@ -0,0 +1,192 @@
+import importlib
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from metrics import Histogram
+from profiling import current_profile, profiled
+from .worker_pool import SharedDataset, get_pool, restart_pool, submit_stage, timed_call
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_THREADS = int(os.environ.get("ANALYSIS_THREADS", 4))
+
+STAGE_SECONDS = Histogram("analysis_stage_duration_seconds", "Wall time of analysis pipeline stages",
+                          labels=("stage", "executor"))
+STAGE_QUEUED_SECONDS = Histogram("analysis_stage_queued_seconds",
+                                 "Time analysis pipeline stages waited for a thread or pool worker", labels=("stage",))
+
+def lazy_import(module_name, function_name):
+    module = importlib.import_module(module_name)
+    return getattr(module, function_name)
+
+class Stage:
+    def __init__(self, name, module, function, inputs=('df',), outputs=None, executor='thread', temporary=False):
+        self.name = name
+        self.module = module
+        self.function = function
+        self.inputs = tuple(inputs)
+        # A stage returning a tuple declares one output per element
+        self.outputs = tuple(outputs or (name,))
+        self.executor = executor
+        # Intermediate results that hold shared resources, released when the run finishes
+        self.temporary = temporary
+
+    def load(self):
+        return lazy_import(self.module, self.function)
+
+STAGES = [
+    # Column groups and the numeric block every stage below reads, built once per run
+    Stage('context', 'analysis.features', 'build_analysis_context', temporary=True),
+    Stage('summary', 'analysis.data_summary', 'summarize', inputs=['df', 'context'], outputs=['summary', 'summary_approximation']),
+    Stage('column_types', 'analysis.data_summary', 'get_column_types'),
+    Stage('general_statistics', 'analysis.data_summary', 'calculate_general_statistics', inputs=['df', 'context']),
+    Stage('missing_values', 'analysis.data_summary', 'get_missing_values', inputs=['df', 'context']),
+    Stage('correlation_matrix', 'analysis.correlation', 'compute_correlation_matrix', inputs=['df', 'context']),
+    Stage('correlation', 'analysis.correlation', 'correlation_to_dict', inputs=['correlation_matrix']),
+    Stage('top_correlations', 'analysis.correlation', 'get_top_correlations', inputs=['correlation_matrix']),
+    Stage('outliers', 'analysis.outlier_detection', 'detect_outliers', inputs=['df', 'outlier_method', 'context']),
+    Stage('outlier_summary', 'analysis.outlier_detection', 'summarize_outliers', inputs=['outliers']),
+    Stage('pca', 'analysis.clustering', 'perform_pca', inputs=['df', 'context'],
+          outputs=['pca_data', 'pca_explained_variance', 'pca_approximation'], executor='process'),
+    Stage('clusters', 'analysis.clustering', 'perform_clustering', inputs=['df', 'context'],
+          outputs=['clusters', 'clusters_approximation'], executor='process'),
+    Stage('time_series_analysis', 'analysis.time_series', 'analyze_time_series', inputs=['df', 'context'],
+          executor='process'),
+    Stage('design_matrix', 'analysis.features', 'build_design_matrix', inputs=['df', 'context'], temporary=True),
+    Stage('feature_importance', 'analysis.feature_importance', 'get_feature_importance',
+          inputs=['df', 'design_matrix'], outputs=['feature_importance', 'feature_importance_approximation'],
+          executor='process'),
+    Stage('regression_insights', 'analysis.regression', 'perform_regression_analysis',
+          inputs=['df', 'design_matrix'], executor='process'),
+    Stage('insights', 'analysis.utils', 'generate_insights',
+          inputs=['df', 'summary', 'top_correlations', 'clusters', 'time_series_analysis', 'outlier_summary',
+                  'feature_importance', 'regression_insights', 'pca_approximation', 'clusters_approximation',
+                  'feature_importance_approximation']),
+    Stage('recommended_visualizations', 'analysis.utils', 'recommend_visualizations', inputs=['df', 'column_types']),
+]
+
+STAGES_BY_OUTPUT = {output: stage for stage in STAGES for output in stage.outputs}
+
+def resolve_stages(targets=None, known=()):
+    # Every stage producing a target plus everything it transitively depends on, in registry order.
+    # Stages whose outputs are all known already are left out.
+    def missing(stage):
+        return not all(output in known for output in stage.outputs)
+
+    if targets is None:
+        return [stage for stage in STAGES if missing(stage)]
+    needed = set()
+    pending = [STAGES_BY_OUTPUT[target] for target in targets if target not in known]
+    while pending:
+        stage = pending.pop()
+        if stage.name in needed:
+            continue
+        needed.add(stage.name)
+        pending.extend(STAGES_BY_OUTPUT[name] for name in stage.inputs if name in STAGES_BY_OUTPUT and name not in known)
+    return [stage for stage in STAGES if stage.name in needed]
+
+# Request parameters stages can take as inputs, None when the caller does not set them
+PARAMETERS = ('outlier_method',)
+
+def run_pipeline(df, targets=None, timings=None, parameters=None, known=None, progress=None, cancel=None):
+    # known holds outputs computed earlier (e.g. cached sections), their stages are not run again.
+    # progress(stage_name, completed, total) is called as stages finish; setting the cancel event
+    # stops new stages from starting and raises CancelledError once the running ones finish.
+    known = known or {}
+    stages = resolve_stages(targets, known)
+    results = {'df': df, **known}
+    for name in PARAMETERS:
+        results[name] = (parameters or {}).get(name)
+    if timings is None:
+        timings = {}
+
+    use_pool = get_pool() is not None and any(stage.executor == 'process' for stage in stages)
+    dataset = SharedDataset(df) if use_pool else None
+    waiting = list(stages)
+    running = {}
+    # Stages of a profiled request are profiled in their threads and pool workers too
+    request_profile = current_profile()
+    # Cleared when the pool breaks during this run, its remaining stages then run on threads
+    pool_usable = dataset is not None
+
+    def start(stage, threads):
+        nonlocal pool_usable
+        if stage.executor == 'process' and pool_usable:
+            args = [results[name] for name in stage.inputs if name != 'df']
+            profile_path = request_profile.worker_path() if request_profile is not None else None
+            try:
+                return submit_stage(stage.load(), dataset, *args, profile_path=profile_path), 'process'
+            except BrokenProcessPool:
+                pool_usable = False
+                restart_pool()
+        args = [results[name] for name in stage.inputs]
+        return threads.submit(profiled(timed_call), stage.load(), args, {}, time.thread_time), 'thread'
+
+    try:
+        with ThreadPoolExecutor(max_workers=ANALYSIS_THREADS) as threads:
+            while waiting or running:
+                if cancel is not None and cancel.is_set():
+                    raise CancelledError("Analysis cancelled")
+                ready = [stage for stage in waiting if all(name in results for name in stage.inputs)]
+                if not ready and not running:
+                    raise RuntimeError(f"Unsatisfiable analysis stages: {[stage.name for stage in waiting]}")
+
+                # Start every stage whose inputs are all available
+                for stage in ready:
+                    waiting.remove(stage)
+                    future, executor = start(stage, threads)
+                    running[future] = (stage, time.perf_counter(), executor)
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, submitted, executor = running.pop(future)
+                    try:
+                        result, wall, cpu = future.result()
+                    except BrokenProcessPool:
+                        # A worker died, failing every stage the pool was running: the pool is
+                        # replaced for later requests and the stage runs again on a thread
+                        logger.warning(f"Analysis pool broke while running {stage.name}, running it on a thread")
+                        pool_usable = False
+                        restart_pool()
+                        retry, executor = start(stage, threads)
+                        running[retry] = (stage, time.perf_counter(), executor)
+                        continue
+                    elapsed = time.perf_counter() - submitted
+                    if len(stage.outputs) == 1:
+                        results[stage.name] = result
+                    else:
+                        results.update(zip(stage.outputs, result))
+                    timings[stage.name] = {
+                        "wall": round(wall, 4),
+                        "cpu": round(cpu, 4),
+                        "queued": round(max(elapsed - wall, 0.0), 4),
+                        "executor": executor,
+                    }
+                    STAGE_SECONDS.observe(wall, stage=stage.name, executor=executor)
+                    STAGE_QUEUED_SECONDS.observe(max(elapsed - wall, 0.0), stage=stage.name)
+                    logger.debug("%s took %.2fs wall, %.2fs CPU", stage.name, wall, cpu)
+                    if progress is not None:
+                        progress(stage.name, len(stages) - len(waiting) - len(running), len(stages))
+    except Exception:
+        # Stages already handed to a worker can't be cancelled, they still read the shared files
+        # released below, so wait for them first
+        wait([future for future in running if not future.cancel()])
+        raise
+    finally:
+        if dataset is not None:
+            dataset.close()
+        for stage in stages:
+            if stage.temporary and results.get(stage.name) is not None:
+                results[stage.name].close()
+
+    del results['df']
+    for name in PARAMETERS:
+        del results[name]
+    for stage in stages:
+        if stage.temporary:
+            results.pop(stage.name, None)
+    return results
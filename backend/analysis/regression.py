@@ -1,32 +1,71 @@
-import pandas as pd
 import numpy as np
+import scipy.sparse
 from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import r2_score, mean_squared_error
+from .features import build_design_matrix
+
+# Ridge term that keeps the correlation matrix invertible when one-hot columns are collinear;
+# as it goes to zero the solution approaches the minimum-norm least squares fit (in standardized
+# units)
+RIDGE = 1e-9
+
+def perform_regression_analysis(df, design=None):
+    design = design if design is not None else build_design_matrix(df)
+    if not design.targets or design.n_rows < 2:
+        return {}
+
+    X = design.matrix()
+    train_rows, test_rows = train_test_split(np.arange(design.n_rows), test_size=0.2, random_state=42)
+    X_train, X_test = X[train_rows], X[test_rows]
+
+    # Regressing each column on all the others can be read off one inverse correlation matrix:
+    # standardized coefficient j for target k is -P[j, k] / P[k, k]. One decomposition solves
+    # every target. Columns are scaled to unit variance first, so the ridge term weighs the same
+    # on every column whatever its units.
+    mean = np.asarray(X_train.mean(axis=0)).ravel()
+    gram = X_train.T @ X_train
+    if scipy.sparse.issparse(gram):
+        gram = gram.toarray()
+    covariance = gram - len(train_rows) * np.outer(mean, mean)
+    scale = np.sqrt(np.maximum(np.diag(covariance), 0.0))
+    # Constant columns drop out of the fit; below this the variance is rounding error of the
+    # uncentered sums
+    scale[scale <= np.sqrt(np.finfo(float).eps * np.abs(np.diag(gram)))] = 0.0
+    safe_scale = np.where(scale > 0, scale, 1.0)
+    correlation = covariance / np.outer(safe_scale, safe_scale)
+    correlation[scale == 0, :] = 0.0
+    correlation[:, scale == 0] = 0.0
+    eigenvalues, eigenvectors = np.linalg.eigh(correlation)
+    precision_cols = (eigenvectors / (np.maximum(eigenvalues, 0.0) + RIDGE)) @ eigenvectors[list(design.targets.values())].T
+
+    target_names = list(design.targets.keys())
+    target_positions = np.array(list(design.targets.values()))
+    targets = np.arange(len(target_positions))
+    # Back from standardized units: coefficient j for target k times sd(k) / sd(j)
+    coefficients = -precision_cols / precision_cols[target_positions, targets]
+    coefficients *= scale[target_positions] / safe_scale[:, None]
+    coefficients[scale == 0, :] = 0.0
+    coefficients[target_positions, targets] = 0.0
+    intercepts = mean[target_positions] - mean @ coefficients
+
+    predictions = np.asarray(X_test @ coefficients) + intercepts
+    y_test = X_test[:, target_positions]
+    y_test = y_test.toarray() if scipy.sparse.issparse(y_test) else np.asarray(y_test)
+    residual_ss = ((y_test - predictions) ** 2).sum(axis=0)
+    total_ss = ((y_test - y_test.mean(axis=0)) ** 2).sum(axis=0)
+    mse = residual_ss / len(test_rows)
 
-def perform_regression_analysis(df):
-    numeric_columns = df.select_dtypes(include=[np.number]).columns
-    categorical_columns = df.select_dtypes(include=['object']).columns
     insights = {}
-    
-    for target in numeric_columns:
-        X = df.drop(columns=[target])
-        y = df[target]
-        
-        # Handle categorical features
-        X_encoded = pd.get_dummies(X, columns=categorical_columns)
-        
-        X_train, X_test, y_train, y_test = train_test_split(X_encoded, y, test_size=0.2, random_state=42)
-        model = LinearRegression()
-        model.fit(X_train, y_train)
-        y_pred = model.predict(X_test)
-        r2 = r2_score(y_test, y_pred)
-        mse = mean_squared_error(y_test, y_pred)
-        
+    for i, target in enumerate(target_names):
+        # Same convention as sklearn's r2_score for a constant test target
+        if total_ss[i] > 0:
+            r2 = 1 - residual_ss[i] / total_ss[i]
+        else:
+            r2 = 1.0 if residual_ss[i] == 0 else 0.0
+        features = [j for j in range(design.n_features) if j != target_positions[i]]
         insights[target] = {
-            "r2_score": r2,
-            "mse": mse,
-            "coefficients": dict(zip(X_encoded.columns, model.coef_))
+            "r2_score": float(r2),
+            "mse": float(mse[i]),
+            "coefficients": dict(zip([design.feature_names[j] for j in features], coefficients[features, i].tolist()))
         }
     
-    return insights
\ No newline at end of file
+    return insights
@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Above this many rows PCA and clustering run on a sample of this size instead of every row
+APPROXIMATE_SAMPLE_SIZE = int(os.environ.get("APPROXIMATE_SAMPLE_SIZE", 10000))
+# Categorical columns with at most this many categories can be used to stratify the sample
+MAX_STRATA = 50
+SAMPLE_SEED = 42
+
+def needs_sampling(df):
+    return len(df) > APPROXIMATE_SAMPLE_SIZE
+
+def _stratify_column(df):
+    for column in df.select_dtypes(include=['object', 'category']).columns:
+        if 1 < df[column].nunique() <= MAX_STRATA:
+            return column
+    return None
+
+def sample_rows(df, size=APPROXIMATE_SAMPLE_SIZE):
+    # Deterministic, so PCA and clustering pick the same rows and their outputs line up
+    rng = np.random.default_rng(SAMPLE_SEED)
+    n = len(df)
+    if n <= size:
+        return np.arange(n), "full"
+
+    column = _stratify_column(df)
+    if column is None:
+        return np.sort(rng.choice(n, size=size, replace=False)), "uniform"
+
+    # Proportional allocation across the categories of the stratifying column
+    codes, _ = pd.factorize(df[column])
+    strata = np.unique(codes)
+    counts = np.array([np.count_nonzero(codes == stratum) for stratum in strata])
+    allocation = np.maximum(np.floor(counts * size / n).astype(int), 1)
+    allocation = np.minimum(allocation, counts)
+    rows = [rng.choice(np.flatnonzero(codes == stratum), size=take, replace=False)
+            for stratum, take in zip(strata, allocation)]
+    return np.sort(np.concatenate(rows)), f"stratified on {column}"
+
+def approximation_info(total_rows, sample_size, method, sample_rows=None, **error_bounds):
+    info = {"total_rows": int(total_rows), "sample_size": int(sample_size), "method": method}
+    if sample_rows is not None:
+        info["sample_rows"] = sample_rows.tolist()
+    info.update(error_bounds)
+    return info
+
+def proportion_error_bounds(labels, total_rows, z=1.96):
+    # 95% half-widths for each label's share of all rows, with the finite population correction
+    sample_size = len(labels)
+    values, counts = np.unique(labels, return_counts=True)
+    shares = counts / sample_size
+    correction = np.sqrt(max(1 - sample_size / total_rows, 0.0))
+    half_widths = z * np.sqrt(shares * (1 - shares) / sample_size) * correction
+    return {str(value): {"share": float(share), "error": float(error)}
+            for value, share, error in zip(values, shares, half_widths)}
@@ -0,0 +1,390 @@
+import numpy as np
+import pandas as pd
+
+# Single-pass, mergeable summaries: every accumulator can be updated chunk by chunk and two
+# accumulators built on different chunks (or in different workers) can be merged.
+
+class MomentSketch:
+    # Count, mean and central moment sums up to the fourth, merged with Pebay's pairwise formulas
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        batch = MomentSketch()
+        batch.n = len(values)
+        batch.mean = float(values.mean())
+        centered = values - batch.mean
+        squared = centered * centered
+        batch.m2 = float(squared.sum())
+        batch.m3 = float((squared * centered).sum())
+        batch.m4 = float((squared * squared).sum())
+        batch.min = float(values.min())
+        batch.max = float(values.max())
+        self.merge(batch)
+
+    @classmethod
+    def from_block(cls, values):
+        # One sketch per column of a 2-D block (NaN for missing), the sums of every column taken at once
+        present = ~np.isnan(values)
+        n = present.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(present, values, 0.0).sum(axis=0) / n
+        centered = np.where(present, values - means, 0.0)
+        squared = centered * centered
+        m2, m3, m4 = squared.sum(axis=0), (squared * centered).sum(axis=0), (squared * squared).sum(axis=0)
+        minima = np.where(present, values, np.inf).min(axis=0, initial=np.inf)
+        maxima = np.where(present, values, -np.inf).max(axis=0, initial=-np.inf)
+        sketches = []
+        for i in range(values.shape[1]):
+            sketch = cls()
+            if n[i]:
+                sketch.n, sketch.mean = int(n[i]), float(means[i])
+                sketch.m2, sketch.m3, sketch.m4 = float(m2[i]), float(m3[i]), float(m4[i])
+                sketch.min, sketch.max = float(minima[i]), float(maxima[i])
+            sketches.append(sketch)
+        return sketches
+
+    def merge(self, other):
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.__dict__.update(other.__dict__)
+            return
+        na, nb = self.n, other.n
+        n = na + nb
+        delta = other.mean - self.mean
+        delta_n = delta / n
+        m2 = self.m2 + other.m2 + delta * delta_n * na * nb
+        m3 = (self.m3 + other.m3 + delta * delta_n * delta_n * na * nb * (na - nb)
+              + 3 * delta_n * (na * other.m2 - nb * self.m2))
+        m4 = (self.m4 + other.m4
+              + delta * delta_n ** 3 * na * nb * (na * na - na * nb + nb * nb)
+              + 6 * delta_n ** 2 * (na * na * other.m2 + nb * nb * self.m2)
+              + 4 * delta_n * (na * other.m3 - nb * self.m3))
+        self.n, self.mean, self.m2, self.m3, self.m4 = n, self.mean + delta_n * nb, m2, m3, m4
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def std(self):
+        return float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else np.nan
+
+    def skewness(self):
+        # Adjusted Fisher-Pearson coefficient, the estimator pandas' skew() uses
+        n = self.n
+        if n < 3:
+            return np.nan
+        if self.m2 == 0:
+            return 0.0
+        g1 = np.sqrt(n) * self.m3 / self.m2 ** 1.5
+        return float(g1 * np.sqrt(n * (n - 1)) / (n - 2))
+
+    def kurtosis(self):
+        # Bias-corrected excess kurtosis, the estimator pandas' kurtosis() uses
+        n = self.n
+        if n < 4:
+            return np.nan
+        if self.m2 == 0:
+            return 0.0
+        g2 = n * self.m4 / self.m2 ** 2 - 3
+        return float(((n + 1) * g2 + 6) * (n - 1) / ((n - 2) * (n - 3)))
+
+class QuantileSketch:
+    # KLL-style compactor hierarchy: level i holds items that each stand for 2**i values.
+    # A full level is sorted and every other item (random offset) is promoted to the next one.
+    def __init__(self, capacity=256, seed=0):
+        self.capacity = capacity
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    @classmethod
+    def exact(cls, values):
+        # Every value kept uncompacted, for data already in memory: the quantiles are exact
+        values = values[~np.isnan(values)]
+        sketch = cls(capacity=max(len(values), 1))
+        sketch.levels[0] = values
+        return sketch
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity:
+                items = np.sort(items)
+                kept = items[len(items) - len(items) % 2:]
+                promoted = items[self._rng.integers(2):len(items) - len(items) % 2:2]
+                self.levels[level] = kept
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantiles(self, qs):
+        if len(self.levels) == 1:
+            # Nothing compacted yet, the answer is exact
+            if len(self.levels[0]) == 0:
+                return [np.nan for _ in qs]
+            return np.quantile(self.levels[0], qs).tolist()
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2.0 ** level) for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items)
+        items, cumulative = items[order], np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+        return items[np.minimum(positions, len(items) - 1)].tolist()
+
+class HyperLogLog:
+    # Distinct hashes are also kept exactly until there are more than exact_limit of them,
+    # so low-cardinality columns report exact counts
+    def __init__(self, precision=14, exact_limit=4096):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+        self.exact_limit = exact_limit
+        self.exact = np.empty(0, dtype=np.uint64)
+
+    def update(self, values):
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_array(np.asarray(values))
+        if self.exact is not None:
+            self.exact = np.unique(np.concatenate([self.exact, hashes]))
+            if len(self.exact) > self.exact_limit:
+                self.exact = None
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        remaining_bits = 64 - self.precision
+        remainder = hashes & np.uint64((1 << remaining_bits) - 1)
+        # Position of the leftmost set bit in the remaining bits (all zeros ranks remaining_bits + 1)
+        bit_length = np.where(remainder > 0, np.floor(np.log2(np.maximum(remainder, 1).astype(np.float64))) + 1, 0)
+        rank = (remaining_bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        if self.exact is not None and other.exact is not None:
+            self.exact = np.union1d(self.exact, other.exact)
+            if len(self.exact) > self.exact_limit:
+                self.exact = None
+        else:
+            self.exact = None
+
+    def estimate(self):
+        if self.exact is not None:
+            return float(len(self.exact))
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(2.0 ** -self.registers.astype(np.float64))
+        zeros = np.count_nonzero(self.registers == 0)
+        if raw <= 2.5 * m and zeros > 0:
+            # Linear counting is more accurate for small cardinalities
+            return float(m * np.log(m / zeros))
+        return float(raw)
+
+class SpaceSaving:
+    # Approximate top-K counts. Keys missing from a full summary may have been seen up to
+    # `floor` times, which is what merging charges them.
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.float64)
+        self.floor = 0.0
+
+    def update(self, values):
+        chunk_counts = pd.Series(values).value_counts()
+        # Categorical values count their unused categories too
+        chunk_counts = chunk_counts[chunk_counts > 0]
+        chunk = SpaceSaving(self.capacity)
+        chunk.counts = chunk_counts.head(self.capacity).astype(np.float64)
+        if len(chunk_counts) > self.capacity:
+            chunk.floor = float(chunk_counts.iloc[self.capacity])
+        self.merge(chunk)
+
+    def merge(self, other):
+        keys = self.counts.index.union(other.counts.index)
+        combined = (self.counts.reindex(keys, fill_value=self.floor)
+                    + other.counts.reindex(keys, fill_value=other.floor))
+        combined = combined.sort_values(ascending=False, kind='stable')
+        if len(combined) > self.capacity:
+            self.floor = max(float(combined.iloc[self.capacity]), self.floor + other.floor)
+            combined = combined.head(self.capacity)
+        else:
+            self.floor = self.floor + other.floor
+        self.counts = combined
+
+    def top(self, k):
+        return {key: int(count) for key, count in self.counts.head(k).items()}
+
+class ColumnSketch:
+    # distinct_limit: distinct values counted exactly before the HyperLogLog estimate takes over
+    def __init__(self, kind, distinct_limit=4096):
+        self.kind = kind
+        self.missing = 0
+        if kind == 'numerical':
+            self.moments = MomentSketch()
+            self.quantiles = QuantileSketch()
+        elif kind == 'datetime':
+            self.min = None
+            self.max = None
+        else:
+            self.count = 0
+            self.distinct = HyperLogLog(exact_limit=distinct_limit)
+            self.top_values = SpaceSaving()
+
+    def __setstate__(self, state):
+        # Categorical sketches stored before their values were counted can't clamp the estimate
+        if state['kind'] == 'categorical':
+            state.setdefault('count', np.inf)
+        self.__dict__.update(state)
+
+    def update(self, series):
+        self.missing += int(series.isnull().sum())
+        if self.kind == 'numerical':
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            self.moments.update(values)
+            self.quantiles.update(values)
+        elif self.kind == 'datetime':
+            series = series.dropna()
+            if len(series):
+                self.min = series.min() if self.min is None else min(self.min, series.min())
+                self.max = series.max() if self.max is None else max(self.max, series.max())
+        else:
+            values = series.dropna()
+            self.count += len(values)
+            self.distinct.update(values.to_numpy())
+            self.top_values.update(values)
+
+    def merge(self, other):
+        self.missing += other.missing
+        if self.kind == 'numerical':
+            self.moments.merge(other.moments)
+            self.quantiles.merge(other.quantiles)
+        elif self.kind == 'datetime':
+            for value in (other.min, other.max):
+                if value is not None:
+                    self.min = value if self.min is None else min(self.min, value)
+                    self.max = value if self.max is None else max(self.max, value)
+        else:
+            self.count += other.count
+            self.distinct.merge(other.distinct)
+            self.top_values.merge(other.top_values)
+
+    def summary(self):
+        # Same keys as get_summary in data_summary.py
+        if self.kind == 'numerical':
+            q25, q50, q75 = self.quantiles.quantiles([0.25, 0.5, 0.75])
+            moments = self.moments
+            empty = moments.n == 0
+            return {
+                'type': 'numerical',
+                'count': float(moments.n),
+                'mean': np.nan if empty else moments.mean,
+                'std': moments.std(),
+                'min': np.nan if empty else moments.min,
+                '25%': q25,
+                '50%': q50,
+                '75%': q75,
+                'max': np.nan if empty else moments.max,
+                'skewness': moments.skewness(),
+                'kurtosis': moments.kurtosis(),
+            }
+        if self.kind == 'datetime':
+            return {
+                'type': 'datetime',
+                'min': self.min.isoformat() if self.min is not None else None,
+                'max': self.max.isoformat() if self.max is not None else None,
+            }
+        # The estimate can exceed the number of values it counted
+        unique_values = int(round(self.distinct.estimate()))
+        return {
+            'type': 'categorical',
+            'unique_values': min(unique_values, self.count),
+            'top_values': self.top_values.top(5),
+        }
+
+def block_sketches(values, columns):
+    # Numeric sketches of the columns of a 2-D block already in memory (rows x columns, NaN for
+    # missing): moments of every column in one vectorized pass and exact quantiles
+    moments = MomentSketch.from_block(values)
+    missing = np.isnan(values).sum(axis=0)
+    sketches = {}
+    for i, column in enumerate(columns):
+        sketch = ColumnSketch('numerical')
+        sketch.missing = int(missing[i])
+        sketch.moments = moments[i]
+        sketch.quantiles = QuantileSketch.exact(values[:, i])
+        sketches[column] = sketch
+    return sketches
+
+def column_kind(series):
+    if pd.api.types.is_bool_dtype(series):
+        return 'categorical'
+    if pd.api.types.is_numeric_dtype(series):
+        return 'numerical'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime'
+    return 'categorical'
+
+class StreamingSummary:
+    def __init__(self):
+        self.rows = 0
+        self.columns = {}
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        for column in chunk.columns:
+            if column not in self.columns:
+                self.columns[column] = ColumnSketch(column_kind(chunk[column]))
+            self.columns[column].update(chunk[column])
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        for column, sketch in other.columns.items():
+            if column in self.columns:
+                self.columns[column].merge(sketch)
+            else:
+                self.columns[column] = sketch
+        return self
+
+    def summary(self):
+        return {column: sketch.summary() for column, sketch in self.columns.items()}
+
+    def missing_values(self):
+        return {column: sketch.missing for column, sketch in self.columns.items()}
+
+    def general_statistics(self):
+        # Same keys as calculate_general_statistics in data_summary.py
+        kinds = [sketch.kind for sketch in self.columns.values()]
+        missing_values = sum(self.missing_values().values())
+        return {
+            "totalRows": self.rows,
+            "totalColumns": len(self.columns),
+            "numericColumns": kinds.count('numerical'),
+            "categoricalColumns": kinds.count('categorical'),
+            "datetimeColumns": kinds.count('datetime'),
+            "missingValues": int(missing_values),
+            "totalCells": self.rows * len(self.columns)
+        }
+
+def summarize_chunks(chunks):
+    summary = StreamingSummary()
+    for chunk in chunks:
+        summary.update(chunk)
+    return summary
@@ -1,28 +1,243 @@
+import logging
+import os
+import warnings
 import numpy as np
-from statsmodels.tsa.seasonal import seasonal_decompose
+from statsmodels.tsa.adfvalues import mackinnonp
 from statsmodels.tsa.stattools import adfuller
+from .column_cache import column_fingerprint, memoize_columns
+from .features import build_analysis_context
 
-def analyze_time_series(df):
-    date_columns = df.select_dtypes(include=['datetime64']).columns
+logger = logging.getLogger(__name__)
+
+# "auto" detects each column's seasonal period from its autocorrelation, a number forces one
+TIME_SERIES_PERIOD = os.environ.get("TIME_SERIES_PERIOD", "auto")
+# Used when no period stands out, the value the decomposition was hard-coded to before
+TIME_SERIES_DEFAULT_PERIOD = 30
+TIME_SERIES_MAX_PERIOD = int(os.environ.get("TIME_SERIES_MAX_PERIOD", 366))
+# Autocorrelation a peak needs to count as a season
+TIME_SERIES_MIN_AUTOCORRELATION = 0.3
+# Peaks within this share of the strongest one are harmonics, the shortest of them is the period
+TIME_SERIES_PEAK_TOLERANCE = 0.9
+# Cells of the lagged ADF designs built at once, wide blocks are tested a slice of columns at a time
+ADF_BLOCK_CELLS = int(os.environ.get("ADF_BLOCK_CELLS", 1 << 24))
+# Relative size below which a diagonal entry of R marks an ADF design as rank deficient
+ADF_RANK_TOLERANCE = 1e-10
+
+def autocorrelation(values, max_lag):
+    # Biased autocorrelation of every column of a 2-D block up to max_lag, through one FFT.
+    # A linear trend is removed first, otherwise it dominates every lag.
+    n = len(values)
+    t = np.arange(n) - (n - 1) / 2
+    centered = values - values.mean(axis=0)
+    slope = (t @ centered) / (t @ t) if n > 1 else np.zeros(values.shape[1])
+    detrended = centered - np.outer(t, slope)
+    size = 1 << int(np.ceil(np.log2(2 * n)))
+    spectrum = np.fft.rfft(detrended, n=size, axis=0)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum), n=size, axis=0)[:max_lag + 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return acf / acf[0]
+
+def detect_periods(values):
+    # One period per column: the shortest lag among the strongest autocorrelation peaks,
+    # the default when there are none. Two full periods must fit in the series.
+    n = len(values)
+    default = min(TIME_SERIES_DEFAULT_PERIOD, n // 2)
+    max_lag = min(TIME_SERIES_MAX_PERIOD, n // 2)
+    periods = np.full(values.shape[1], default)
+    if max_lag < 3:
+        return periods
+    acf = autocorrelation(values, max_lag + 1)
+    # Local maxima at lags 2..max_lag
+    inner = acf[2:max_lag + 1]
+    peaks = (inner > acf[1:max_lag]) & (inner >= acf[3:max_lag + 2]) & (inner >= TIME_SERIES_MIN_AUTOCORRELATION)
+    heights = np.where(peaks, inner, -np.inf)
+    strongest = heights.max(axis=0)
+    candidates = peaks & (heights >= TIME_SERIES_PEAK_TOLERANCE * strongest)
+    found = candidates.any(axis=0)
+    periods[found] = np.argmax(candidates[:, found], axis=0) + 2
+    return periods
+
+def moving_average_trend(values, period):
+    # The centred moving average seasonal_decompose uses (a 2 x period one for even periods),
+    # for all columns at once from cumulative sums. The half period at either end is NaN.
+    n = len(values)
+    half = period // 2
+    trend = np.full(values.shape, np.nan)
+    if n <= 2 * half:
+        return trend
+    sums = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+    centers = np.arange(half, n - half)
+    if period % 2:
+        trend[centers] = (sums[centers + half + 1] - sums[centers - half]) / period
+    else:
+        inner = sums[centers + half] - sums[centers - half + 1]
+        trend[centers] = (inner + 0.5 * (values[centers - half] + values[centers + half])) / period
+    return trend
+
+def decompose_block(values, period):
+    # Additive decomposition of every column, matching statsmodels' seasonal_decompose
+    n = len(values)
+    trend = moving_average_trend(values, period)
+    detrended = values - trend
+    cycles = -(-n // period)
+    padded = np.full((cycles * period, values.shape[1]), np.nan)
+    padded[:n] = detrended
+    with np.errstate(invalid='ignore'):
+        seasonal_means = np.nanmean(padded.reshape(cycles, period, -1), axis=0)
+    seasonal_means -= seasonal_means.mean(axis=0)
+    seasonal = np.tile(seasonal_means, (cycles, 1))[:n]
+    return trend, seasonal, detrended - seasonal
+
+def _lagged_design(values, lags):
+    # The ADF regression of every column with a constant, the lagged level and `lags` lagged
+    # differences, on the observations all of them are defined for. The level comes last.
+    differences = np.diff(values, axis=0)
+    nobs = len(differences) - lags
+    columns = [np.ones((nobs, values.shape[1]))]
+    columns += [differences[lags - lag:len(differences) - lag] for lag in range(1, lags + 1)]
+    columns.append(values[lags:lags + nobs])
+    # (columns of the block, observations, regressors)
+    return np.stack(columns, axis=-1).transpose(1, 0, 2), differences[lags:].T
+
+def _adf_columns(values):
+    # Augmented Dickey-Fuller tests with a constant and AIC lag selection, as adfuller runs them,
+    # for all columns at once. Nested lag models share one batched QR: the residual sum of
+    # squares of the first p regressors is what the first p entries of Q'y leave unexplained.
+    # Columns whose design is rank deficient go through adfuller one by one.
+    n, k = values.shape
+    statistics = np.full(k, np.nan)
+    pvalues = np.full(k, np.nan)
+    errors = {}
+    max_lag = min(n // 2 - 2, int(np.ceil(12.0 * np.power(n / 100.0, 1 / 4.0))))
+    if max_lag < 0:
+        return statistics, pvalues, {i: "Sample size is too short for an ADF test" for i in range(k)}
+    constant = values.max(axis=0) == values.min(axis=0)
+    for i in np.flatnonzero(constant):
+        errors[i] = "Invalid input, x is constant"
+    if constant.all():
+        return statistics, pvalues, errors
+
+    design, target = _lagged_design(values[:, ~constant], max_lag)
+    # adfuller orders the candidates constant, level, lag 1, lag 2, ...
+    design = np.concatenate([design[:, :, :1], design[:, :, -1:], design[:, :, 1:-1]], axis=2)
+    q, r = np.linalg.qr(design)
+    explained = np.cumsum(np.einsum('knp,kn->kp', q, target) ** 2, axis=1)
+    rss = np.maximum((target ** 2).sum(axis=1)[:, None] - explained[:, 1:], np.finfo(float).tiny)
+    nobs = target.shape[1]
+    aic = nobs * np.log(rss / nobs) + 2 * np.arange(2, max_lag + 3)
+    best_lags = np.argmin(aic, axis=1)
+    diagonal = np.abs(np.diagonal(r, axis1=1, axis2=2))
+    deficient = diagonal.min(axis=1) <= ADF_RANK_TOLERANCE * diagonal.max(axis=1)
+
+    positions = np.flatnonzero(~constant)
+    for lags in np.unique(best_lags):
+        group = np.flatnonzero((best_lags == lags) & ~deficient)
+        if len(group) == 0:
+            continue
+        design, target = _lagged_design(values[:, positions[group]], int(lags))
+        q, r = np.linalg.qr(design)
+        projected = np.einsum('knp,kn->kp', q, target)
+        dof = target.shape[1] - design.shape[2]
+        scale = np.sqrt(((target ** 2).sum(axis=1) - (projected ** 2).sum(axis=1)) / dof)
+        # With the level as the last regressor its t-value only needs the last entries of R and Q'y
+        statistics[positions[group]] = np.sign(r[:, -1, -1]) * projected[:, -1] / scale
+    for i in positions[deficient]:
+        try:
+            statistics[i] = adfuller(values[:, i])[0]
+        except Exception as e:
+            errors[i] = str(e)
+    for i in np.flatnonzero(~np.isnan(statistics)):
+        pvalues[i] = mackinnonp(statistics[i], regression='c', N=1)
+    return statistics, pvalues, errors
+
+def adf_test_block(values):
+    # Returns ADF statistics and p-values per column, NaN where the test failed, and
+    # {column position: error message} for those
+    n, k = values.shape
+    lags = int(np.ceil(12.0 * np.power(n / 100.0, 1 / 4.0)))
+    step = max(1, ADF_BLOCK_CELLS // max(1, n * (lags + 2)))
+    statistics, pvalues, errors = np.full(k, np.nan), np.full(k, np.nan), {}
+    for start in range(0, k, step):
+        chunk_statistics, chunk_pvalues, chunk_errors = _adf_columns(values[:, start:start + step])
+        statistics[start:start + step] = chunk_statistics
+        pvalues[start:start + step] = chunk_pvalues
+        errors.update({start + i: error for i, error in chunk_errors.items()})
+    return statistics, pvalues, errors
+
+def decompose_columns(values, columns, period=None):
+    # values is a 2-D float block in date order. Columns that can't be decomposed get an
+    # "error" entry instead of disappearing from the result.
+    results = {}
+    n = len(values)
+    with warnings.catch_warnings():
+        # All-missing columns have no mean, they are reported below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        means = np.nanmean(values, axis=0)
+    filled = np.where(np.isnan(values), means, values)
+
+    valid = []
+    for i, column in enumerate(columns):
+        if np.isnan(means[i]):
+            results[column] = {"error": "Column has no values"}
+        elif n < 4:
+            results[column] = {"error": f"Too few rows ({n}) for a time series decomposition"}
+        else:
+            valid.append(i)
+    if not valid:
+        return {column: results[column] for column in columns}
+
+    if period is None:
+        periods = detect_periods(filled[:, valid])
+    else:
+        periods = np.full(len(valid), min(int(period), n // 2))
+    decomposed = {}
+    for group_period in np.unique(periods):
+        group = [valid[j] for j in np.flatnonzero(periods == group_period)]
+        if group_period < 2:
+            for i in group:
+                results[columns[i]] = {"error": f"Too few rows ({n}) for a period of {int(group_period)}"}
+            continue
+        trend, seasonal, residual = decompose_block(filled[:, group], int(group_period))
+        for j, i in enumerate(group):
+            decomposed[i] = (int(group_period), trend[:, j], seasonal[:, j], residual[:, j])
+
+    order = sorted(decomposed)
+    statistics, pvalues, adf_errors = adf_test_block(filled[:, order])
+    for j, i in enumerate(order):
+        column_period, trend, seasonal, residual = decomposed[i]
+        results[columns[i]] = {
+            'trend': trend.tolist(),
+            'seasonal': seasonal.tolist(),
+            'residual': residual.tolist(),
+            'period': column_period,
+            'adf_statistic': None if np.isnan(statistics[j]) else float(statistics[j]),
+            'adf_pvalue': None if np.isnan(pvalues[j]) else float(pvalues[j]),
+        }
+        if j in adf_errors:
+            results[columns[i]]['error'] = f"ADF test failed: {adf_errors[j]}"
+    for column, result in results.items():
+        if 'error' in result:
+            logger.warning(f"Time series analysis of {column}: {result['error']}")
+    return {column: results[column] for column in columns}
+
+def analyze_time_series(df, context=None):
+    analysis_context = context if context is not None else build_analysis_context(df)
+    date_columns = analysis_context.groups['datetime']
     if len(date_columns) > 0:
         date_column = date_columns[0]
-        df = df.sort_values(by=date_column)
-        numeric_columns = df.select_dtypes(include=[np.number]).columns
-        results = {}
-        for column in numeric_columns:
-            try:
-                series = df[column].fillna(df[column].mean())
-                decomposition = seasonal_decompose(series, model='additive', period=30)
-                adf_result = adfuller(series)
-                results[column] = {
-                    'trend': decomposition.trend.tolist(),
-                    'seasonal': decomposition.seasonal.tolist(),
-                    'residual': decomposition.resid.tolist(),
-                    'adf_statistic': adf_result[0],
-                    'adf_pvalue': adf_result[1],
-                    'dates': df[date_column].dt.strftime('%Y-%m-%d').tolist()
-                }
-            except:
-                pass
-        return results
-    return None
\ No newline at end of file
+        # Rows in date order, missing dates last
+        order = np.argsort(df[date_column].to_numpy(), kind='stable')
+        period = None if TIME_SERIES_PERIOD == "auto" else int(TIME_SERIES_PERIOD)
+
+        def compute(columns):
+            values = analysis_context.values(columns)[order]
+            return decompose_columns(values, list(columns), period)
+
+        # The decomposition depends on the row order, so the date column is part of the key. The
+        # cached entries leave out the dates, every column shares them and they are added here.
+        key_context = f"{TIME_SERIES_PERIOD}-{column_fingerprint(df[date_column])}"
+        results = memoize_columns('time_series', df, analysis_context.numeric, compute, context=key_context)
+        dates = df[date_column].iloc[order].dt.strftime('%Y-%m-%d').tolist()
+        return {column: {**result, 'dates': dates} if 'trend' in result else result
+                for column, result in results.items()}
+    return None
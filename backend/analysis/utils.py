@@ -1,6 +1,5 @@
-import pandas as pd
-
-def generate_insights(df, summary, correlation, clusters, time_series_analysis, outliers, feature_importance, regression_insights):
+def generate_insights(df, summary, top_correlations, clusters, time_series_analysis, outliers, feature_importance, regression_insights,
+                      pca_approximation=None, clusters_approximation=None, feature_importance_approximation=None):
     insights = []
     
     # Basic statistics insights
@@ -16,8 +15,8 @@ def generate_insights(df, summary, correlation, clusters, time_series_analysis,
             insights.append(f"In the {column} category, '{top_category}' is dominant, representing {percentage:.2f}% of the data. This imbalance might affect analysis and modeling.")
     
     # Correlation insights
-    if correlation:
-        strong_correlations = [(col1, col2, corr) for col1, col2, corr in get_top_correlations(correlation) if abs(corr) > 0.7]
+    if top_correlations:
+        strong_correlations = [(col1, col2, corr) for col1, col2, corr in top_correlations if abs(corr) > 0.7]
         for col1, col2, corr in strong_correlations:
             insights.append(f"There is a strong {'positive' if corr > 0 else 'negative'} correlation ({corr:.2f}) between {col1} and {col2}. This relationship might be key for predictive modeling or understanding data dynamics.")
     
@@ -25,20 +24,24 @@ def generate_insights(df, summary, correlation, clusters, time_series_analysis,
     if clusters is not None:
         n_clusters = len(set(clusters))
         insights.append(f"The data exhibits {n_clusters} distinct clusters, suggesting natural groupings or segments within your dataset. Further analysis of these clusters could reveal important patterns or customer segments.")
+        if clusters_approximation is not None:
+            insights.append(f"Clustering and PCA were computed on a sample of {clusters_approximation['sample_size']:,} of {clusters_approximation['total_rows']:,} rows ({clusters_approximation['method']}). Cluster shares are accurate to within {max(share['error'] for share in clusters_approximation['cluster_shares'].values()) * 100:.2f} percentage points.")
     
     # Time series insights
     if time_series_analysis:
         for column, analysis in time_series_analysis.items():
+            if analysis.get('adf_pvalue') is None:
+                continue
             if analysis['adf_pvalue'] < 0.05:
                 insights.append(f"The time series for {column} is stationary, making it suitable for various forecasting models. Consider using ARIMA or exponential smoothing methods for predictions.")
             else:
                 insights.append(f"The time series for {column} is non-stationary. Consider differencing or transforming the data before applying time series models.")
     
     # Outlier insights
-    for column, outlier_labels in outliers.items():
-        outlier_count = sum(1 for label in outlier_labels if label == -1)
+    for column, outlier_stats in outliers.items():
+        outlier_count = outlier_stats['num_outliers']
         if outlier_count > 0:
-            percentage = (outlier_count / len(outlier_labels)) * 100
+            percentage = outlier_stats['percentage']
             insights.append(f"{column} contains {outlier_count} potential outliers ({percentage:.2f}% of the data). These outliers might represent anomalies, errors, or interesting edge cases worth investigating.")
     
     # Feature importance insights
@@ -47,8 +50,8 @@ def generate_insights(df, summary, correlation, clusters, time_series_analysis,
             top_features = sorted(importances.items(), key=lambda x: x[1], reverse=True)[:3]
             features_str = ", ".join([f"{feature} ({importance:.3f})" for feature, importance in top_features])
             insights.append(f"For predicting {target}, the most important features are: {features_str}. Focus on these features for feature engineering or when building predictive models.")
-    else:
-        insights.append("Feature importance analysis was skipped due to the large size of the dataset (over 10,000 rows). This helps to ensure faster processing times for large datasets.")
+        if feature_importance_approximation is not None:
+            insights.append(f"Feature importances were estimated with trees fit on samples of {feature_importance_approximation['sample_size']:,} of {feature_importance_approximation['total_rows']:,} rows. Importances within {max(feature_importance_approximation['importance_error'].values(), default=0):.3f} of each other should be treated as equal.")
     
     # Regression insights
     if regression_insights:
@@ -79,15 +82,3 @@ def recommend_visualizations(df, column_types):
         recommendations.append(('Numerical', 'Correlation Heatmap'))
     
     return recommendations
-
-def get_top_correlations(correlation_matrix, n=5):
-    if not correlation_matrix:
-        return []
-    correlation_matrix = pd.DataFrame(correlation_matrix)
-    
-    corr_pairs = []
-    for i in range(len(correlation_matrix.columns)):
-        for j in range(i+1, len(correlation_matrix.columns)):
-            corr_pairs.append((correlation_matrix.index[i], correlation_matrix.columns[j], correlation_matrix.iloc[i, j]))
-    
-    return sorted(corr_pairs, key=lambda x: abs(x[2]), reverse=True)[:n]
\ No newline at end of file
@@ -0,0 +1,186 @@
+import cProfile
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import scipy.sparse
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_POOL_WORKERS = int(os.environ.get("ANALYSIS_POOL_WORKERS", min(os.cpu_count() or 4, 8)))
+# Datasets are handed to workers as memory-mapped Arrow files, /dev/shm keeps them in RAM
+SPILL_DIRECTORY = os.environ.get(
+    "ANALYSIS_SPILL_DIRECTORY", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+PRELOAD_MODULES = ['analysis.worker_pool', 'pandas', 'sklearn.ensemble', 'statsmodels.tsa.seasonal']
+
+_pool = None
+_pool_lock = threading.Lock()
+
+POOL_WORKERS = Gauge("analysis_pool_workers", "Processes in the analysis pool")
+# Submitted and not finished, so anything above the worker count is waiting in the queue
+POOL_PENDING_STAGES = Gauge("analysis_pool_pending_stages", "Stages submitted to the analysis pool and not yet finished")
+
+def start_pool(processes=None):
+    global _pool
+    if _pool is None:
+        processes = processes or ANALYSIS_POOL_WORKERS
+        # Workers are forked from a clean server process, not from the threaded web server
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(PRELOAD_MODULES)
+        else:
+            context = multiprocessing.get_context('spawn')
+        _pool = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+        POOL_WORKERS.set(processes)
+        logger.info(f"Started analysis pool with {processes} workers")
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        POOL_WORKERS.set(0)
+        logger.info("Analysis pool shut down")
+
+def get_pool():
+    return _pool
+
+def restart_pool():
+    # A worker that died (e.g. killed for memory) breaks the whole executor and every later submit
+    # fails, so a broken pool is replaced. Several requests can notice the same broken pool, only
+    # the first one restarts it.
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool._broken:
+            processes = _pool._max_workers
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+            logger.warning("Analysis pool broke, restarting it")
+            start_pool(processes)
+    return _pool
+
+class SharedDataset:
+    # Writes the DataFrame once so every stage maps the same file instead of receiving a pickled copy.
+    # Arrow has no sparse columns, those are written next to it as one CSC matrix.
+    def __init__(self, df):
+        self.path = os.path.join(SPILL_DIRECTORY, f"analysis-{uuid.uuid4().hex}.arrow")
+        self.sparse_path = f"{self.path}.sparse.npz"
+        sparse = [column for column in df.columns if isinstance(df[column].dtype, pd.SparseDtype)]
+        table = pa.Table.from_pandas(df.drop(columns=sparse), preserve_index=False)
+        if sparse:
+            block = df[sparse].sparse.to_coo().tocsc()
+            np.savez(self.sparse_path, data=block.data, indices=block.indices, indptr=block.indptr, shape=block.shape)
+            table = table.replace_schema_metadata({
+                **(table.schema.metadata or {}),
+                b"sparse_columns": json.dumps(sparse).encode('utf-8'),
+                b"column_order": json.dumps(list(df.columns)).encode('utf-8'),
+            })
+        with pa.OSFile(self.path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    def close(self):
+        for path in (self.path, self.sparse_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class SharedArrays:
+    # NumPy arrays that are spilled to .npy files the first time they are pickled for a worker.
+    # The worker side unpickles them as read-only memory maps, so N stages cost one write.
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self._paths = None
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __getstate__(self):
+        with self._lock:
+            if self._paths is None:
+                prefix = os.path.join(SPILL_DIRECTORY, f"arrays-{uuid.uuid4().hex}")
+                self._paths = {}
+                for name, array in self.arrays.items():
+                    self._paths[name] = f"{prefix}-{name}.npy"
+                    np.save(self._paths[name], array)
+        return {"paths": self._paths}
+
+    def __setstate__(self, state):
+        self._paths = state["paths"]
+        self._lock = threading.Lock()
+        self.arrays = {name: np.load(path, mmap_mode='r') for name, path in self._paths.items()}
+
+    def close(self):
+        for path in (self._paths or {}).values():
+            if os.path.exists(path):
+                os.remove(path)
+
+# Each worker keeps the most recently mapped dataset, stages of one request usually share it
+_worker_dataset = (None, None)
+
+def _load_shared_dataset(path):
+    global _worker_dataset
+    cached_path, df = _worker_dataset
+    if cached_path != path:
+        with pa.memory_map(path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        df = table.to_pandas()
+        metadata = table.schema.metadata or {}
+        if b"sparse_columns" in metadata:
+            with np.load(f"{path}.sparse.npz") as saved:
+                block = scipy.sparse.csc_matrix((saved['data'], saved['indices'], saved['indptr']), shape=tuple(saved['shape']))
+            sparse = pd.DataFrame.sparse.from_spmatrix(block, columns=json.loads(metadata[b"sparse_columns"]))
+            df = pd.concat([df, sparse], axis=1)[json.loads(metadata[b"column_order"])]
+        _worker_dataset = (path, df)
+    return df
+
+def timed_call(func, args, kwargs, cpu_clock=time.process_time):
+    start_wall = time.perf_counter()
+    start_cpu = cpu_clock()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start_wall, cpu_clock() - start_cpu
+
+def _run_stage(module_name, function_name, dataset_path, args, kwargs, profile_path=None):
+    func = getattr(importlib.import_module(module_name), function_name)
+    profiler = cProfile.Profile() if profile_path else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        df = _load_shared_dataset(dataset_path)
+        result = func(df, *args, **kwargs)
+        return result, time.perf_counter() - start_wall, time.process_time() - start_cpu
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+
+def submit_stage(func, dataset, *args, profile_path=None, **kwargs):
+    # Resolves to (result, wall seconds, CPU seconds) measured inside the worker. With a
+    # profile_path the worker profiles the stage and dumps its stats there.
+    future = _pool.submit(_run_stage, func.__module__, func.__name__, dataset.path, args, kwargs, profile_path)
+    POOL_PENDING_STAGES.inc()
+    future.add_done_callback(lambda _: POOL_PENDING_STAGES.dec())
+    return future
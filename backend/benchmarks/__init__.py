@@ -0,0 +1,3 @@
+from .datasets import make_dataset, preprocessing_options, write_dataset
+
+__all__ = ['make_dataset', 'preprocessing_options', 'write_dataset']
@@ -0,0 +1,83 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+BACKEND_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Time the analysis stages and endpoints on synthetic datasets.")
+    parser.add_argument("--rows", default="1000,10000,100000", help="comma-separated row counts")
+    parser.add_argument("--numeric", type=int, default=10, help="numeric columns")
+    parser.add_argument("--categorical", type=int, default=3, help="categorical columns")
+    parser.add_argument("--datetime", type=int, default=1, help="datetime columns")
+    parser.add_argument("--cardinality", type=int, default=20, help="categories per categorical column")
+    parser.add_argument("--missing-rate", type=float, default=0.05, help="share of missing cells")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per benchmark, the median is reported")
+    parser.add_argument("--benchmarks", help="comma-separated subset of benchmarks to run")
+    parser.add_argument("--no-endpoints", action="store_true", help="skip the /upload and /preprocess benchmarks")
+    parser.add_argument("--output", help="write the report as JSON, e.g. to save a new baseline")
+    parser.add_argument("--baseline", help="report to compare against; exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown as a fraction of the baseline")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25, help="allowed peak memory growth")
+    parser.add_argument("--work-directory", help="where datasets, uploads and caches go (default: a temporary one)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    work_directory = os.path.abspath(args.work_directory or tempfile.mkdtemp(prefix="benchmarks-"))
+    os.makedirs(work_directory, exist_ok=True)
+
+    # Uploads and caches are relative to the working directory; caching is off so every call
+    # does the full work. Set before the backend modules are imported (with the harness), they
+    # read both on import.
+    os.chdir(work_directory)
+    for name in ("RESULT_CACHE_MEMORY_BYTES", "RESULT_CACHE_DISK_BYTES", "COLUMN_CACHE_MEMORY_BYTES",
+                 "COLUMN_CACHE_DISK_BYTES"):
+        os.environ.setdefault(name, "0")
+    if BACKEND_DIRECTORY not in sys.path:
+        sys.path.insert(0, BACKEND_DIRECTORY)
+
+    from .harness import compare_to_baseline, format_report, run_benchmarks
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("benchmarks").setLevel(logging.INFO)
+
+    dataset = {
+        "numeric_columns": args.numeric,
+        "categorical_columns": args.categorical,
+        "datetime_columns": args.datetime,
+        "cardinality": args.cardinality,
+        "missing_rate": args.missing_rate,
+        "seed": args.seed,
+    }
+    sizes = [int(rows) for rows in args.rows.split(",")]
+    benchmarks = args.benchmarks.split(",") if args.benchmarks else None
+    try:
+        report = run_benchmarks(sizes, work_directory, dataset=dataset, repeat=args.repeat, benchmarks=benchmarks,
+                                endpoints=not args.no_endpoints)
+    finally:
+        if not args.work_directory:
+            os.chdir(BACKEND_DIRECTORY)
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    regressions = []
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance, args.memory_tolerance)
+        report["regressions"] = regressions
+    print(format_report(report, regressions))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
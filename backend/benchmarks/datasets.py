@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+# Numeric columns are mixtures of a few shared factors, so correlation, regression and feature
+# importance have structure to find, plus a weekly season for the time series analysis
+LATENT_FACTORS = 3
+SEASONAL_PERIOD = 7
+
+def make_dataset(rows, numeric_columns=10, categorical_columns=3, datetime_columns=1, cardinality=20,
+                 missing_rate=0.05, seed=0):
+    # The same arguments always give the same frame. The first datetime column is a complete
+    # index at one-minute steps (daily steps run past pandas' timestamp range after about 95,000
+    # rows), the others are random timestamps. Categories follow a Zipf-like skew.
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for i in range(datetime_columns):
+        if i == 0:
+            columns["date"] = pd.date_range("2000-01-01", periods=rows, freq="min")
+        else:
+            offsets = rng.integers(0, 20 * 365 * 24 * 3600, rows)
+            columns[f"time_{i}"] = pd.Timestamp("2000-01-01") + pd.to_timedelta(np.sort(offsets), unit="s")
+
+    factors = rng.normal(size=(rows, LATENT_FACTORS))
+    season = np.sin(2 * np.pi * np.arange(rows) / SEASONAL_PERIOD)
+    for i in range(numeric_columns):
+        weights = rng.normal(size=LATENT_FACTORS)
+        values = factors @ weights + rng.normal(scale=0.5, size=rows) + (i % 2) * season
+        columns[f"num_{i}"] = np.round(values * 10 ** (i % 3), 3)
+
+    weights = 1.0 / np.arange(1, cardinality + 1)
+    weights /= weights.sum()
+    for i in range(categorical_columns):
+        labels = np.array([f"c{i}_{k}" for k in range(cardinality)], dtype=object)
+        columns[f"cat_{i}"] = labels[rng.choice(cardinality, size=rows, p=weights)]
+
+    df = pd.DataFrame(columns)
+    if missing_rate > 0:
+        for column in df.columns:
+            if column == "date":
+                continue
+            missing = rng.random(rows) < missing_rate
+            df[column] = df[column].mask(missing)
+    return df
+
+def write_dataset(df, path):
+    # Written the way users upload them: a CSV of text, parsed on upload
+    df.to_csv(path, index=False, date_format="%Y-%m-%d %H:%M:%S")
+    return path
+
+def preprocessing_options(df):
+    # Mean fill and standardization for numbers, one-hot encoding for categories
+    options = {}
+    for column in df.columns:
+        numeric = pd.api.types.is_numeric_dtype(df[column])
+        categorical = not numeric and not pd.api.types.is_datetime64_any_dtype(df[column])
+        options[column] = {
+            "include": True,
+            "fillMethod": "mean" if numeric else "none",
+            "scaling": "standardization" if numeric else "none",
+            "encoding": "one-hot" if categorical else "none",
+            "binning": "none",
+        }
+    return {"columnOptions": options}
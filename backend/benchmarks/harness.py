@@ -0,0 +1,236 @@
+import logging
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import sklearn
+import analysis.column_cache
+from analysis.aggregation import build_category_index, group_by
+from analysis.data_summary import get_summary
+from analysis.downsampling import axis_values
+from analysis.feature_importance import get_feature_importance
+from analysis.pipeline import run_pipeline
+from analysis.regression import perform_regression_analysis
+from analysis.time_series import analyze_time_series
+from data_processor import ingest_file, preprocess_data
+from result_cache import ResultCache
+from schema_inference import apply_schema, infer_schema
+from .datasets import make_dataset, preprocessing_options, write_dataset
+
+logger = logging.getLogger(__name__)
+
+# Stages timed on their own, in this process
+STAGE_BENCHMARKS = ('upload_parsing', 'preprocess_data', 'summary', 'regression', 'feature_importance',
+                    'time_series', 'pipeline', 'pipeline_cold_cache', 'wide_pipeline', 'wide_pipeline_cold_cache',
+                    'group_by')
+ENDPOINT_BENCHMARKS = ('endpoint_upload', 'endpoint_preprocess')
+# Slowdowns smaller than this many seconds are noise, whatever the ratio
+MIN_REGRESSION_SECONDS = 0.01
+# Budgets of the column cache in pipeline_cold_cache, its defaults: the run itself turns caching off
+COLD_CACHE_MEMORY_BYTES = 128 * 1024 * 1024
+COLD_CACHE_DISK_BYTES = 1024 * 1024 * 1024
+# The wide_ benchmarks run on a frame of this many numeric columns and a tenth of the rows
+WIDE_NUMERIC_COLUMNS = 1000
+WIDE_ROWS_DIVISOR = 10
+# The stages whose per-column results the column cache holds; feature importance fits a forest
+# per column and would take hours on the wide frame
+WIDE_PIPELINE_TARGETS = ['summary', 'outliers', 'time_series_analysis']
+
+def measure(func, repeat, setup=None):
+    # Median and fastest wall time over `repeat` calls, then one more call under tracemalloc for
+    # the peak of Python and NumPy allocations (kept out of the timed calls, it slows them down).
+    # setup runs once, untimed, before the first call.
+    if setup is not None:
+        setup()
+    walls, cpus = [], []
+    for _ in range(repeat):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        func()
+        walls.append(time.perf_counter() - start_wall)
+        cpus.append(time.process_time() - start_cpu)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "wall": round(statistics.median(walls), 6),
+        "min_wall": round(min(walls), 6),
+        "cpu": round(statistics.median(cpus), 6),
+        "peak_memory": int(peak),
+    }
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+    }
+
+def _cold_cache_pipeline(preprocessed, directory, targets=None):
+    # The pipeline writing every per-column result to an empty column cache, as the first analysis
+    # of a new upload does with caching on
+    cache_directory = tempfile.mkdtemp(prefix="cold-cache-", dir=directory)
+    saved = analysis.column_cache.column_cache
+    analysis.column_cache.column_cache = ResultCache(cache_directory, COLD_CACHE_MEMORY_BYTES, COLD_CACHE_DISK_BYTES,
+                                                     name="column")
+    try:
+        run_pipeline(preprocessed, targets=targets)
+    finally:
+        analysis.column_cache.column_cache = saved
+        shutil.rmtree(cache_directory, ignore_errors=True)
+
+def _wide_frame(rows, dataset):
+    # The preprocessed wide frame, with the dtypes an upload is stored with
+    df = make_dataset(max(1, rows // WIDE_ROWS_DIVISOR), **{**dataset, "numeric_columns": WIDE_NUMERIC_COLUMNS})
+    df = apply_schema(df, infer_schema(df))
+    return preprocess_data(df, preprocessing_options(df))
+
+def _stage_benchmarks(rows, df, source_path, dataset, selected):
+    # {benchmark name: callable} for one dataset
+    options = preprocessing_options(df)
+    # Built only for the wide_ benchmarks, and before any of them is timed
+    wide = _wide_frame(rows, dataset) if any(name.startswith('wide_') for name in selected) else None
+    directory = os.path.dirname(source_path)
+    preprocessed = preprocess_data(df, options)
+    target_path = os.path.join(directory, f"ingested-{rows}.csv")
+    # A first group-by query: the category index of one column, then counts, means and boxes of a
+    # numeric column per category
+    by = df.select_dtypes(include=['category', 'object']).columns[:1]
+    numeric = df.select_dtypes(include=[np.number]).columns
+    values = axis_values(df[numeric[0]])[0] if len(numeric) else None
+    aggregations = ('count', 'mean', 'box') if values is not None else ('count',)
+    return {
+        'upload_parsing': lambda: ingest_file(source_path, target_path),
+        'preprocess_data': lambda: preprocess_data(df, options),
+        'summary': lambda: get_summary(preprocessed),
+        'regression': lambda: perform_regression_analysis(preprocessed),
+        'feature_importance': lambda: get_feature_importance(preprocessed),
+        'time_series': lambda: analyze_time_series(preprocessed),
+        'pipeline': lambda: run_pipeline(preprocessed),
+        'pipeline_cold_cache': lambda: _cold_cache_pipeline(preprocessed, directory),
+        'wide_pipeline': lambda: run_pipeline(wide, targets=WIDE_PIPELINE_TARGETS),
+        'wide_pipeline_cold_cache': lambda: _cold_cache_pipeline(wide, directory, targets=WIDE_PIPELINE_TARGETS),
+        'group_by': lambda: group_by([build_category_index(df[column]) for column in by], rows, values, aggregations),
+    }
+
+def _pipeline_stage_timings(df):
+    # Every pipeline stage as the pipeline itself times it, for one run
+    timings = {}
+    run_pipeline(preprocess_data(df, preprocessing_options(df)), timings=timings)
+    return {stage: timing["wall"] for stage, timing in timings.items()}
+
+def _endpoint_benchmarks(client, df, source_path):
+    # {benchmark name: (setup or None, callable)}, preprocess uploads the file it reads as its setup
+    filename = os.path.basename(source_path)
+    options = preprocessing_options(df)
+
+    def upload():
+        with open(source_path, "rb") as f:
+            response = client.post('/upload', files={'file': (filename, f)})
+        response.raise_for_status()
+
+    def preprocess():
+        response = client.post('/preprocess', json={'filename': filename, 'options': options})
+        response.raise_for_status()
+
+    return {'endpoint_upload': (None, upload), 'endpoint_preprocess': (upload, preprocess)}
+
+def scaling_exponents(results):
+    # Slope of log time against log rows: about 1 for linear stages, 2 for quadratic ones
+    exponents = {}
+    for name, by_rows in results.items():
+        points = sorted((int(rows), timing["wall"]) for rows, timing in by_rows.items() if timing["wall"] > 0)
+        if len(points) >= 2:
+            rows, walls = np.log([point[0] for point in points]), np.log([point[1] for point in points])
+            exponents[name] = round(float(np.polyfit(rows, walls, 1)[0]), 3)
+    return exponents
+
+def run_benchmarks(sizes, work_directory, dataset=None, repeat=3, benchmarks=None, endpoints=True):
+    # Times each selected benchmark on one synthetic dataset per row count. Returns a
+    # JSON-serializable report that compare_to_baseline can check a later run against.
+    dataset = dataset or {}
+    selected = set(benchmarks or STAGE_BENCHMARKS + ENDPOINT_BENCHMARKS)
+    unknown = selected - set(STAGE_BENCHMARKS + ENDPOINT_BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {sorted(unknown)}")
+    results = {}
+    pipeline_stages = {}
+    datasets = {}
+    for rows in sizes:
+        df = make_dataset(rows, **dataset)
+        source_path = write_dataset(df, os.path.join(work_directory, f"synthetic-{rows}.csv"))
+        # Stages see the dtypes an upload is stored with
+        df = apply_schema(df, infer_schema(df))
+        datasets[rows] = (df, source_path)
+        stages = _stage_benchmarks(rows, df, source_path, dataset, selected)
+        for name in STAGE_BENCHMARKS:
+            if name in selected:
+                logger.info(f"Benchmarking {name} on {rows} rows")
+                results.setdefault(name, {})[str(rows)] = measure(stages[name], repeat)
+        if 'pipeline' in selected:
+            pipeline_stages[str(rows)] = _pipeline_stage_timings(df)
+
+    if endpoints and selected & set(ENDPOINT_BENCHMARKS):
+        # Through the app as the frontend calls it, with the worker pool running
+        from fastapi.testclient import TestClient
+        from main import app
+        with TestClient(app) as client:
+            for rows, (df, source_path) in datasets.items():
+                calls = _endpoint_benchmarks(client, df, source_path)
+                for name in ENDPOINT_BENCHMARKS:
+                    if name in selected:
+                        logger.info(f"Benchmarking {name} on {rows} rows")
+                        setup, call = calls[name]
+                        results.setdefault(name, {})[str(rows)] = measure(call, repeat, setup)
+
+    return {
+        "environment": environment(),
+        "config": {"sizes": list(sizes), "repeat": repeat, "dataset": dataset},
+        "results": results,
+        "pipeline_stages": pipeline_stages,
+        "scaling": scaling_exponents(results),
+    }
+
+def compare_to_baseline(report, baseline, tolerance=0.25, memory_tolerance=0.25):
+    # Benchmarks measured in both reports whose median time or peak memory grew by more than
+    # the tolerance (a fraction of the baseline). Returns one dict per regression.
+    regressions = []
+    for name, by_rows in report["results"].items():
+        for rows, timing in by_rows.items():
+            base = baseline.get("results", {}).get(name, {}).get(rows)
+            if base is None:
+                continue
+            if (timing["wall"] > base["wall"] * (1 + tolerance)
+                    and timing["wall"] - base["wall"] > MIN_REGRESSION_SECONDS):
+                regressions.append({"benchmark": name, "rows": int(rows), "metric": "wall",
+                                    "baseline": base["wall"], "current": timing["wall"],
+                                    "ratio": round(timing["wall"] / base["wall"], 3)})
+            if base.get("peak_memory") and timing["peak_memory"] > base["peak_memory"] * (1 + memory_tolerance):
+                regressions.append({"benchmark": name, "rows": int(rows), "metric": "peak_memory",
+                                    "baseline": base["peak_memory"], "current": timing["peak_memory"],
+                                    "ratio": round(timing["peak_memory"] / base["peak_memory"], 3)})
+    return regressions
+
+def format_report(report, regressions=None):
+    lines = [f"{'benchmark':<26}{'rows':>10}{'wall s':>12}{'cpu s':>12}{'peak MiB':>12}"]
+    for name, by_rows in report["results"].items():
+        for rows, timing in sorted(by_rows.items(), key=lambda item: int(item[0])):
+            lines.append(f"{name:<26}{rows:>10}{timing['wall']:>12.4f}{timing['cpu']:>12.4f}"
+                         f"{timing['peak_memory'] / 2**20:>12.1f}")
+    if report["scaling"]:
+        lines.append("")
+        lines.append("scaling exponents: " + ", ".join(f"{name} {exponent}" for name, exponent in report["scaling"].items()))
+    for regression in regressions or []:
+        lines.append(f"REGRESSION {regression['benchmark']} at {regression['rows']} rows: {regression['metric']} "
+                     f"{regression['baseline']} -> {regression['current']} ({regression['ratio']}x)")
+    return "\n".join(lines)
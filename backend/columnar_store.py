@@ -0,0 +1,244 @@
+import glob
+import json
+import os
+import pickle
+import logging
+from contextlib import ExitStack
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_SUFFIX = ".arrow"
+SCHEMA_SUFFIX = ".schema.json"
+SKETCH_SUFFIX = ".sketch.pkl"
+PLANS_SUFFIX = ".plans.pkl"
+STATES_SUFFIX = ".states.pkl"
+# Appended rows go to segment files next to the columnar copy; past this many they are merged
+# back into one file, so reads don't open ever more of them
+COLUMNAR_MAX_SEGMENTS = int(os.environ.get("COLUMNAR_MAX_SEGMENTS", 32))
+
+def columnar_path(file_path):
+    return file_path + COLUMNAR_SUFFIX
+
+def schema_path(file_path):
+    return file_path + SCHEMA_SUFFIX
+
+def sketch_path(file_path):
+    return file_path + SKETCH_SUFFIX
+
+def plans_path(file_path):
+    return file_path + PLANS_SUFFIX
+
+def states_path(file_path):
+    return file_path + STATES_SUFFIX
+
+def segment_path(file_path, segment):
+    return f"{columnar_path(file_path)}.{segment}"
+
+def _remove_segments(file_path):
+    for path in glob.glob(glob.escape(columnar_path(file_path)) + ".*"):
+        if path.rsplit(".", 1)[1].isdigit():
+            os.remove(path)
+
+def has_columnar_copy(file_path):
+    return os.path.exists(columnar_path(file_path)) and os.path.exists(schema_path(file_path))
+
+def _to_arrow_table(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type object columns (e.g. ints and strings) can't be typed by Arrow,
+        # store them as strings and keep missing values as nulls
+        df = df.copy()
+        for column in df.select_dtypes(include=['object']).columns:
+            if pd.api.types.infer_dtype(df[column], skipna=True) not in ('string', 'empty'):
+                df[column] = df[column].where(df[column].isnull(), df[column].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+def write_schema(file_path, arrow_schema, dtypes, num_rows, **extra):
+    schema = {
+        "num_rows": num_rows,
+        "columns": arrow_schema.names,
+        "dtypes": dtypes,
+        "arrow_types": {field.name: str(field.type) for field in arrow_schema},
+    }
+    schema.update(extra)
+    with open(schema_path(file_path), "w") as f:
+        json.dump(schema, f)
+    return schema
+
+class ColumnarWriter:
+    # Writes Arrow record batches to a temporary file and moves it into place on close,
+    # so readers never see a half-written columnar copy
+    def __init__(self, file_path, arrow_schema):
+        self.file_path = file_path
+        self.schema = arrow_schema
+        self.num_rows = 0
+        self._tmp_path = columnar_path(file_path) + ".tmp"
+        self._sink = pa.OSFile(self._tmp_path, "wb")
+        self._writer = pa.ipc.new_file(self._sink, arrow_schema)
+
+    def write_table(self, table):
+        self._writer.write_table(table)
+        self.num_rows += table.num_rows
+
+    def write_frame(self, df):
+        self.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        self._writer.close()
+        self._sink.close()
+        os.replace(self._tmp_path, columnar_path(self.file_path))
+        # Rows appended to an earlier version of the file are not part of this one
+        _remove_segments(self.file_path)
+
+    def abort(self):
+        self._writer.close()
+        self._sink.close()
+        os.remove(self._tmp_path)
+
+def write_columnar(df, file_path, **extra):
+    table = _to_arrow_table(df)
+
+    # Uncompressed Arrow IPC so later reads can memory-map the buffers directly
+    writer = ColumnarWriter(file_path, table.schema)
+    writer.write_table(table)
+    writer.close()
+
+    schema = write_schema(file_path, table.schema, df.dtypes.astype(str).to_dict(), table.num_rows, **extra)
+    logger.info(f"Wrote columnar copy of {file_path} ({table.num_rows} rows, {table.num_columns} columns)")
+    return schema
+
+def read_schema(file_path):
+    with open(schema_path(file_path)) as f:
+        return json.load(f)
+
+def update_schema(file_path, **fields):
+    schema = read_schema(file_path)
+    schema.update(fields)
+    with open(schema_path(file_path), "w") as f:
+        json.dump(schema, f)
+    return schema
+
+def _segment_paths(file_path):
+    # The columnar copy, then its appended segments in order
+    segments = read_schema(file_path).get("segments", 0)
+    paths = [segment_path(file_path, segment) for segment in range(1, segments + 1)]
+    return [columnar_path(file_path)] + [path for path in paths if os.path.exists(path)]
+
+def _open_readers(paths, stack):
+    return [pa.ipc.open_file(stack.enter_context(pa.memory_map(path, "r"))) for path in paths]
+
+def _unified_schema(readers):
+    # Appended segments may hold wider types (larger integers, floats where there were integers,
+    # other dictionaries), reads see every segment as the widest
+    return pa.unify_schemas([reader.schema for reader in readers], promote_options="permissive")
+
+def read_columnar(file_path, columns=None, rows=None):
+    with ExitStack() as stack:
+        tables = []
+        for reader in _open_readers(_segment_paths(file_path), stack):
+            table = reader.read_all()
+            if columns is not None:
+                table = table.select([column for column in columns if column in table.column_names])
+            tables.append(table)
+        table = tables[0] if len(tables) == 1 else pa.concat_tables(tables, promote_options="permissive")
+        if rows is not None:
+            # Only the selected rows are copied out of the memory map
+            table = table.take(pa.array(rows, type=pa.int64()))
+        return table.to_pandas()
+
+def _iter_batches(readers):
+    schema = _unified_schema(readers) if len(readers) > 1 else None
+    for reader in readers:
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            yield batch if schema is None or batch.schema == schema else batch.cast(schema)
+
+def iter_columnar_batches(file_path, columns=None):
+    # One record batch at a time, so callers can stream files larger than RAM
+    with ExitStack() as stack:
+        for batch in _iter_batches(_open_readers(_segment_paths(file_path), stack)):
+            if columns is not None:
+                batch = batch.select([column for column in columns if column in batch.schema.names])
+            yield batch.to_pandas()
+
+def append_columnar(file_path, df, **extra):
+    # Writes the rows as a new segment instead of rewriting the columnar copy, then updates the
+    # schema with the row count, the widened types and the given fields. Returns the new schema.
+    schema = read_schema(file_path)
+    table = _to_arrow_table(df)
+    segment = schema.get("segments", 0) + 1
+    path = segment_path(file_path, segment)
+    with pa.OSFile(path + ".tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(path + ".tmp", path)
+
+    with ExitStack() as stack:
+        arrow_schema = _unified_schema(_open_readers(_segment_paths(file_path) + [path], stack))
+    schema = update_schema(file_path, num_rows=schema["num_rows"] + table.num_rows, segments=segment,
+                           dtypes={**schema["dtypes"], **df.dtypes.astype(str).to_dict()},
+                           arrow_types={field.name: str(field.type) for field in arrow_schema}, **extra)
+    if segment >= COLUMNAR_MAX_SEGMENTS:
+        schema = compact_columnar(file_path)
+    return schema
+
+def compact_columnar(file_path):
+    # Merges the appended segments back into one columnar copy; closing the writer replaces the
+    # copy and removes the segments
+    with ExitStack() as stack:
+        tables = [reader.read_all() for reader in _open_readers(_segment_paths(file_path), stack)]
+        # The IPC file format takes one dictionary per column for the whole file
+        table = pa.concat_tables(tables, promote_options="permissive").unify_dictionaries()
+        writer = ColumnarWriter(file_path, table.schema)
+        try:
+            writer.write_table(table)
+        except Exception:
+            writer.abort()
+            raise
+        writer.close()
+    schema = update_schema(file_path, segments=0)
+    logger.info(f"Compacted appended segments of {file_path} ({schema['num_rows']} rows)")
+    return schema
+
+def write_sketch(file_path, sketch):
+    tmp_path = sketch_path(file_path) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(sketch, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, sketch_path(file_path))
+
+def read_sketch(file_path):
+    if not os.path.exists(sketch_path(file_path)):
+        return None
+    with open(sketch_path(file_path), "rb") as f:
+        return pickle.load(f)
+
+def read_plans(file_path):
+    # Fitted transform plans of a dataset, by plan key
+    if not os.path.exists(plans_path(file_path)):
+        return {}
+    with open(plans_path(file_path), "rb") as f:
+        return pickle.load(f)
+
+def write_plan(file_path, plan):
+    plans = read_plans(file_path)
+    plans[plan.key] = plan
+    tmp_path = plans_path(file_path) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(plans, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, plans_path(file_path))
+
+def read_states(file_path):
+    # Incrementally maintained analysis statistics of a dataset, by transform plan key
+    if not os.path.exists(states_path(file_path)):
+        return {}
+    with open(states_path(file_path), "rb") as f:
+        return pickle.load(f)
+
+def write_states(file_path, states):
+    tmp_path = states_path(file_path) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(states, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, states_path(file_path))
@@ -1,164 +1,752 @@
 import pandas as pd
 import numpy as np
-import io
 import logging
 from fastapi import UploadFile, HTTPException
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
-from analysis import analyze_data
+from starlette.concurrency import run_in_threadpool
+from analysis import ANALYSIS_SECTIONS, analyze_data, analyze_sections, build_section, section_outputs
+from columnar_store import (has_columnar_copy, write_columnar, read_columnar, read_schema, update_schema, write_schema,
+                            ColumnarWriter, iter_columnar_batches, read_sketch, write_sketch, read_plans, write_plan,
+                            append_columnar, read_states, write_states)
+from analysis.streaming_stats import StreamingSummary, summarize_chunks
+from analysis.incremental import build_analysis_state
+from analysis.sampling import approximation_info
+from analysis.outlier_detection import OUTLIER_METHOD
+from analysis.downsampling import (LINE_METHODS, axis_values, build_density_pyramid, build_series_pyramid,
+                                   downsample_series, scatter_density)
+from analysis.aggregation import GROUP_LIMIT, PAIR_COLUMN_LIMIT, bin_edges, build_category_index, group_by, histogram, pair_counts
+from result_cache import result_cache, hash_file, hash_options
+from transforms import TransformPlan, plan_key
+from schema_inference import SchemaInference, apply_schema, conform_batch, infer_schema, memory_usage
+from jobs import job_manager
+from readers import STREAMING_FORMATS, CsvEngineError, iter_chunks, read_frame, sniff
+import hashlib
+import pyarrow as pa
 import os
-import sklearn
-import scipy.sparse
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+import re
+import threading
+import time
+import uuid
+from metrics import Counter
+from profiling import profiled
+
 logger = logging.getLogger(__name__)
 
 UPLOAD_DIRECTORY = "uploaded_files"
+# Uploads are copied to disk and parsed in fixed-size pieces so peak memory doesn't grow with the file
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Handles are result cache keys, "<content hash>-<options hash>"
+HANDLE_PATTERN = re.compile(r"^[0-9a-f]{32}-[0-9a-f]{32}$")
+# Sections with one entry per row, which can be fetched a page at a time
+PAGED_SECTIONS = {"pca_data", "pca_result", "clusters", "time_series_analysis", "outliers"}
+# Series of each time series analysis entry that can be downsampled
+TIME_SERIES_COMPONENTS = ("trend", "seasonal", "residual")
+
+BYTES_PARSED = Counter("upload_bytes_parsed_total", "Bytes of uploaded files parsed into columnar copies", labels=("format",))
+ROWS_PARSED = Counter("upload_rows_parsed_total", "Rows of uploaded files parsed into columnar copies", labels=("format",))
+
+# Appends read, extend and rewrite a dataset's stored files, one at a time
+APPEND_LOCK = threading.Lock()
 
 if not os.path.exists(UPLOAD_DIRECTORY):
     os.makedirs(UPLOAD_DIRECTORY)
 
+def read_uploaded_file(file_path: str, filename: str = None) -> pd.DataFrame:
+    # The format comes from the original filename, the data may sit in a temporary path
+    return read_frame(file_path, sniff(file_path, filename))
+
+def optimize_dtypes(df: pd.DataFrame, file_path: str):
+    # Stores every column as the smallest dtype that holds its values; the columnar copy keeps
+    # these types, so later loads don't infer them again
+    before = memory_usage(df)
+    df = apply_schema(df, infer_schema(df))
+    memory = {"before": before, "after": memory_usage(df)}
+    _log_memory_usage(file_path, memory["before"], memory["after"])
+    return df, memory
+
+def load_dataset(filename: str, columns=None) -> pd.DataFrame:
+    file_path = os.path.join(UPLOAD_DIRECTORY, filename)
+    if not has_columnar_copy(file_path):
+        # Files uploaded before the columnar cache existed are converted on first use
+        logger.info(f"No columnar copy for {file_path}, converting raw file")
+        df, memory = optimize_dtypes(read_uploaded_file(file_path), file_path)
+        write_columnar(df, file_path, content_hash=hash_file(file_path), memory_usage=memory)
+    return read_columnar(file_path, columns=columns)
+
+def get_content_hash(filename: str) -> str:
+    file_path = os.path.join(UPLOAD_DIRECTORY, filename)
+    if not has_columnar_copy(file_path):
+        load_dataset(filename, columns=[])
+    schema = read_schema(file_path)
+    if 'content_hash' not in schema:
+        schema = update_schema(file_path, content_hash=hash_file(file_path))
+    return schema['content_hash']
+
+def get_streaming_summary(filename: str) -> dict:
+    file_path = os.path.join(UPLOAD_DIRECTORY, filename)
+    if not has_columnar_copy(file_path):
+        load_dataset(filename, columns=[])
+    sketch = read_sketch(file_path)
+    if sketch is None:
+        # Files ingested before summaries were kept get one pass over the memory-mapped batches
+        sketch = summarize_chunks(iter_columnar_batches(file_path))
+        write_sketch(file_path, sketch)
+    return {
+        "filename": filename,
+        "summary": sketch.summary(),
+        "general_statistics": sketch.general_statistics(),
+        "missing_values": sketch.missing_values()
+    }
+
+def _load_columns(filename: str, columns: list) -> pd.DataFrame:
+    # A column asked for twice (e.g. plotted against itself) is read once
+    columns = list(dict.fromkeys(columns))
+    df = load_dataset(filename, columns=columns)
+    missing_columns = [column for column in columns if column not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Columns not found in {filename}: {missing_columns}")
+    return df
+
+def _cached_for_version(filename: str, options: dict, build):
+    # Built once per file version and options, appends and re-uploads change the content hash
+    cache_key = result_cache.make_key(get_content_hash(filename), options)
+    value = result_cache.get(cache_key)
+    if value is None:
+        value = build()
+        result_cache.put(cache_key, value)
+    return value
+
+def _lod_pyramid(filename: str, kind: str, columns: list, build):
+    # Pyramids are cached per file version and column pair, so zooming and panning only read them
+    return _cached_for_version(filename, {"lod": kind, "columns": columns}, lambda: build(_load_columns(filename, columns)))
+
+def get_line_series(filename: str, y: str, x: str = None, start: float = None, end: float = None,
+                    pixels: int = 1000, method: str = "minmax") -> dict:
+    if method not in LINE_METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    file_path = os.path.join(UPLOAD_DIRECTORY, filename)
+    columns = [y] if x is None else list(dict.fromkeys([x, y]))
+    pyramid = _lod_pyramid(filename, "line", columns, lambda df: build_series_pyramid(None if x is None else df[x], df[y]))
+
+    def raw_loader(lo, hi):
+        rows = np.arange(lo, hi) if pyramid.order is None else pyramid.order[lo:hi]
+        df = read_columnar(file_path, columns=columns, rows=rows)
+        x_values = rows.astype(np.float64) if x is None else axis_values(df[x])[0]
+        return x_values, axis_values(df[y])[0]
+
+    series = downsample_series(pyramid, raw_loader, start=start, end=end, pixels=pixels, method=method)
+    return {"filename": filename, "x_column": x, "y_column": y, **series}
+
+def get_scatter_density(filename: str, x: str, y: str, x_min: float = None, x_max: float = None,
+                        y_min: float = None, y_max: float = None, bins: int = 200) -> dict:
+    file_path = os.path.join(UPLOAD_DIRECTORY, filename)
+    columns = list(dict.fromkeys([x, y]))
+    pyramid = _lod_pyramid(filename, "scatter", columns, lambda df: build_density_pyramid(df[x], df[y]))
+
+    def raw_loader():
+        df = read_columnar(file_path, columns=columns)
+        return axis_values(df[x])[0], axis_values(df[y])[0]
+
+    density = scatter_density(pyramid, raw_loader, x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max, bins=bins)
+    return {"filename": filename, "x_column": x, "y_column": y, **density}
+
+def _analysis_section(handle: str, section: str):
+    if not HANDLE_PATTERN.match(handle):
+        raise ValueError(f"Invalid analysis handle: {handle}")
+    return compute_sections(handle, [section])[section]
+
+def _cached_for_handle(handle: str, options: dict, build):
+    # Pyramids of an analysis's derived series, kept next to the analysis's other cached outputs
+    cache_key = f"{handle}-lod-{hash_options(options)}"
+    value = result_cache.get(cache_key)
+    if value is None:
+        value = build()
+        result_cache.put(cache_key, value)
+    return value
+
+def get_component_series(handle: str, column: str, component: str = "trend", start: float = None, end: float = None,
+                         pixels: int = 1000, method: str = "minmax") -> dict:
+    # A trend, seasonal or residual series of the time series analysis, downsampled like a dataset column
+    if method not in LINE_METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    if component not in TIME_SERIES_COMPONENTS:
+        raise ValueError(f"Unknown time series component: {component}")
+    analysis = (_analysis_section(handle, "time_series_analysis") or {}).get(column)
+    if analysis is None or component not in analysis:
+        raise ValueError(f"No {component} series for column {column}")
+
+    def series():
+        dates = pd.Series(pd.to_datetime(analysis["dates"])) if analysis.get("dates") is not None else None
+        return dates, pd.Series(analysis[component], dtype=np.float64)
+
+    pyramid = _cached_for_handle(handle, {"lod": "line", "column": column, "component": component},
+                                 lambda: build_series_pyramid(*series()))
+
+    def raw_loader(lo, hi):
+        dates, values = series()
+        rows = np.arange(lo, hi) if pyramid.order is None else pyramid.order[lo:hi]
+        x_values = rows.astype(np.float64) if dates is None else axis_values(dates)[0][rows]
+        return x_values, values.to_numpy()[rows]
+
+    downsampled = downsample_series(pyramid, raw_loader, start=start, end=end, pixels=pixels, method=method)
+    return {"handle": handle, "column": column, "component": component, **downsampled}
+
+def get_pca_density(handle: str, cluster: int = None, x_min: float = None, x_max: float = None,
+                    y_min: float = None, y_max: float = None, bins: int = 200) -> dict:
+    # The PCA scores of an analysis (or the points of one cluster) as binned counts or points
+    def scores():
+        pca = pd.DataFrame.from_records(_analysis_section(handle, "pca_data") or [], columns=["PC1", "PC2"])
+        if cluster is not None:
+            clusters = np.asarray(_analysis_section(handle, "clusters") or [])
+            if len(clusters) != len(pca):
+                raise ValueError("The clusters do not match the PCA scores of this analysis")
+            pca = pca[clusters == cluster]
+        return pca["PC1"], pca["PC2"]
+
+    pyramid = _cached_for_handle(handle, {"lod": "scatter", "section": "pca_data", "cluster": cluster},
+                                 lambda: build_density_pyramid(*scores()))
+
+    def raw_loader():
+        x, y = scores()
+        return axis_values(x)[0], axis_values(y)[0]
+
+    density = scatter_density(pyramid, raw_loader, x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max, bins=bins)
+    return {"handle": handle, "cluster": cluster, **density}
+
+def _category_index(filename: str, column: str):
+    # Dictionary-encoded index of a group-by column, built on its first query and kept per file version
+    return _cached_for_version(filename, {"index": column}, lambda: build_category_index(_load_columns(filename, [column])[column]))
+
+def _value_column(filename: str, column: str):
+    return axis_values(_load_columns(filename, [column])[column])
+
+def query_group_by(filename: str, by: list, value: str = None, aggregations: list = None, quantiles: list = None,
+                   order: str = "size", limit: int = GROUP_LIMIT) -> dict:
+    aggregations = aggregations or ["count"]
+    quantiles = sorted(set(quantiles or []))
+    query = {"query": "groupby", "by": by, "value": value, "aggregations": aggregations, "quantiles": quantiles,
+             "order": order, "limit": limit}
+
+    def run():
+        indexes = [_category_index(filename, column) for column in by]
+        values, value_type = _value_column(filename, value) if value is not None else (None, None)
+        if values is not None:
+            n_rows = len(values)
+        elif indexes:
+            n_rows = len(indexes[0].codes)
+        else:
+            n_rows = read_schema(os.path.join(UPLOAD_DIRECTORY, filename))["num_rows"]
+        result = group_by(indexes, n_rows, values, aggregations, quantiles, order=order, limit=limit)
+        return {**result, "value_type": value_type}
+
+    return {"filename": filename, "by": by, "value": value, **_cached_for_version(filename, query, run)}
+
+def query_histogram(filename: str, column: str, bins: int = 30, value_min: float = None, value_max: float = None,
+                    edges: list = None, by: str = None, limit: int = GROUP_LIMIT) -> dict:
+    query = {"query": "histogram", "column": column, "bins": bins, "range": [value_min, value_max], "edges": edges,
+             "by": by, "limit": limit}
+
+    def run():
+        values, value_type = _value_column(filename, column)
+        indexes = [] if by is None else [_category_index(filename, by)]
+        result = histogram(values, bin_edges(values, bins, (value_min, value_max), edges), indexes, limit=limit)
+        return {**result, "value_type": value_type}
+
+    return {"filename": filename, "column": column, "by": by, **_cached_for_version(filename, query, run)}
+
+def query_pair_counts(filename: str, columns: list, bins: int = 20) -> dict:
+    if not 2 <= len(set(columns)) == len(columns) <= PAIR_COLUMN_LIMIT:
+        raise ValueError(f"Pair counts take between 2 and {PAIR_COLUMN_LIMIT} distinct columns")
+    query = {"query": "pairs", "columns": columns, "bins": bins}
+
+    def run():
+        df = _load_columns(filename, columns)
+        binned, types = {}, {}
+        for column in columns:
+            values, types[column] = axis_values(df[column])
+            binned[column] = (values, bin_edges(values, bins))
+        return {**pair_counts(binned), "types": types}
+
+    return {"filename": filename, "columns": columns, **_cached_for_version(filename, query, run)}
+
+async def save_upload(file: UploadFile, file_path: str) -> str:
+    # Hash while copying so the result cache can key on content without re-reading the file
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "wb") as buffer:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            buffer.write(chunk)
+    return digest.hexdigest()
+
+def _merge_dtypes(current, new):
+    if current is None or current == new:
+        return new
+    if current.kind in 'iuf' and new.kind in 'iuf':
+        return np.result_type(current, new)
+    return np.dtype('object')
+
+def _arrow_type(dtype, target=None):
+    # target is the column's inferred schema entry, if it is stored as something smaller
+    if target is not None:
+        if target["dtype"] == 'category':
+            codes = pd.Categorical([], categories=target["categories"]).codes
+            return pa.dictionary(pa.from_numpy_dtype(codes.dtype), pa.string())
+        if target["dtype"] == 'datetime64[ns]':
+            return pa.timestamp('ns')
+        dtype = np.dtype(target["dtype"])
+    if dtype == np.dtype('object'):
+        return pa.string()
+    return pa.from_numpy_dtype(dtype)
+
+def _log_memory_usage(file_path: str, before: int, after: int):
+    logger.info(f"Inferred dtypes shrink {file_path} from {before / 2**20:.1f} MiB to {after / 2**20:.1f} MiB in memory")
+
+def ingest_streaming(source_path: str, file_path: str, dialect: dict) -> dict:
+    try:
+        return _ingest_chunks(source_path, file_path, dialect)
+    except CsvEngineError as e:
+        logger.warning(f"pyarrow can't read {file_path} ({str(e)}), parsing it with pandas")
+        return _ingest_chunks(source_path, file_path, {**dialect, "engine": "pandas"})
+
+def _ingest_chunks(source_path: str, file_path: str, dialect: dict) -> dict:
+    # First pass: infer a dtype that holds every chunk, count missing values and gather what
+    # each column's values allow it to be stored as (smaller numbers, categories, datetimes)
+    dtypes = {}
+    missing_values = {}
+    num_rows = 0
+    inference = SchemaInference()
+    for chunk in iter_chunks(source_path, dialect):
+        # JSON records can leave keys out: a column is missing wherever a chunk lacks it
+        for column in dtypes.keys() - set(chunk.columns):
+            missing_values[column] += len(chunk)
+            dtypes[column] = _merge_dtypes(dtypes[column], np.dtype('float64'))
+        for column in [column for column in chunk.columns if column not in dtypes]:
+            missing_values[column] = num_rows
+            dtypes[column] = np.dtype('float64') if num_rows else None
+        num_rows += len(chunk)
+        inference.update(chunk)
+        for column, count in chunk.isnull().sum().items():
+            missing_values[column] += int(count)
+            dtypes[column] = _merge_dtypes(dtypes[column], chunk[column].dtype)
+
+    if num_rows == 0:
+        raise ValueError("The uploaded file is empty")
+
+    # Second pass: parse with the unified dtypes, convert to the inferred ones, append each chunk
+    # to the columnar copy and fold it into the streaming summary so the file never has to be
+    # held in memory
+    inferred = inference.schema(dtypes)
+    arrow_schema = pa.schema([(column, _arrow_type(dtype, inferred.get(column))) for column, dtype in dtypes.items()])
+    writer = ColumnarWriter(file_path, arrow_schema)
+    sketch = StreamingSummary()
+    memory_before = memory_after = 0
+    try:
+        for chunk in iter_chunks(source_path, dialect, dtypes):
+            memory_before += memory_usage(chunk)
+            chunk = apply_schema(chunk, inferred)
+            memory_after += memory_usage(chunk)
+            writer.write_frame(chunk)
+            sketch.update(chunk)
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+    write_sketch(file_path, sketch)
+
+    dtype_names = {column: inferred[column]["dtype"] if column in inferred else str(dtype) for column, dtype in dtypes.items()}
+    memory = {"before": memory_before, "after": memory_after}
+    write_schema(file_path, arrow_schema, dtype_names, num_rows, memory_usage=memory)
+    _log_memory_usage(file_path, memory_before, memory_after)
+    logger.info(f"Streamed {num_rows} rows of {file_path} into columnar copy")
+    return {
+        "shape": (num_rows, len(dtypes)),
+        "columns": list(dtypes.keys()),
+        "dtypes": dtype_names,
+        "missing_values": missing_values,
+        "memory_usage": memory
+    }
+
+def ingest_file(source_path: str, file_path: str) -> dict:
+    dialect = sniff(source_path, file_path)
+    if dialect["format"] in STREAMING_FORMATS:
+        return ingest_streaming(source_path, file_path, dialect)
+
+    # XLSX and JSON documents have no chunked reader, parse them from disk in one go
+    df = read_frame(source_path, dialect)
+    if df.empty:
+        raise ValueError("The uploaded file is empty")
+    df, memory = optimize_dtypes(df, file_path)
+    write_columnar(df, file_path, memory_usage=memory)
+    write_sketch(file_path, StreamingSummary().update(df))
+    return {
+        "shape": df.shape,
+        "columns": df.columns.tolist(),
+        "dtypes": df.dtypes.astype(str).to_dict(),
+        "missing_values": {column: int(count) for column, count in df.isnull().sum().items()},
+        "memory_usage": memory
+    }
+
 async def process_uploaded_file(file: UploadFile):
-    contents = await file.read()
-    
+    file_path = os.path.join(UPLOAD_DIRECTORY, file.filename)
+    part_path = file_path + ".part"
+
     try:
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-        elif file.filename.endswith('.xlsx'):
-            df = pd.read_excel(io.BytesIO(contents))
-        elif file.filename.endswith('.json'):
-            df = pd.read_json(io.StringIO(contents.decode('utf-8')))
-        else:
-            raise ValueError("Unsupported file format")
-        
-        if df.empty:
-            raise ValueError("The uploaded file is empty")
-
-        # Save the file
-        file_path = os.path.join(UPLOAD_DIRECTORY, file.filename)
-        with open(file_path, "wb") as buffer:
-            buffer.write(contents)
-        
+        # Stream the upload to disk instead of holding the whole body in memory
+        content_hash = await save_upload(file, part_path)
+        previous_hash = read_schema(file_path).get('content_hash') if has_columnar_copy(file_path) else None
+        file_info = await run_in_threadpool(profiled(ingest_file), part_path, file_path)
+        file_format = os.path.splitext(file.filename)[1].lstrip('.')
+        BYTES_PARSED.inc(os.path.getsize(part_path), format=file_format)
+        ROWS_PARSED.inc(file_info["shape"][0], format=file_format)
+        update_schema(file_path, content_hash=content_hash)
+        os.replace(part_path, file_path)
+
+        # Results computed for the replaced file are no longer reachable, drop them
+        if previous_hash is not None and previous_hash != content_hash:
+            result_cache.invalidate(previous_hash)
+
         # Return basic file info and data summary
-        return {
-            "filename": file.filename,
-            "shape": df.shape,
-            "columns": df.columns.tolist(),
-            "dtypes": df.dtypes.astype(str).to_dict(),
-            "missing_values": df.isnull().sum().to_dict()
-        }
+        return {"filename": file.filename, **file_info}
     except Exception as e:
         logger.error(f"Error processing uploaded file: {str(e)}", exc_info=True)
         raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+def _advance_analysis_states(filename: str, previous_hash: str, batch: pd.DataFrame):
+    # Plans fitted on the previous version keep applying to the appended one when they transform
+    # rows one by one: the earlier rows preprocess the same, so their statistics only need the
+    # new rows folded in. Other plans are refitted by the next request.
+    file_path = os.path.join(UPLOAD_DIRECTORY, filename)
+    stored = read_states(file_path)
+    plans, states = [], {}
+    for plan in read_plans(file_path).values():
+        if plan.content_hash != previous_hash or not plan.row_wise:
+            continue
+        state = stored.get(plan.key)
+        if state is None or state.content_hash != previous_hash:
+            # The first append since the plan was fitted makes one pass over the history
+            logger.info(f"Building incremental statistics of {filename} for plan {plan.key}")
+            history = load_dataset(filename, columns=plan.columns)
+            state = build_analysis_state(plan.transform(history), plan.key, previous_hash)
+        try:
+            state.update(plan.transform(batch))
+        except ValueError as e:
+            logger.warning(f"Dropping incremental statistics of {filename} for plan {plan.key}: {str(e)}")
+            continue
+        plans.append(plan)
+        states[plan.key] = state
+    return plans, states
+
+def append_rows(source_path: str, filename: str, batch_filename: str, batch_hash: str) -> dict:
+    # Adds the rows of another file to an uploaded dataset as a new columnar segment and folds
+    # them into the kept statistics, instead of re-uploading and re-analysing everything
+    file_path = os.path.join(UPLOAD_DIRECTORY, filename)
+    if not os.path.exists(file_path):
+        raise ValueError(f"Unknown dataset: {filename}")
+    with APPEND_LOCK:
+        previous_hash = get_content_hash(filename)
+        schema = read_schema(file_path)
+        batch = read_uploaded_file(source_path, batch_filename)
+        if batch.empty:
+            raise ValueError("The appended file has no rows")
+        memory_before = memory_usage(batch)
+        batch = conform_batch(batch, schema["dtypes"])
+        memory_after = memory_usage(batch)
+        plans, states = _advance_analysis_states(filename, previous_hash, batch)
+
+        # The new version's hash chains the previous one with the appended file's
+        content_hash = hashlib.blake2b(f"{previous_hash}-{batch_hash}".encode('utf-8'), digest_size=16).hexdigest()
+        memory = schema.get("memory_usage", {"before": 0, "after": 0})
+        schema = append_columnar(file_path, batch, content_hash=content_hash,
+                                 memory_usage={"before": memory["before"] + memory_before,
+                                               "after": memory["after"] + memory_after})
+        for plan in plans:
+            plan.content_hash = content_hash
+            write_plan(file_path, plan)
+        for state in states.values():
+            state.content_hash = content_hash
+        write_states(file_path, states)
+
+        sketch = read_sketch(file_path)
+        sketch = summarize_chunks(iter_columnar_batches(file_path)) if sketch is None else sketch.update(batch)
+        write_sketch(file_path, sketch)
 
-def preprocess_data(df: pd.DataFrame, preprocessing_options: dict) -> pd.DataFrame:
-    logger.info("Starting preprocessing")
-    
-    # Filter out columns that are not included
-    included_columns = [col for col, options in preprocessing_options['columnOptions'].items() if options['include']]
-    df = df[included_columns]
-    
-    logger.info(f"Columns after filtering: {df.columns.tolist()}")
-    
-    # If no further preprocessing is needed, return the filtered DataFrame
-    if not preprocessing_options.get('use_standard_scaler', False) and not any(options.get('fillMethod') != 'none' for options in preprocessing_options['columnOptions'].values()):
-        logger.info("No further preprocessing needed. Returning filtered DataFrame.")
-        return df
-
-    numeric_features = df.select_dtypes(include=['int64', 'float64']).columns
-    categorical_features = df.select_dtypes(include=['object']).columns
-
-    logger.debug(f"Numeric features: {numeric_features}")
-    logger.debug(f"Categorical features: {categorical_features}")
-
-    # Separate categorical columns for one-hot encoding and those to keep as is
-    encode_columns = [col for col in categorical_features if preprocessing_options['columnOptions'].get(col, {}).get('encoding') == 'one-hot']
-    keep_categorical = [col for col in categorical_features if col not in encode_columns]
-
-    transformers = []
-
-    # Numeric transformer
-    numeric_steps = []
-    if any(preprocessing_options['columnOptions'].get(col, {}).get('fillMethod') != 'none' for col in numeric_features):
-        numeric_steps.append(('imputer', SimpleImputer(strategy='mean')))
-    if preprocessing_options.get('use_standard_scaler', False):
-        numeric_steps.append(('scaler', StandardScaler()))
-    if numeric_steps:
-        numeric_transformer = Pipeline(steps=numeric_steps)
-        transformers.append(('num', numeric_transformer, numeric_features))
-
-    # One-hot encoding transformer
-    if encode_columns:
-        categorical_transformer = Pipeline(steps=[
-            ('imputer', SimpleImputer(strategy='constant', fill_value='missing')),
-            ('onehot', OneHotEncoder(handle_unknown='ignore'))
-        ])
-        transformers.append(('cat', categorical_transformer, encode_columns))
-
-    # If no transformers, return the filtered DataFrame
-    if not transformers:
-        logger.info("No transformations needed. Returning filtered DataFrame.")
-        return df
-
-    # Create the ColumnTransformer
-    preprocessor = ColumnTransformer(transformers=transformers)
+    # Results computed for the previous version are no longer reachable
+    result_cache.invalidate(previous_hash)
+    logger.info(f"Appended {len(batch)} rows to {filename}, {len(states)} incremental statistics updated")
+    return {
+        "shape": (schema["num_rows"], len(schema["columns"])),
+        "columns": schema["columns"],
+        "dtypes": schema["dtypes"],
+        "missing_values": sketch.missing_values(),
+        "memory_usage": schema["memory_usage"],
+        "appended_rows": len(batch),
+    }
 
+async def process_append_request(filename: str, file: UploadFile):
+    part_path = os.path.join(UPLOAD_DIRECTORY, f"{filename}.{uuid.uuid4().hex}.part")
     try:
-        # Fit and transform the data
-        preprocessed_data = preprocessor.fit_transform(df)
-        logger.info("Preprocessing transformation complete")
-
-        # Get feature names
-        feature_names = list(numeric_features)
-        if encode_columns:
-            if hasattr(preprocessor.named_transformers_['cat'].named_steps['onehot'], 'get_feature_names_out'):
-                cat_feature_names = preprocessor.named_transformers_['cat'].named_steps['onehot'].get_feature_names_out(encode_columns)
-            else:
-                cat_feature_names = preprocessor.named_transformers_['cat'].named_steps['onehot'].get_feature_names(encode_columns)
-            feature_names.extend(cat_feature_names)
-
-        # Convert to dense array if it's sparse
-        if scipy.sparse.issparse(preprocessed_data):
-            preprocessed_data = preprocessed_data.toarray()
-
-        # Create DataFrame with preprocessed data
-        result_df = pd.DataFrame(preprocessed_data, columns=feature_names, index=df.index)
-
-        # Add back categorical columns that were not one-hot encoded
-        for col in keep_categorical:
-            result_df[col] = df[col]
-
-        logger.info(f"Preprocessing complete. Final columns: {result_df.columns.tolist()}")
-        return result_df
+        batch_hash = await save_upload(file, part_path)
+        file_info = await run_in_threadpool(profiled(append_rows), part_path, filename, file.filename, batch_hash)
+        file_format = os.path.splitext(file.filename)[1].lstrip('.')
+        BYTES_PARSED.inc(os.path.getsize(part_path), format=file_format)
+        ROWS_PARSED.inc(file_info["appended_rows"], format=file_format)
+        return {"filename": filename, **file_info}
+    except Exception as e:
+        logger.error(f"Error appending to {filename}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=f"Error appending rows: {str(e)}")
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+def _analysis_state(filename: str, options: dict):
+    # Statistics appends kept up to date for these options on the current version, if any
+    if options.get('planFrom'):
+        return None
+    state = read_states(os.path.join(UPLOAD_DIRECTORY, filename)).get(plan_key(_column_options(options)))
+    if state is None or state.content_hash != get_content_hash(filename):
+        return None
+    return state
+
+def _save_analysis_state(filename: str, state):
+    file_path = os.path.join(UPLOAD_DIRECTORY, filename)
+    with APPEND_LOCK:
+        states = read_states(file_path)
+        # Another append may have moved the dataset on in the meantime
+        if state.key in states and states[state.key].content_hash == state.content_hash:
+            states[state.key] = state
+            write_states(file_path, states)
+
+def _column_options(preprocessing_options: dict) -> dict:
+    # The global standard scaler switch standardizes the columns without a scaling of their own
+    column_options = preprocessing_options['columnOptions']
+    if not preprocessing_options.get('use_standard_scaler', False):
+        return column_options
+    return {column: {**options, 'scaling': 'standardization'} if options.get('scaling', 'none') == 'none' else options
+            for column, options in column_options.items()}
 
+def _stored_plan(filename: str, column_options: dict) -> TransformPlan:
+    return read_plans(os.path.join(UPLOAD_DIRECTORY, filename)).get(plan_key(column_options))
+
+def _plan_approximation(plan: TransformPlan, total_rows: int):
+    # Row-wise plans keep the fill values, scaling and bins fitted before later appends, so the
+    # appended rows are preprocessed with statistics of fewer rows. Plans stored before their
+    # rows were recorded have no fitted_rows.
+    if plan is None or getattr(plan, 'fitted_rows', None) in (None, total_rows):
+        return None
+    return approximation_info(total_rows, plan.fitted_rows, "preprocessing fitted before rows were appended")
+
+def _cache_options(options: dict) -> dict:
+    # The outlier method the analysis runs with, whether it was asked for or is the server default
+    options = {**options, 'outlierMethod': options.get('outlierMethod') or OUTLIER_METHOD}
+    # A plan applied from elsewhere is part of the result, re-fitting it changes the analysis
+    if not options.get('planFrom'):
+        return options
+    plan = _stored_plan(options['planFrom'], _column_options(options))
+    return {**options, 'planContentHash': plan.content_hash if plan is not None else None}
+
+def get_transform_plan(filename: str, df: pd.DataFrame, options: dict) -> TransformPlan:
+    # Fitted once per dataset version and column options, then reused. planFrom applies the plan
+    # fitted on another upload (or an earlier version of this one) without refitting it.
+    column_options = _column_options(options)
+    if options.get('planFrom'):
+        plan = _stored_plan(options['planFrom'], column_options)
+        if plan is None:
+            raise ValueError(f"No transform plan fitted on {options['planFrom']} for these column options")
+        logger.info(f"Applying the transform plan of {options['planFrom']} to {filename}")
+        return plan
+    content_hash = get_content_hash(filename)
+    plan = _stored_plan(filename, column_options)
+    if plan is None or plan.content_hash != content_hash:
+        plan = TransformPlan.fit(df, column_options, content_hash)
+        write_plan(os.path.join(UPLOAD_DIRECTORY, filename), plan)
+    return plan
+
+def preprocess_data(df: pd.DataFrame, preprocessing_options: dict, plan: TransformPlan = None) -> pd.DataFrame:
+    logger.debug("Starting preprocessing")
+    try:
+        if plan is None:
+            plan = TransformPlan.fit(df, _column_options(preprocessing_options))
+        result_df = plan.transform(df)
+        # Listing every column is costly on wide frames, only done when it will be shown
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Preprocessing complete. Final columns: %s", result_df.columns.tolist())
+        return result_df
     except Exception as e:
         logger.error(f"Error during preprocessing: {str(e)}", exc_info=True)
         raise
 
-async def process_preprocessing_request(filename: str, options: dict):
+def _load_preprocessed(filename: str, options: dict) -> pd.DataFrame:
+    # Load only the included columns from the memory-mapped columnar copy
+    included_columns = [col for col, col_options in options['columnOptions'].items() if col_options['include']]
+    logger.debug("Loading %d columns of %s", len(included_columns), filename)
+    df = load_dataset(filename, columns=included_columns)
+    logger.debug("Data loaded. Shape: %s", df.shape)
+    return preprocess_data(df, options, get_transform_plan(filename, df, options))
+
+def _preprocessed_frame(handle: str) -> pd.DataFrame:
+    # Section requests for one handle share the preprocessed frame instead of redoing it each time
+    frame_key = f"{handle}-frame"
+    df = result_cache.get(frame_key)
+    if df is None:
+        session = result_cache.get(f"{handle}-session")
+        if session is None:
+            raise ValueError(f"Unknown or expired analysis handle: {handle}")
+        df = _load_preprocessed(session["filename"], session["options"])
+        result_cache.put(frame_key, df)
+    return df
+
+def compute_sections(handle: str, sections: list) -> dict:
+    full_result = result_cache.get(handle)
+    if full_result is not None:
+        return {section: full_result[section] for section in sections}
+
+    # Pipeline outputs are cached one by one, so a section reuses whatever earlier requests computed
+    outputs = {output for section in sections for output in section_outputs(section)}
+    known = {}
+    for output in outputs:
+        value = result_cache.get(f"{handle}-output-{output}")
+        if value is not None:
+            known[output] = value
+    if len(known) < len(outputs):
+        session = result_cache.get(f"{handle}-session")
+        if session is None:
+            raise ValueError(f"Unknown or expired analysis handle: {handle}")
+        state = _analysis_state(session["filename"], session["options"])
+        if state is not None:
+            known.update({output: value for output, value in state.outputs(session["options"].get('outlierMethod')).items()
+                          if output in outputs and output not in known})
+    if len(known) < len(outputs):
+        df = _preprocessed_frame(handle)
+        for output, value in analyze_sections(df, sections, known=known,
+                                              outlier_method=session["options"].get('outlierMethod')).items():
+            if output not in known:
+                result_cache.put(f"{handle}-output-{output}", value)
+                known[output] = value
+    result = {section: build_section(section, known) for section in sections}
+    if "approximations" in result:
+        session = result_cache.get(f"{handle}-session")
+        if session is not None and not session["options"].get('planFrom'):
+            filename = session["filename"]
+            plan = _stored_plan(filename, _column_options(session["options"]))
+            num_rows = read_schema(os.path.join(UPLOAD_DIRECTORY, filename))["num_rows"]
+            approximation = _plan_approximation(plan, num_rows)
+            if approximation is not None:
+                result["approximations"]["preprocessing"] = approximation
+    return result
+
+def _page(value, offset: int, limit: int):
+    # Per-row lists are sliced, dicts are paged entry by entry, anything else is sent whole
+    if isinstance(value, list):
+        return value[offset:offset + limit], len(value)
+    if isinstance(value, dict):
+        paged, total = {}, 0
+        for key, item in value.items():
+            paged[key], item_total = _page(item, offset, limit)
+            total = max(total, item_total)
+        return paged, total
+    return value, 0
+
+def get_analysis_section(handle: str, section: str, offset: int = 0, limit: int = None) -> dict:
+    if not HANDLE_PATTERN.match(handle):
+        raise ValueError(f"Invalid analysis handle: {handle}")
+    if section not in ANALYSIS_SECTIONS:
+        raise ValueError(f"Unknown analysis section: {section}")
+    data = compute_sections(handle, [section])[section]
+    response = {"handle": handle, "section": section}
+    if section in PAGED_SECTIONS and data is not None:
+        if limit is None:
+            _, total = _page(data, 0, 0)
+        else:
+            data, total = _page(data, offset, limit)
+        response.update(offset=offset, limit=limit, total=total)
+    response["data"] = data
+    return response
+
+def run_preprocessing_request(filename: str, options: dict, include_timings: bool = False, lazy: bool = False,
+                              progress=None, cancel=None):
+    def report(step, fraction):
+        if progress is not None:
+            progress(step, fraction)
+
+    start = time.perf_counter()
+    logger.info(f"Processing preprocessing request for file: {filename}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Preprocessing options: %s", options)
+
+    # Identical options on an unchanged file return the stored result
+    cache_key = result_cache.make_key(get_content_hash(filename), _cache_options(options))
+    result_cache.put(f"{cache_key}-session", {"filename": filename, "options": options})
+    if lazy:
+        # The cheap sections now, everything else from /analysis/{handle}/{section} when it is shown
+        result = {"handle": cache_key, "filename": filename, "sections": ANALYSIS_SECTIONS}
+        result.update(compute_sections(cache_key, ["general_statistics", "summary", "column_types", "missing_values"]))
+        if include_timings:
+            result["timings"] = {"total": {"wall": round(time.perf_counter() - start, 4)}}
+        return result
+
+    cached_result = result_cache.get(cache_key)
+    if cached_result is not None:
+        logger.info(f"Returning cached analysis for {filename}")
+        # Results cached before they carried their handle
+        result = {"handle": cache_key, **cached_result}
+        if include_timings:
+            result["timings"] = {"cache": {"wall": round(time.perf_counter() - start, 4)}}
+        return result
+
+    # Load only the included columns from the memory-mapped columnar copy
+    included_columns = [col for col, col_options in options['columnOptions'].items() if col_options['include']]
+    logger.debug("Loading %d columns of %s", len(included_columns), filename)
+    df = load_dataset(filename, columns=included_columns)
+    logger.debug("Data loaded. Shape: %s", df.shape)
+    load_time = time.perf_counter() - start
+    report("load", 0.05)
+
+    # Apply preprocessing (including column filtering)
+    logger.debug("Applying preprocessing")
+    start = time.perf_counter()
+    plan = get_transform_plan(filename, df, options)
+    preprocessed_df = preprocess_data(df, options, plan)
+    preprocess_time = time.perf_counter() - start
+    logger.debug("Preprocessing complete. New shape: %s", preprocessed_df.shape)
+    report("preprocess", 0.1)
+
+    # Statistics kept up to date by appends are not computed again
+    state = _analysis_state(filename, options)
+    known = state.outputs(options.get('outlierMethod')) if state is not None else None
+    if known:
+        logger.info(f"Reusing incrementally updated {', '.join(known)} of {filename}")
+
+    # Perform analysis on preprocessed data
+    logger.debug("Performing analysis on preprocessed data")
+    analysis_result = analyze_data(preprocessed_df, include_timings=include_timings, outlier_method=options.get('outlierMethod'),
+                                   progress=lambda stage, completed, total: report(stage, 0.1 + 0.9 * completed / total),
+                                   cancel=cancel, known=known)
+    logger.debug("Analysis complete")
+    approximation = _plan_approximation(plan, len(df)) if not options.get('planFrom') else None
+    if approximation is not None:
+        analysis_result["approximations"]["preprocessing"] = approximation
+    # The handle addresses the result's sections and downsampled series, as for lazy requests
+    analysis_result = {"handle": cache_key, **analysis_result}
+    if state is not None and not state.outliers_valid:
+        # Appends moved the outlier bounds past the kept candidates, they are collected again
+        state.reset_outliers(preprocessed_df)
+        _save_analysis_state(filename, state)
+    result_cache.put(cache_key, {key: value for key, value in analysis_result.items() if key != "timings"})
+    if include_timings:
+        analysis_result["timings"]["load"] = {"wall": round(load_time, 4)}
+        analysis_result["timings"]["preprocess"] = {"wall": round(preprocess_time, 4)}
+
+    return analysis_result
+
+async def process_preprocessing_request(filename: str, options: dict, include_timings: bool = False, lazy: bool = False):
+    # The CPU-heavy work runs on the bounded job pool so the event loop keeps serving other clients
     try:
-        logger.info(f"Processing preprocessing request for file: {filename}")
-        logger.debug(f"Preprocessing options: {options}")
-
-        # Load the data
-        file_path = os.path.join(UPLOAD_DIRECTORY, filename)
-        logger.info(f"Loading data from: {file_path}")
-        df = pd.read_csv(file_path)
-        logger.info(f"Data loaded. Shape: {df.shape}")
-
-        # Apply preprocessing (including column filtering)
-        logger.info("Applying preprocessing")
-        preprocessed_df = preprocess_data(df, options)
-        logger.info(f"Preprocessing complete. New shape: {preprocessed_df.shape}")
-
-        # Perform analysis on preprocessed data
-        logger.info("Performing analysis on preprocessed data")
-        analysis_result = analyze_data(preprocessed_df)
-        logger.info("Analysis complete")
-        
-        return analysis_result
+        return await job_manager.run(run_preprocessing_request, filename, options, include_timings=include_timings, lazy=lazy)
     except Exception as e:
         logger.error(f"Error during preprocessing: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=400, detail=f"Error preprocessing data: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=f"Error preprocessing data: {str(e)}")
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from metrics import Gauge
+from profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# Analyses running at once; further jobs wait in the queue so one user can't starve the others
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", 2))
+# Finished jobs (and their results) are kept this long for clients to collect
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 3600))
+JOB_EVENT_POLL_SECONDS = 0.2
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self.cancel_event = threading.Event()
+        # Append-only, so event stream readers can follow along by position without locking
+        self.events = []
+
+    def emit(self, event, **data):
+        self.events.append({"event": event, "job_id": self.id, **data})
+
+    def report(self, step, fraction):
+        self.progress = fraction
+        self.emit("progress", stage=step, progress=round(fraction, 4))
+
+    def set_status(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.emit("status", status=status, progress=round(self.progress, 4), error=error)
+
+    def info(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+class JobManager:
+    # Runs CPU-heavy request handlers on a bounded pool of worker threads instead of the event loop.
+    # Job functions are called with progress=job.report and cancel=job.cancel_event.
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="analysis-job")
+            return self._executor
+
+    def submit(self, func, *args, **kwargs):
+        self._purge()
+        job = Job()
+        with self._lock:
+            self._jobs[job.id] = job
+        job.emit("status", status="queued", progress=0.0, error=None)
+        # A profiled request's job is profiled on the worker thread
+        job.future = self._get_executor().submit(profiled(self._run), job, func, args, kwargs)
+        return job
+
+    async def run(self, func, *args, **kwargs):
+        # For request handlers that wait for their own result: queued like any job, then forgotten
+        job = self.submit(func, *args, **kwargs)
+        try:
+            return await asyncio.wrap_future(job.future)
+        except asyncio.CancelledError:
+            # The request went away (e.g. the client disconnected): a queued job never starts and a
+            # running one stops at its next stage instead of finishing for no one
+            job.cancel_event.set()
+            raise
+        finally:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+
+    def _run(self, job, func, args, kwargs):
+        if job.cancel_event.is_set():
+            self._finish(job, "cancelled")
+            raise CancelledError("Job cancelled")
+        job.set_status("running")
+        try:
+            job.result = func(*args, progress=job.report, cancel=job.cancel_event, **kwargs)
+        except CancelledError:
+            self._finish(job, "cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}", exc_info=True)
+            self._finish(job, "failed", error=str(e))
+            raise
+        job.progress = 1.0
+        self._finish(job, "done")
+        return job.result
+
+    @staticmethod
+    def _finish(job, status, error=None):
+        # The final event goes out before the job is marked finished, so streams never miss it
+        job.set_status(status, error)
+        job.finished = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        # Jobs still in the queue never start; running ones stop at the next stage boundary
+        if job.future is not None and job.future.cancel():
+            self._finish(job, "cancelled")
+        return job
+
+    def status_counts(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {(status,): 0 for status in ("queued", "running")}
+        for job in jobs:
+            counts[(job.status,)] = counts.get((job.status,), 0) + 1
+        return counts
+
+    def _purge(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+                del self._jobs[job_id]
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+            executor, self._executor = self._executor, None
+        for job in jobs:
+            job.cancel_event.set()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+async def iter_job_events(job):
+    # Server-sent events for everything the job has emitted so far and from now on, until it finishes
+    sent = 0
+    while True:
+        events = job.events[sent:]
+        for event in events:
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        sent += len(events)
+        if job.finished is not None and sent == len(job.events):
+            return
+        await asyncio.sleep(JOB_EVENT_POLL_SECONDS)
+
+job_manager = JobManager(JOB_CONCURRENCY)
+
+JOBS = Gauge("analysis_jobs", "Analysis jobs known to the job manager by status, queued ones wait for a worker thread",
+             labels=("status",), collect=job_manager.status_counts)
@@ -1,8 +1,32 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from routes import router as api_router
+from analysis.worker_pool import start_pool, shutdown_pool
+from jobs import job_manager
+from metrics import Histogram
+from profiling import PROFILING_ENABLED, start_request_profile, stop_request_profile
 
-app = FastAPI()
+# DEBUG adds per-stage timings and column lists, which are costly to format on wide frames
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL)
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to the response headers of HTTP requests",
+                            labels=("method", "route", "status"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One long-lived analysis pool per server process instead of a fresh Pool per request
+    start_pool()
+    yield
+    job_manager.shutdown()
+    shutdown_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -10,8 +34,42 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id", "X-Profile-Url"],
 )
 
+# Profiled requests run one at a time: a profiler can't tell their threads apart, and from
+# Python 3.12 only one can be enabled at all
+profiled_requests = asyncio.Lock()
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    # ?profile=1 profiles the request's work and points to the artifact in the X-Profile-Url header.
+    # The event loop thread is profiled too (from Python 3.12 every thread), so the profile can
+    # include some of the unprofiled requests running meanwhile.
+    if PROFILING_ENABLED and request.query_params.get("profile") == "1":
+        async with profiled_requests:
+            return await _observe_request(request, call_next, profile=True)
+    return await _observe_request(request, call_next, profile=False)
+
+async def _observe_request(request: Request, call_next, profile: bool):
+    if profile:
+        request_profile, state = start_request_profile()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # Labelled by route template, not path, so file names don't make a series each
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                                route=route.path if route is not None else "unmatched", status=status)
+        if profile:
+            path = stop_request_profile(request_profile, state)
+    if profile and path is not None:
+        response.headers["X-Profile-Id"] = request_profile.id
+        response.headers["X-Profile-Url"] = f"/profiles/{request_profile.id}"
+    return response
 
 app.include_router(api_router)
 
@@ -0,0 +1,150 @@
+import contextvars
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIRECTORY = os.environ.get("PROFILE_DIRECTORY", "profiles")
+# Off by default: with this on, any client can profile a request with ?profile=1
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+# From Python 3.12 cProfile hooks into sys.monitoring: one profiler sees every thread of the
+# process and no second one can be enabled while it runs. Before that it only sees the thread
+# that enabled it, so each thread doing a request's work needs its own.
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+# Most recent artifacts kept on disk, older ones are removed as new ones are written
+PROFILE_RETENTION = int(os.environ.get("PROFILE_RETENTION", 50))
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_current = contextvars.ContextVar("request_profile", default=None)
+
+class RequestProfile:
+    # The profiles of every thread (before 3.12) and pool process doing a request's work, merged
+    # into one artifact at the end. Profiled requests must not overlap, see PROCESS_WIDE_PROFILER.
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self._profiles = []
+        self._files = []
+        self._lock = threading.Lock()
+
+    def profiler(self):
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profiler)
+        return profiler
+
+    def worker_path(self):
+        # Where a pool process dumps its stats for this request, merged by save()
+        os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+        path = os.path.abspath(os.path.join(PROFILE_DIRECTORY, f"{self.id}-{uuid.uuid4().hex}.part"))
+        with self._lock:
+            self._files.append(path)
+        return path
+
+    def save(self):
+        os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+        with self._lock:
+            profiles = [profile for profile in self._profiles if profile.getstats()]
+            profiles += [path for path in self._files if os.path.exists(path)]
+        path = profile_path(self.id) if profiles else None
+        if profiles:
+            pstats.Stats(*profiles).dump_stats(path)
+        for part in self._files:
+            if os.path.exists(part):
+                os.remove(part)
+        _evict_profiles()
+        if path is not None:
+            logger.info(f"Saved profile {self.id} from {len(profiles)} threads and workers")
+        return path
+
+def current_profile():
+    return _current.get()
+
+def start_request_profile():
+    # Profiles the calling thread and everything handed off through profiled() until the
+    # returned profile is stopped with stop_request_profile
+    request_profile = RequestProfile()
+    profiler = request_profile.profiler()
+    token = _current.set(request_profile)
+    profiler.enable()
+    return request_profile, (profiler, token)
+
+def stop_request_profile(request_profile, state):
+    profiler, token = state
+    profiler.disable()
+    _current.reset(token)
+    return request_profile.save()
+
+@contextmanager
+def profile_thread(request_profile=None):
+    # Profiles the calling thread for the current (or given) request, if it is being profiled
+    request_profile = request_profile or _current.get()
+    if request_profile is None or PROCESS_WIDE_PROFILER:
+        # The request's profiler already sees this thread
+        yield
+        return
+    profiler = request_profile.profiler()
+    token = _current.set(request_profile)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _current.reset(token)
+
+def profiled(func):
+    # func bound to the current request's profile, for handing to another thread. Outside a
+    # profiled request it is returned as it is.
+    request_profile = _current.get()
+    if request_profile is None:
+        return func
+
+    def run(*args, **kwargs):
+        with profile_thread(request_profile):
+            return func(*args, **kwargs)
+    return run
+
+def profiled_route(func):
+    # For sync routes: FastAPI runs them on its threadpool, which carries the request's context
+    # over but is not profiled otherwise
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        with profile_thread():
+            return func(*args, **kwargs)
+    return run
+
+def profile_path(profile_id):
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        raise ValueError(f"Invalid profile id: {profile_id}")
+    return os.path.join(PROFILE_DIRECTORY, f"{profile_id}.prof")
+
+def profile_report(profile_id, sort="cumulative", limit=50):
+    # The artifact as pstats text, for reading without loading it into a viewer
+    path = profile_path(profile_id)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Unknown profile: {profile_id}")
+    stream = io.StringIO()
+    pstats.Stats(path, stream=stream).sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+def _evict_profiles():
+    entries = []
+    for name in os.listdir(PROFILE_DIRECTORY):
+        if name.endswith(".prof"):
+            try:
+                entries.append((os.stat(os.path.join(PROFILE_DIRECTORY, name)).st_mtime, name))
+            except FileNotFoundError:
+                continue
+    for _, name in sorted(entries)[:max(len(entries) - PROFILE_RETENTION, 0)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIRECTORY, name))
+        except FileNotFoundError:
+            pass
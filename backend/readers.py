@@ -0,0 +1,263 @@
+import codecs
+import csv
+import json
+import logging
+import os
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the start of an upload to tell its encoding, delimiter and JSON layout
+SNIFF_BYTES = int(os.environ.get("SNIFF_BYTES", 64 * 1024))
+# "pyarrow" parses CSV blocks on all cores; "pandas" is the single-threaded C parser, which
+# files pyarrow can't read (e.g. duplicate headers or ragged rows) fall back to
+CSV_ENGINE = os.environ.get("CSV_ENGINE", "pyarrow")
+# pyarrow reads CSV this many bytes at a time, one chunk each; types are inferred from the first
+CSV_BLOCK_BYTES = int(os.environ.get("CSV_BLOCK_BYTES", 16 * 1024 * 1024))
+# Rows per chunk for the pandas CSV and JSON Lines readers
+CHUNK_ROWS = 100_000
+FORMATS = {'.csv': 'csv', '.tsv': 'csv', '.xlsx': 'xlsx', '.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+SUPPORTED_EXTENSIONS = tuple(FORMATS)
+# Formats read a chunk at a time, the others are parsed whole
+STREAMING_FORMATS = ('csv', 'jsonl')
+DELIMITERS = ',;\t|'
+# pandas' default missing value markers, so both CSV engines read the same cells as missing
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+             'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+# UTF-32 first, its little-endian mark starts like UTF-16's
+BOMS = ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'), (codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+CONVERSION_ERROR = re.compile(r"In CSV column #(\d+): .*CSV conversion error to \w+: invalid value '(.*)'", re.S)
+
+class CsvEngineError(ValueError):
+    # pyarrow can't read the file; it is read again with the pandas engine
+    pass
+
+def sniff_encoding(prefix: bytes) -> str:
+    for bom, encoding in BOMS:
+        if prefix.startswith(bom):
+            return encoding
+    try:
+        # The prefix may end inside a multi-byte character
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        prefix.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def sniff_delimiter(text: str, default: str = ',') -> str:
+    # Complete lines only, the prefix usually ends inside one
+    lines = text.splitlines()
+    lines = (lines[:-1] if len(lines) > 1 else lines)[:100]
+    if not lines:
+        return default
+    try:
+        delimiter = csv.Sniffer().sniff("\n".join(lines), delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        return default
+    # A single column can fool the sniffer into picking a character from its values
+    return delimiter if delimiter in lines[0] else default
+
+def _is_json_lines(text: str) -> bool:
+    # One object per line rather than one document: the first line parses on its own and more
+    # follow. A document on a single line (e.g. DataFrame.to_json) has nothing after it.
+    lines = [line for line in text.splitlines() if line.strip()][:2]
+    if len(lines) < 2 or not lines[0].lstrip().startswith('{'):
+        return False
+    try:
+        json.loads(lines[0])
+    except ValueError:
+        return False
+    return True
+
+def sniff(path: str, filename: str = None) -> dict:
+    # The format comes from the original filename (the data may sit in a temporary path), the
+    # encoding, delimiter and JSON layout from the first bytes
+    extension = os.path.splitext(filename or path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError("Unsupported file format")
+    dialect = {"format": FORMATS[extension]}
+    if dialect["format"] == 'xlsx':
+        return dialect
+    with open(path, 'rb') as f:
+        prefix = f.read(SNIFF_BYTES)
+    dialect["encoding"] = sniff_encoding(prefix)
+    text = codecs.getincrementaldecoder(dialect["encoding"])(errors='replace').decode(prefix, final=False)
+    if dialect["format"] == 'json' and _is_json_lines(text):
+        dialect["format"] = 'jsonl'
+    elif dialect["format"] == 'csv':
+        dialect["delimiter"] = sniff_delimiter(text, '\t' if extension == '.tsv' else ',')
+        # Quoted values may hold line breaks, then pyarrow can't split blocks at any newline
+        dialect["quoted"] = '"' in text
+        dialect["engine"] = CSV_ENGINE
+    return dialect
+
+def _frame(df: pd.DataFrame) -> pd.DataFrame:
+    # Arrow needs string column names (Excel headers can be numbers)
+    df.columns = df.columns.astype(str)
+    return df
+
+def _arrow_encoding(encoding: str) -> str:
+    # pyarrow decodes UTF-8 itself and skips its byte order mark
+    return 'utf8' if encoding in ('utf-8', 'utf-8-sig') else encoding
+
+def _csv_options(dialect: dict, column_types: dict, skip_rows: int = 0):
+    read_options = pa_csv.ReadOptions(encoding=_arrow_encoding(dialect["encoding"]), block_size=CSV_BLOCK_BYTES,
+                                      skip_rows_after_names=skip_rows)
+    parse_options = pa_csv.ParseOptions(delimiter=dialect["delimiter"], newlines_in_values=dialect["quoted"])
+    convert_options = pa_csv.ConvertOptions(column_types=column_types, null_values=NA_VALUES, strings_can_be_null=True)
+    return {"read_options": read_options, "parse_options": parse_options, "convert_options": convert_options}
+
+def _check_names(names):
+    # pandas renames duplicate and blank headers, pyarrow would keep them
+    if len(set(names)) != len(names) or '' in names:
+        raise CsvEngineError("The header has duplicate or blank column names")
+
+def _text_temporals(schema, column_types: dict) -> dict:
+    # Dates stay text like with pandas, schema inference decides how they are stored
+    return {field.name: pa.string() for field in schema
+            if pa.types.is_temporal(field.type) and field.name not in column_types}
+
+def _open_arrow_csv(path: str, dialect: dict, column_types: dict, skip_rows: int):
+    reader = pa_csv.open_csv(path, **_csv_options(dialect, column_types, skip_rows))
+    _check_names(reader.schema.names)
+    temporals = _text_temporals(reader.schema, column_types)
+    if temporals:
+        reader.close()
+        column_types.update(temporals)
+        reader = pa_csv.open_csv(path, **_csv_options(dialect, column_types, skip_rows))
+    return reader
+
+def _arrow_frame(data) -> pd.DataFrame:
+    # Columns without any value are typed null by pyarrow, pandas reads them as float
+    if any(pa.types.is_null(field.type) for field in data.schema):
+        data = data.cast(pa.schema([pa.field(field.name, pa.float64()) if pa.types.is_null(field.type) else field
+                                    for field in data.schema]))
+    return data.to_pandas()
+
+def _is_float(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+def _iter_arrow_csv(path: str, dialect: dict, dtypes: dict = None):
+    # With dtypes every column's type is fixed. Otherwise types are inferred from the first block,
+    # and when a later block has a value that doesn't convert, the file is reopened past the rows
+    # already read with that column widened to float or text; chunks then differ in dtype like
+    # pandas' chunks do.
+    column_types = {column: _arrow_type(dtype) for column, dtype in dtypes.items()} if dtypes else {}
+    rows = 0
+    while True:
+        try:
+            reader = _open_arrow_csv(path, dialect, column_types, rows)
+        except pa.ArrowInvalid as e:
+            raise CsvEngineError(str(e)) from e
+        try:
+            for batch in reader:
+                rows += batch.num_rows
+                yield _arrow_frame(batch)
+            return
+        except pa.ArrowInvalid as e:
+            match = CONVERSION_ERROR.search(str(e))
+            if dtypes or match is None:
+                raise CsvEngineError(str(e)) from e
+            column = reader.schema.names[int(match.group(1))]
+            current = reader.schema.field(column).type
+            widened = pa.float64() if _is_float(match.group(2)) and not pa.types.is_floating(current) else pa.string()
+            if current == widened:
+                raise CsvEngineError(str(e)) from e
+            logger.debug("Reading column %s of %s as %s from row %d", column, path, widened, rows)
+            column_types[column] = widened
+        finally:
+            reader.close()
+
+def _arrow_type(dtype) -> pa.DataType:
+    return pa.string() if np.dtype(dtype) == np.dtype('object') else pa.from_numpy_dtype(dtype)
+
+def _iter_pandas_csv(path: str, dialect: dict, dtypes: dict = None):
+    yield from pd.read_csv(path, chunksize=CHUNK_ROWS, sep=dialect["delimiter"], encoding=dialect["encoding"], dtype=dtypes)
+
+def _cast_chunk(chunk: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    # JSON records may leave keys out and a key's values may change type between records, so
+    # chunks are given every column as the shared dtype; text columns get other values as text
+    chunk = chunk.reindex(columns=list(dtypes))
+    for column, dtype in dtypes.items():
+        series = chunk[column]
+        if dtype == np.dtype('object'):
+            if pd.api.types.infer_dtype(series, skipna=True) not in ('string', 'empty'):
+                chunk[column] = series.astype(object).where(series.isnull(), series.astype(str))
+        elif series.dtype != dtype:
+            chunk[column] = series.astype(dtype)
+    return chunk
+
+def _iter_json_lines(path: str, dialect: dict, dtypes: dict = None):
+    # Values keep their JSON types, strings aren't parsed into dates or numbers here (schema
+    # inference decides that like for CSV)
+    with pd.read_json(path, lines=True, chunksize=CHUNK_ROWS, encoding=dialect["encoding"], dtype=False,
+                      convert_dates=False) as reader:
+        for chunk in reader:
+            chunk = _frame(chunk)
+            if dtypes is not None:
+                yield _cast_chunk(chunk, dtypes)
+                continue
+            # Keys that are null throughout a chunk come back as objects, pandas' CSV reader
+            # reads such columns as float
+            empty = [column for column in chunk.select_dtypes(include='object').columns if chunk[column].isnull().all()]
+            yield chunk.astype({column: np.float64 for column in empty}) if empty else chunk
+
+def iter_chunks(path: str, dialect: dict, dtypes: dict = None):
+    # DataFrames of consecutive rows of a CSV or JSON Lines file. Without dtypes each chunk's
+    # types are its own; with them (a second pass) every chunk has exactly those columns and dtypes.
+    if dialect["format"] == 'jsonl':
+        yield from _iter_json_lines(path, dialect, dtypes)
+    elif dialect["format"] != 'csv':
+        raise ValueError(f"{dialect['format']} files can't be read in chunks")
+    elif dialect["engine"] == 'pyarrow':
+        yield from _iter_arrow_csv(path, dialect, dtypes)
+    else:
+        for chunk in _iter_pandas_csv(path, dialect, dtypes):
+            yield _frame(chunk)
+
+def _read_arrow_csv(path: str, dialect: dict) -> pd.DataFrame:
+    # Read whole, pyarrow unifies the types of all blocks
+    column_types = {}
+    table = pa_csv.read_csv(path, **_csv_options(dialect, column_types))
+    _check_names(table.schema.names)
+    temporals = _text_temporals(table.schema, column_types)
+    if temporals:
+        table = pa_csv.read_csv(path, **_csv_options(dialect, temporals))
+    return _arrow_frame(table)
+
+def read_xlsx(path: str) -> pd.DataFrame:
+    # calamine (Rust) is many times faster than openpyxl, when it is installed
+    return pd.read_excel(path, engine='calamine' if python_calamine is not None else 'openpyxl')
+
+def read_frame(path: str, dialect: dict) -> pd.DataFrame:
+    # The whole file as one DataFrame
+    if dialect["format"] == 'xlsx':
+        return _frame(read_xlsx(path))
+    if dialect["format"] == 'json':
+        return _frame(pd.read_json(path, encoding=dialect["encoding"]))
+    if dialect["format"] == 'jsonl':
+        return _frame(pd.read_json(path, lines=True, encoding=dialect["encoding"], dtype=False, convert_dates=False))
+    if dialect["engine"] == 'pyarrow':
+        try:
+            return _frame(_read_arrow_csv(path, dialect))
+        except (CsvEngineError, pa.ArrowInvalid) as e:
+            logger.warning(f"pyarrow can't read {path} ({str(e)}), parsing it with pandas")
+    return _frame(pd.read_csv(path, sep=dialect["delimiter"], encoding=dialect["encoding"]))
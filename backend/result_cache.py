@@ -0,0 +1,279 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_DIRECTORY = os.environ.get("RESULT_CACHE_DIRECTORY", "result_cache")
+RESULT_CACHE_MEMORY_BYTES = int(os.environ.get("RESULT_CACHE_MEMORY_BYTES", 256 * 1024 * 1024))
+RESULT_CACHE_DISK_BYTES = int(os.environ.get("RESULT_CACHE_DISK_BYTES", 2 * 1024 * 1024 * 1024))
+
+# Eviction removes entries until the directory is this share of its budget, so the next scan is
+# many puts away
+DISK_EVICTION_TARGET = 0.9
+# put_many writes its items as one bundle file and appends a "<key>\t<bundle file>" line per key here
+BUNDLE_INDEX = "bundles.idx"
+
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result (memory_hit, disk_hit or miss)",
+                        labels=("cache", "result"))
+
+def hash_options(options):
+    # Canonical JSON so key order and whitespace in the request don't change the key
+    canonical = json.dumps(options, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _remove_quietly(path):
+    # Another worker process may have evicted the same entry first
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class ResultCache:
+    # Two tiers: an in-process LRU of result objects and a directory of pickles shared across workers.
+    # Keys are "<content hash>-<options hash>" so all results for one file version share a prefix.
+    def __init__(self, directory, memory_bytes, disk_bytes, name="result"):
+        # name labels the cache's lookups in the metrics
+        self.name = name
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        # Bytes in the directory as this process knows them: scanned when first needed and after
+        # evictions, counted up by its own writes in between. Other processes' writes are only
+        # seen at the next scan, so the directory can run over budget by what they wrote since.
+        self._disk_used = None
+        # {key: bundle file} as read from the index, and how far it was read: (inode, offset)
+        self._bundles = {}
+        self._index_position = (None, 0)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_hash, options):
+        return f"{content_hash}-{hash_options(options)}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        # {key: value} for the keys found, each bundle holding some of them is read once
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    CACHE_LOOKUPS.inc(cache=self.name, result="memory_hit")
+                    found[key] = self._memory[key][0]
+        remaining = [key for key in keys if key not in found]
+        if not remaining:
+            return found
+
+        bundles = self._refresh_index()
+        by_bundle = {}
+        for key in remaining:
+            if key in bundles:
+                by_bundle.setdefault(bundles[key], []).append(key)
+            else:
+                value = self._read_entry(key)
+                if value is not None:
+                    found[key] = value
+        for bundle, bundle_keys in by_bundle.items():
+            entries = self._read_bundle(bundle)
+            for key in bundle_keys:
+                if key in entries:
+                    found[key] = entries[key]
+        for key in remaining:
+            CACHE_LOOKUPS.inc(cache=self.name, result="disk_hit" if key in found else "miss")
+        return found
+
+    def _read_entry(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                payload = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        value = pickle.loads(payload)
+        self._remember(key, value, len(payload))
+        return value
+
+    def _read_bundle(self, bundle):
+        # Every entry of the bundle is kept in memory, the next lookups of its keys are memory hits
+        path = os.path.join(self.directory, bundle)
+        try:
+            with open(path, "rb") as f:
+                payload = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted since the index was read
+            return {}
+        entries = pickle.loads(payload)
+        size = len(payload) // max(1, len(entries))
+        for key, value in entries.items():
+            self._remember(key, value, size)
+        return entries
+
+    def _refresh_index(self):
+        # Reads the index lines appended since the last call. A rewritten index (another inode or
+        # shorter than what was read) is read again from the start.
+        path = os.path.join(self.directory, BUNDLE_INDEX)
+        with self._lock:
+            try:
+                with open(path, "rb") as f:
+                    stat = os.fstat(f.fileno())
+                    inode, offset = self._index_position
+                    if stat.st_ino != inode or stat.st_size < offset:
+                        self._bundles, offset = {}, 0
+                    f.seek(offset)
+                    appended = f.read()
+            except FileNotFoundError:
+                self._bundles, self._index_position = {}, (None, 0)
+                return self._bundles
+            # Only whole lines, another process may be writing the last one
+            end = appended.rfind(b"\n") + 1
+            for line in appended[:end].decode('utf-8').splitlines():
+                key, _, bundle = line.partition("\t")
+                self._bundles[key] = bundle
+            self._index_position = (stat.st_ino, offset + end)
+            return self._bundles
+
+    def _rewrite_index(self, keep):
+        # Drops the index lines for which keep(key, bundle) is false. Lines another process
+        # appends while this runs are lost, their bundles are then only reclaimed by eviction.
+        path = os.path.join(self.directory, BUNDLE_INDEX)
+        try:
+            with open(path, "rb") as f:
+                lines = f.read().decode('utf-8').splitlines(keepends=True)
+        except FileNotFoundError:
+            return
+        kept = [line for line in lines if line.endswith("\n") and keep(*line.rstrip("\n").partition("\t")[::2])]
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            f.writelines(kept)
+        os.replace(tmp_path, path)
+
+    def put(self, key, value):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, value, len(payload))
+        if len(payload) > self.disk_bytes:
+            return
+        tmp_path = self._disk_path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, self._disk_path(key))
+        self._count_written(len(payload))
+
+    def put_many(self, items):
+        # Writes every {key: value} as one bundle, a single file and index append however many
+        # items there are
+        if not items:
+            return
+        payload = pickle.dumps(items, protocol=pickle.HIGHEST_PROTOCOL)
+        size = len(payload) // len(items)
+        for key, value in items.items():
+            self._remember(key, value, size)
+        if len(payload) > self.disk_bytes:
+            return
+        bundle = f"bundle-{uuid.uuid4().hex}.pkl"
+        tmp_path = os.path.join(self.directory, bundle + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, os.path.join(self.directory, bundle))
+        # One unbuffered write in append mode, so lines of processes appending at once don't interleave
+        lines = "".join(f"{key}\t{bundle}\n" for key in items).encode('utf-8')
+        with open(os.path.join(self.directory, BUNDLE_INDEX), "ab", buffering=0) as f:
+            f.write(lines)
+        self._count_written(len(payload))
+
+    def _count_written(self, written):
+        # Checks the disk budget after a write of this many bytes
+        with self._lock:
+            if self._disk_used is None:
+                over_budget = None
+            else:
+                self._disk_used += written
+                over_budget = self._disk_used > self.disk_bytes
+        if over_budget is None:
+            # The first write of this process: the scan already sees what it wrote
+            over_budget = self._scan_disk()[1] > self.disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _remember(self, key, value, size):
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_used -= self._memory.pop(key)[1]
+            self._memory[key] = (value, size)
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_used -= evicted_size
+
+    def _scan_disk(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        used = sum(size for _, size, _ in entries)
+        with self._lock:
+            self._disk_used = used
+        return entries, used
+
+    def _evict_disk(self):
+        entries, used = self._scan_disk()
+        target = self.disk_bytes * DISK_EVICTION_TARGET
+        if used <= self.disk_bytes:
+            return
+        # Least recently used first, reads touch the file's mtime
+        removed = set()
+        for _, size, name in sorted(entries):
+            if used <= target:
+                break
+            _remove_quietly(os.path.join(self.directory, name))
+            removed.add(name)
+            used -= size
+        with self._lock:
+            self._disk_used = used
+        if any(name.startswith("bundle-") for name in removed):
+            self._rewrite_index(lambda key, bundle: bundle not in removed)
+
+    def invalidate(self, content_hash):
+        prefix = f"{content_hash}-"
+        with self._lock:
+            for key in [key for key in self._memory if key.startswith(prefix)]:
+                self._memory_used -= self._memory.pop(key)[1]
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix):
+                _remove_quietly(os.path.join(self.directory, name))
+        # Their bundles may hold other keys too, they stay until evicted
+        self._rewrite_index(lambda key, bundle: not key.startswith(prefix))
+        with self._lock:
+            self._disk_used = None
+        logger.info(f"Invalidated cached results for content {content_hash}")
+
+result_cache = ResultCache(RESULT_CACHE_DIRECTORY, RESULT_CACHE_MEMORY_BYTES, RESULT_CACHE_DISK_BYTES)
@@ -1,8 +1,21 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
 from pydantic import BaseModel, Field
-from typing import Dict, Any, Optional
-from data_processor import process_uploaded_file, process_preprocessing_request
+from typing import Dict, Any, List, Literal, Optional
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from data_processor import (process_uploaded_file, process_append_request, process_preprocessing_request, run_preprocessing_request,
+                            get_streaming_summary, get_line_series, get_scatter_density, get_analysis_section,
+                            get_component_series, get_pca_density,
+                            query_group_by, query_histogram, query_pair_counts)
+from analysis.aggregation import GROUP_LIMIT
+from analysis.downsampling import DENSITY_GRID_BINS
+from analysis.outlier_detection import OUTLIER_METHODS
+from serialization import RESPONSE_FORMATS, render_analysis
+from jobs import iter_job_events, job_manager
+from readers import SUPPORTED_EXTENSIONS
+from metrics import render_metrics
+from profiling import profile_path, profile_report, profiled_route
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -19,16 +32,27 @@ class ColumnOption(BaseModel):
 
 class PreprocessingOptions(BaseModel):
     columnOptions: Dict[str, ColumnOption]
+    # zscore, iqr or isolation_forest; unset uses the server's OUTLIER_METHOD
+    outlierMethod: Optional[Literal[OUTLIER_METHODS]] = None
+    use_standard_scaler: bool = False
+    # Apply the transform plan fitted on this upload instead of fitting one on the data itself
+    planFrom: Optional[str] = None
 
 class PreprocessingRequest(BaseModel):
     filename: str
     options: PreprocessingOptions
+    includeTimings: bool = False
+    # json, or columnar to send long numeric lists as typed base64 blocks
+    responseFormat: str = "json"
+    streamResponse: bool = False
+    # Return a handle and the cheap sections only, the rest is fetched from /analysis/{handle}/{section}
+    lazy: bool = False
 
 @router.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     try:
-        if not file.filename.endswith(('.csv', '.xlsx', '.json')):
-            raise ValueError("Unsupported file format. Please upload a CSV, XLSX, or JSON file.")
+        if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+            raise ValueError("Unsupported file format. Please upload a CSV, TSV, XLSX, JSON, or JSON Lines file.")
         
         file_info = await process_uploaded_file(file)
         return file_info
@@ -36,13 +60,195 @@ async def upload_file(file: UploadFile = File(...)):
         logger.error(f"Error during file upload: {str(e)}", exc_info=True)
         raise HTTPException(status_code=400, detail=str(e))
 
+# New rows for an uploaded dataset, in a file with the same columns
+@router.post("/append/{filename}")
+async def append_rows_route(filename: str, file: UploadFile = File(...)):
+    try:
+        if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+            raise ValueError("Unsupported file format. Please upload a CSV, TSV, XLSX, JSON, or JSON Lines file.")
+        return await process_append_request(filename, file)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error during append: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/preprocess")
 async def preprocess_data_route(request: PreprocessingRequest):
     try:
         logger.info(f"Received preprocessing request for file: {request.filename}")
-        logger.debug(f"Preprocessing options: {request.options}")
-        result = await process_preprocessing_request(request.filename, request.options.dict())
-        return result
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Preprocessing options: %s", request.options)
+        if request.responseFormat not in RESPONSE_FORMATS:
+            raise ValueError(f"Unknown response format: {request.responseFormat}")
+        result = await process_preprocessing_request(request.filename, request.options.dict(), include_timings=request.includeTimings,
+                                                     lazy=request.lazy)
+        return render_analysis(result, request.responseFormat, stream=request.streamResponse)
     except Exception as e:
         logger.error(f"Error during preprocessing: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Downsampled series derived by an analysis, for the charts that plot them
+@router.get("/analysis/{handle}/lod/line/{column}")
+@profiled_route
+def component_series_route(handle: str, column: str, component: str = "trend", start: Optional[float] = None,
+                           end: Optional[float] = None, pixels: int = Query(1000, ge=1), method: str = "minmax"):
+    try:
+        return get_component_series(handle, column, component=component, start=start, end=end, pixels=pixels,
+                                    method=method)
+    except Exception as e:
+        logger.error(f"Error downsampling series: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/analysis/{handle}/lod/scatter")
+@profiled_route
+def pca_density_route(handle: str, cluster: Optional[int] = None, x_min: Optional[float] = None,
+                      x_max: Optional[float] = None, y_min: Optional[float] = None, y_max: Optional[float] = None,
+                      bins: int = Query(200, ge=1, le=DENSITY_GRID_BINS)):
+    try:
+        return get_pca_density(handle, cluster=cluster, x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max, bins=bins)
+    except Exception as e:
+        logger.error(f"Error computing scatter density: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/analysis/{handle}/{section}")
+@profiled_route
+def analysis_section_route(handle: str, section: str, offset: int = 0, limit: Optional[int] = None,
+                           response_format: str = "json"):
+    try:
+        if response_format not in RESPONSE_FORMATS:
+            raise ValueError(f"Unknown response format: {response_format}")
+        return render_analysis(get_analysis_section(handle, section, offset=offset, limit=limit), response_format)
+    except Exception as e:
+        logger.error(f"Error computing analysis section: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/summary/{filename}")
+@profiled_route
+def streaming_summary_route(filename: str):
+    try:
+        # Rendered like analysis results: statistics of short or empty columns are NaN, sent as null
+        return render_analysis(get_streaming_summary(filename))
+    except Exception as e:
+        logger.error(f"Error computing summary: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Viewport bounds are in chart coordinates: numbers, or epoch milliseconds for date columns
+@router.get("/lod/line/{filename}")
+@profiled_route
+def line_series_route(filename: str, y: str, x: Optional[str] = None, start: Optional[float] = None,
+                      end: Optional[float] = None, pixels: int = Query(1000, ge=1), method: str = "minmax"):
+    try:
+        return get_line_series(filename, y, x=x, start=start, end=end, pixels=pixels, method=method)
+    except Exception as e:
+        logger.error(f"Error downsampling series: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/lod/scatter/{filename}")
+@profiled_route
+def scatter_density_route(filename: str, x: str, y: str, x_min: Optional[float] = None, x_max: Optional[float] = None,
+                          y_min: Optional[float] = None, y_max: Optional[float] = None,
+                          bins: int = Query(200, ge=1, le=DENSITY_GRID_BINS)):
+    try:
+        return get_scatter_density(filename, x, y, x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max, bins=bins)
+    except Exception as e:
+        logger.error(f"Error computing scatter density: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Aggregates computed over the stored dataset, so charts don't need its rows. Column lists are
+# repeated parameters, e.g. ?by=region&by=product.
+@router.get("/query/groupby/{filename}")
+@profiled_route
+def group_by_route(filename: str, by: List[str] = Query([]), value: Optional[str] = None,
+                   aggregations: List[str] = Query(["count"]), quantiles: List[float] = Query([]), order: str = "size",
+                   limit: int = GROUP_LIMIT):
+    try:
+        return query_group_by(filename, by, value=value, aggregations=aggregations, quantiles=quantiles, order=order,
+                              limit=limit)
+    except Exception as e:
+        logger.error(f"Error computing group-by: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Equal-width bins over [min, max] (default: the column's extent), or the given edges
+@router.get("/query/histogram/{filename}")
+@profiled_route
+def histogram_route(filename: str, column: str, bins: int = 30, min: Optional[float] = None, max: Optional[float] = None,
+                    edges: Optional[List[float]] = Query(None), by: Optional[str] = None, limit: int = GROUP_LIMIT):
+    try:
+        return query_histogram(filename, column, bins=bins, value_min=min, value_max=max, edges=edges, by=by, limit=limit)
+    except Exception as e:
+        logger.error(f"Error computing histogram: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/query/pairs/{filename}")
+@profiled_route
+def pair_counts_route(filename: str, columns: List[str] = Query(...), bins: int = 20):
+    try:
+        return query_pair_counts(filename, columns, bins=bins)
+    except Exception as e:
+        logger.error(f"Error computing pair counts: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+@router.post("/jobs")
+async def submit_job_route(request: PreprocessingRequest):
+    if request.responseFormat not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown response format: {request.responseFormat}")
+    job = job_manager.submit(run_preprocessing_request, request.filename, request.options.dict(),
+                             include_timings=request.includeTimings, lazy=request.lazy)
+    return job.info()
+
+@router.get("/jobs/{job_id}")
+async def job_status_route(job_id: str):
+    return _get_job(job_id).info()
+
+@router.get("/jobs/{job_id}/events")
+async def job_events_route(job_id: str):
+    return StreamingResponse(iter_job_events(_get_job(job_id)), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@router.get("/jobs/{job_id}/result")
+@profiled_route
+def job_result_route(job_id: str, response_format: str = "json", stream: bool = False):
+    job = _get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=400, detail=job.error)
+    if job.status == "cancelled":
+        raise HTTPException(status_code=410, detail="Job was cancelled")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown response format: {response_format}")
+    return render_analysis(job.result, response_format, stream=stream)
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job_route(job_id: str):
+    _get_job(job_id)
+    return job_manager.cancel(job_id).info()
+
+@router.get("/metrics")
+def metrics_route():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# Profiles of ?profile=1 requests: the pstats file (for snakeviz or `python -m pstats`), or its
+# top functions as text
+@router.get("/profiles/{profile_id}")
+def profile_route(profile_id: str, format: str = "prof", sort: str = "cumulative", limit: int = 50):
+    try:
+        if format == "text":
+            return PlainTextResponse(profile_report(profile_id, sort=sort, limit=limit))
+        if format != "prof":
+            raise ValueError(f"Unknown profile format: {format}")
+        path = profile_path(profile_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Unknown profile: {profile_id}")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
@@ -0,0 +1,199 @@
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+# Strings become categories while they have at most this many distinct values...
+CATEGORY_MAX_UNIQUE = int(os.environ.get("CATEGORY_MAX_UNIQUE", 10_000))
+# ...and repeat enough for the codes to be smaller than the strings
+CATEGORY_MAX_UNIQUE_RATIO = float(os.environ.get("CATEGORY_MAX_UNIQUE_RATIO", 0.5))
+INTEGER_TYPES = [np.dtype(name) for name in ('int8', 'int16', 'int32', 'int64')]
+# Integers float32 still holds exactly, for columns mixing integer and float chunks
+FLOAT32_EXACT_INTEGER = 1 << 24
+
+class ColumnInference:
+    # What one column's values allow, gathered chunk by chunk. Only lossless conversions are
+    # inferred: integers to the smallest type holding their range, floats to float32 when every
+    # value survives the round trip, strings to datetimes when every value parses with one
+    # format, and to categories when they repeat.
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.float32 = True
+        self.strings = True
+        self.date_format = None
+        self.dates = True
+        self.categories = set()
+
+    def update(self, series):
+        values = series.dropna()
+        self.count += len(values)
+        if not len(values):
+            return
+        kind = series.dtype.kind
+        if kind in 'iuf':
+            # Chunks of one column can be parsed as different types, the type all of them share
+            # is only known at the end
+            self.strings = self.dates = False
+            self.min = min(self.min, values.min()) if self.min is not None else values.min()
+            self.max = max(self.max, values.max()) if self.max is not None else values.max()
+            if kind in 'iu':
+                self.float32 = self.float32 and max(abs(int(values.min())), abs(int(values.max()))) <= FLOAT32_EXACT_INTEGER
+            elif self.float32:
+                array = values.to_numpy()
+                with warnings.catch_warnings():
+                    # Values beyond float32's range overflow to inf and fail the comparison
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    self.float32 = bool(np.array_equal(array.astype(np.float32).astype(np.float64), array))
+        elif self.strings:
+            if kind != 'O' or pd.api.types.infer_dtype(values, skipna=True) != 'string':
+                self.strings = self.dates = False
+                return
+            if self.dates:
+                self._update_dates(values)
+            if self.categories is not None:
+                self.categories.update(values.unique())
+                if len(self.categories) > CATEGORY_MAX_UNIQUE:
+                    self.categories = None
+
+    def _update_dates(self, values):
+        if self.date_format is None:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning)
+                self.date_format = guess_datetime_format(values.iloc[0])
+        if self.date_format is None or '%z' in self.date_format:
+            # Offsets would make the column timezone-aware, it is kept as text
+            self.dates = False
+            return
+        parsed = pd.to_datetime(values, format=self.date_format, errors='coerce')
+        self.dates = not parsed.isnull().any()
+
+    def target(self, dtype):
+        # The dtype name to store a column of the given dtype as, None to keep it as it is
+        if dtype.kind == 'i' and self.min is not None:
+            for smaller in INTEGER_TYPES:
+                info = np.iinfo(smaller)
+                if info.min <= self.min and self.max <= info.max:
+                    return smaller.name if smaller.itemsize < dtype.itemsize else None
+        if dtype.kind == 'f' and self.float32 and dtype.itemsize > 4:
+            return 'float32'
+        if dtype == np.dtype('object') and self.strings and self.count:
+            if self.dates:
+                return 'datetime64[ns]'
+            if self.categories is not None and len(self.categories) <= CATEGORY_MAX_UNIQUE_RATIO * self.count:
+                return 'category'
+        return None
+
+class SchemaInference:
+    def __init__(self):
+        self.columns = {}
+
+    def update(self, chunk):
+        for column in chunk.columns:
+            self.columns.setdefault(column, ColumnInference()).update(chunk[column])
+        return self
+
+    def schema(self, dtypes):
+        # {column: {"dtype": target dtype name, plus "categories" or "format" where needed}} for
+        # the columns of the given dtypes that can be stored smaller
+        schema = {}
+        for column, inference in self.columns.items():
+            dtype = inference.target(np.dtype(dtypes[column]))
+            if dtype == 'category':
+                schema[column] = {"dtype": dtype, "categories": sorted(inference.categories)}
+            elif dtype == 'datetime64[ns]':
+                schema[column] = {"dtype": dtype, "format": inference.date_format}
+            elif dtype is not None:
+                schema[column] = {"dtype": dtype}
+        return schema
+
+def apply_schema(df, schema):
+    # Converts a frame (or one chunk of it) to the inferred dtypes. Categories are fixed up
+    # front, so every chunk of a file shares one dictionary.
+    converted = {}
+    for column, target in schema.items():
+        if column not in df.columns:
+            continue
+        if target["dtype"] == 'category':
+            converted[column] = pd.Categorical(df[column], categories=target["categories"])
+        elif target["dtype"] == 'datetime64[ns]':
+            converted[column] = pd.to_datetime(df[column], format=target["format"])
+        else:
+            converted[column] = df[column].astype(target["dtype"])
+    return df.assign(**converted) if converted else df
+
+def infer_schema(df):
+    return SchemaInference().update(df).schema(df.dtypes.to_dict())
+
+def memory_usage(df):
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+def _conform_integers(series, dtype):
+    # The stored integer type, or the smallest wider one holding the new values; floats once
+    # there are missing or fractional values
+    values = series.dropna()
+    if series.dtype.kind == 'f':
+        if len(values) < len(series) or not np.array_equal(values, np.floor(values)):
+            return series.astype('float64')
+    if not len(values):
+        return series.astype(dtype)
+    low, high = int(values.min()), int(values.max())
+    for wider in INTEGER_TYPES:
+        info = np.iinfo(wider)
+        if wider.itemsize >= dtype.itemsize and info.min <= low and high <= info.max:
+            return series.astype(wider)
+    return series.astype('float64')
+
+def _conform_floats(series, dtype):
+    if dtype == np.dtype('float32'):
+        inference = ColumnInference()
+        inference.update(series)
+        if inference.float32:
+            return series.astype('float32')
+    return series.astype('float64')
+
+def _as_strings(series):
+    return series.where(series.isnull(), series.astype(str)).astype(object)
+
+def conform_batch(df, dtypes):
+    # New rows for a stored dataset, converted to its dtypes (given as names). Numbers that
+    # don't fit get a wider type, new categories are added; values that can't be read as the
+    # column's type (text in a numeric column, unparseable dates) raise a ValueError.
+    df.columns = df.columns.astype(str)
+    missing = [column for column in dtypes if column not in df.columns]
+    extra = [column for column in df.columns if column not in dtypes]
+    if missing or extra:
+        raise ValueError(f"The new rows must have the dataset's columns; missing: {missing}, unexpected: {extra}")
+    converted = {}
+    for column, name in dtypes.items():
+        series = df[column]
+        if name == 'category':
+            converted[column] = _as_strings(series).astype('category')
+        elif name.startswith('datetime64'):
+            values = series.dropna()
+            date_format = guess_datetime_format(str(values.iloc[0])) if len(values) and series.dtype.kind == 'O' else None
+            try:
+                converted[column] = pd.to_datetime(series, format=date_format)
+            except (ValueError, TypeError) as e:
+                raise ValueError(f"Column {column} holds dates, the new values can't be parsed: {e}")
+            if converted[column].dt.tz is not None:
+                raise ValueError(f"Column {column} holds dates without a time zone, the new values have one")
+        elif name == 'object':
+            converted[column] = _as_strings(series) if series.dtype.kind != 'O' else series
+        else:
+            dtype = np.dtype(name)
+            if dtype.kind in 'iuf' and series.dtype.kind not in 'iufb':
+                if series.notna().any():
+                    raise ValueError(f"Column {column} holds numbers, the new values are {series.dtype}")
+                series = series.astype('float64')
+            if dtype.kind in 'iu':
+                converted[column] = _conform_integers(series, dtype)
+            elif dtype.kind == 'f':
+                converted[column] = _conform_floats(series, dtype)
+            elif dtype.kind == 'b' and series.dtype.kind != 'b':
+                raise ValueError(f"Column {column} holds booleans, the new values are {series.dtype}")
+            else:
+                converted[column] = series
+    return pd.DataFrame(converted, index=df.index)[list(dtypes)]
@@ -0,0 +1,127 @@
+import base64
+import datetime
+import json
+import math
+import os
+import numpy as np
+import pandas as pd
+from fastapi.responses import Response, StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RESPONSE_FORMATS = ('json', 'columnar')
+# Numeric lists shorter than this stay plain JSON, the block header would outweigh the savings
+BLOCK_MIN_LENGTH = int(os.environ.get("BLOCK_MIN_LENGTH", 256))
+# Floats are sent at chart precision in columnar responses
+BLOCK_FLOAT_DTYPE = np.dtype(os.environ.get("BLOCK_FLOAT_DTYPE", "float32")).newbyteorder('<')
+BLOCK_INT_DTYPE = np.dtype('<i4')
+# Sections that repeat another section, sent once and referenced as {"$ref": <section>}
+DUPLICATE_SECTIONS = {"pca_result": "pca_data"}
+
+def _default(obj):
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return None if not np.isfinite(obj) else float(obj)
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.ndarray):
+        return _finite(obj.tolist())
+    if isinstance(obj, (pd.Timestamp, datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _finite(obj):
+    # The stdlib encoder writes NaN and Infinity, which are not JSON; orjson writes null
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(_finite(obj), default=_default, separators=(',', ':')).encode('utf-8')
+
+def encode_block(array, columns=None):
+    # A typed little-endian buffer, base64 encoded. Two-dimensional blocks are row-major and
+    # name their columns so the client can rebuild the original records.
+    if array.dtype.kind in 'iub' and len(array) and array.min() >= np.iinfo(BLOCK_INT_DTYPE).min \
+            and array.max() <= np.iinfo(BLOCK_INT_DTYPE).max:
+        array = array.astype(BLOCK_INT_DTYPE)
+    else:
+        array = array.astype(BLOCK_FLOAT_DTYPE)
+    block = {
+        "$block": array.dtype.name,
+        "shape": list(array.shape),
+        "data": base64.b64encode(np.ascontiguousarray(array).tobytes()).decode('ascii'),
+    }
+    if columns is not None:
+        block["columns"] = [str(column) for column in columns]
+    return block
+
+def _numeric_block(values):
+    first = next((value for value in values if value is not None), None)
+    if isinstance(first, dict):
+        if not all(isinstance(value, (int, float)) or value is None for value in first.values()):
+            return None
+        frame = pd.DataFrame.from_records(values)
+        if not all(pd.api.types.is_numeric_dtype(dtype) for dtype in frame.dtypes):
+            return None
+        return encode_block(frame.to_numpy(dtype=np.float64, na_value=np.nan), frame.columns)
+    if isinstance(first, (bool, np.bool_)) or not isinstance(first, (int, float, np.number)):
+        return None
+    try:
+        array = np.asarray(values)
+        if array.dtype.kind not in 'iuf':
+            array = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    return encode_block(array) if array.ndim == 1 else None
+
+def to_columnar(obj):
+    # Replaces long numeric lists (and lists of numeric records) with typed blocks
+    if isinstance(obj, dict):
+        return {key: to_columnar(value) for key, value in obj.items()}
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in 'iubf':
+        return encode_block(obj) if obj.size >= BLOCK_MIN_LENGTH else obj
+    if isinstance(obj, list):
+        if len(obj) >= BLOCK_MIN_LENGTH:
+            block = _numeric_block(obj)
+            if block is not None:
+                return block
+        return [to_columnar(value) for value in obj]
+    return obj
+
+def iter_sections(result, response_format='json'):
+    # Encodes the response one top-level section at a time, so the first bytes go out before
+    # the last section is encoded. Sections that are the same object are encoded once.
+    encoded = {}
+    yield b'{'
+    for i, (key, value) in enumerate(result.items()):
+        reference = DUPLICATE_SECTIONS.get(key)
+        if reference in result and result[reference] is value:
+            body = dumps({"$ref": reference})
+        elif id(value) in encoded:
+            body = encoded[id(value)]
+        else:
+            body = dumps(to_columnar(value) if response_format == 'columnar' else value)
+            encoded[id(value)] = body
+        yield (b',' if i else b'') + dumps(str(key)) + b':' + body
+    yield b'}'
+
+def render_analysis(result, response_format='json', stream=False):
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown response format: {response_format}")
+    sections = iter_sections(result, response_format)
+    if stream:
+        return StreamingResponse(sections, media_type="application/json")
+    return Response(b''.join(sections), media_type="application/json")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend is run from its own directory and imports its modules by top-level name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,48 @@
+import os
+import numpy as np
+import pandas as pd
+import analysis.column_cache
+from analysis.time_series import analyze_time_series
+from result_cache import BUNDLE_INDEX, ResultCache
+
+def _dated_frame(rows=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "date": pd.date_range("2020-01-01", periods=rows, freq="D"),
+        **{f"num_{i}": rng.normal(size=rows) + np.sin(np.arange(rows) / 7) for i in range(5)},
+    })
+
+def test_put_many_writes_one_bundle_other_processes_read(tmp_path):
+    items = {f"key-{i}": {"value": i} for i in range(50)}
+    ResultCache(str(tmp_path), 2**20, 2**20).put_many(items)
+    assert sorted(os.listdir(tmp_path))[0].startswith("bundle-")
+    assert len(os.listdir(tmp_path)) == 2 and BUNDLE_INDEX in os.listdir(tmp_path)
+    # A cache with nothing in memory, as in another worker process
+    other = ResultCache(str(tmp_path), 2**20, 2**20)
+    assert other.get_many([*items, "absent"]) == items
+    assert other.get("key-7") == {"value": 7}
+
+def test_evicted_bundles_leave_the_index(tmp_path):
+    # Room for one of the two bundles, the older goes
+    cache = ResultCache(str(tmp_path), 0, 300)
+    cache.put_many({"old-a": b"a" * 100, "old-b": b"b" * 100})
+    for name in os.listdir(tmp_path):
+        os.utime(tmp_path / name, (0, 0))
+    cache.put_many({"new-a": b"c" * 100, "new-b": b"d" * 100})
+    assert set(cache.get_many(["old-a", "old-b", "new-a", "new-b"])) == {"new-a", "new-b"}
+    with open(tmp_path / BUNDLE_INDEX) as f:
+        assert [line.split("\t")[0] for line in f.read().splitlines()] == ["new-a", "new-b"]
+
+def test_time_series_entries_leave_out_the_dates(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), 2**20, 2**20, name="column")
+    monkeypatch.setattr(analysis.column_cache, "column_cache", cache)
+    df = _dated_frame()
+    cold = analyze_time_series(df)
+    warm = analyze_time_series(df)
+    assert cold == warm
+    assert cold["num_0"]["dates"][:2] == ["2020-01-01", "2020-01-02"]
+    # Read back from disk, the entries hold the decomposition only
+    entries = ResultCache(str(tmp_path), 2**20, 2**20)._refresh_index()
+    assert len(entries) == 5
+    for value in ResultCache(str(tmp_path), 2**20, 2**20).get_many(list(entries)).values():
+        assert "dates" not in value and "trend" in value
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+import analysis.column_cache
+from analysis.data_summary import get_summary
+from result_cache import ResultCache
+
+@pytest.fixture(autouse=True)
+def empty_column_cache(tmp_path, monkeypatch):
+    # Every test computes its summaries instead of reading an earlier run's
+    monkeypatch.setattr(analysis.column_cache, "column_cache", ResultCache(str(tmp_path), 0, 0, name="column"))
+
+def _mixed_frame(rows=6000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "normal": rng.normal(size=rows),
+        "skewed": np.where(rng.random(rows) < 0.2, np.nan, rng.exponential(size=rows) * 1e6),
+        "constant": np.full(rows, 3.0),
+        "integers": rng.integers(0, 10, rows),
+        "empty": np.full(rows, np.nan),
+        "category": pd.Categorical(rng.choice(list("abcdef"), rows), categories=list("abcdefgh")),
+        "text": rng.choice(["x", "y", None], rows),
+        "ids": [f"k{value}" for value in rng.integers(0, 10**6, rows)],
+        "dates": pd.date_range("2020-01-01", periods=rows, freq="h"),
+        "indicator": pd.arrays.SparseArray(np.where(rng.random(rows) < 0.05, 1.0, 0.0), fill_value=0.0),
+    })
+
+def test_numeric_summary_matches_pandas():
+    df = _mixed_frame()
+    summary = get_summary(df)
+    for column in ["normal", "skewed", "constant", "integers", "empty", "indicator"]:
+        series = df[column].sparse.to_dense() if isinstance(df[column].dtype, pd.SparseDtype) else df[column]
+        expected = {**series.describe().to_dict(), "skewness": series.skew(), "kurtosis": series.kurtosis()}
+        assert summary[column]["type"] == "numerical"
+        for key, value in expected.items():
+            assert summary[column][key] == pytest.approx(value, rel=1e-9, abs=1e-12, nan_ok=True), (column, key)
+
+def test_categorical_summary_is_exact():
+    df = _mixed_frame()
+    summary = get_summary(df)
+    # ids has more distinct values than the streaming HyperLogLog counts exactly
+    for column in ["category", "text", "ids"]:
+        counts = df[column].value_counts()
+        assert summary[column]["type"] == "categorical"
+        assert summary[column]["unique_values"] == df[column].nunique()
+        assert summary[column]["top_values"] == counts[counts > 0].head(5).to_dict()
+    assert summary["dates"] == {"type": "datetime", "min": df["dates"].min().isoformat(),
+                                "max": df["dates"].max().isoformat()}
@@ -0,0 +1,30 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError
+from jobs import JobManager
+
+def test_cancelled_request_cancels_its_running_job():
+    started, stopped = threading.Event(), threading.Event()
+
+    def analysis(progress=None, cancel=None):
+        # Stands in for the pipeline, which checks the cancel event between stages
+        started.set()
+        if not cancel.wait(5):
+            return "finished for no one"
+        stopped.set()
+        raise CancelledError("Analysis cancelled")
+
+    async def request():
+        manager = JobManager(1)
+        task = asyncio.create_task(manager.run(analysis))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return manager
+
+    manager = asyncio.run(request())
+    assert stopped.wait(5)
+    assert manager.status_counts() == {("queued",): 0, ("running",): 0}
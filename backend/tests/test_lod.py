@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+import pytest
+import data_processor
+from result_cache import ResultCache
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    # An uploaded file in a directory of its own, with caches nothing else reads
+    monkeypatch.setattr(data_processor, "UPLOAD_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(data_processor, "result_cache", ResultCache(str(tmp_path / "cache"), 0, 0))
+    rng = np.random.default_rng(0)
+    pd.DataFrame({"a": rng.normal(size=5000), "b": rng.normal(size=5000)}).to_csv(tmp_path / "f.csv", index=False)
+    return "f.csv"
+
+def test_scatter_of_a_column_against_itself(dataset):
+    result = data_processor.get_scatter_density(dataset, "a", "a", bins=20)
+    x, y = np.asarray(result["x"]), np.asarray(result["y"])
+    assert result["mode"] == "points" and result["total_points"] == 5000
+    np.testing.assert_array_equal(x, y)
+
+def test_line_of_a_column_against_itself(dataset):
+    result = data_processor.get_line_series(dataset, "a", x="a", pixels=10)
+    assert result["viewport_points"] == 5000
+    np.testing.assert_array_equal(result["x"], result["y"])
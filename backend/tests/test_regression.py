@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import r2_score
+from sklearn.model_selection import train_test_split
+from analysis.regression import perform_regression_analysis
+
+def _sklearn_regression(df):
+    # The per-target LinearRegression fits perform_regression_analysis replaced. Features are
+    # standardized first: on raw columns of scales 1e6 and 1e-3 lstsq cuts off the small singular
+    # values and no longer returns the least squares fit.
+    results = {}
+    for target in df.select_dtypes(include=[np.number]).columns:
+        X = pd.get_dummies(df.drop(columns=[target]), dtype=float)
+        X_train, X_test, y_train, y_test = train_test_split(X, df[target], test_size=0.2, random_state=42)
+        scale = X_train.std(ddof=0).replace(0.0, 1.0)
+        model = LinearRegression().fit(X_train / scale, y_train)
+        predictions = model.predict(X_test / scale)
+        results[target] = {"r2_score": r2_score(y_test, predictions),
+                           "coefficients": dict(zip(X.columns, model.coef_ / scale.to_numpy()))}
+    return results
+
+def _mixed_scales(rows=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    qty = rng.integers(1, 10, rows).astype(float)
+    return pd.DataFrame({
+        "price": rng.normal(1e6, 1e5, rows),
+        "qty": qty,
+        "total": 3 * qty + rng.normal(0, 0.05, rows),
+        "tiny": rng.normal(0, 1e-3, rows),
+    })
+
+def test_mixed_scales_match_linear_regression():
+    # A column of scale 1e6 explained by one of scale 1e-3
+    df = _mixed_scales()
+    df["big"] = 1e6 * df["tiny"] + np.random.default_rng(1).normal(0, 10, len(df))
+    insights = perform_regression_analysis(df)
+    expected = _sklearn_regression(df)
+    for target, result in expected.items():
+        assert insights[target]["r2_score"] == pytest.approx(result["r2_score"], abs=1e-6), target
+        # qty and total are 0.99998 correlated, where the ridge term moves coefficients by ~1e-4
+        for feature, coefficient in result["coefficients"].items():
+            assert insights[target]["coefficients"][feature] == pytest.approx(coefficient, rel=1e-3), (target, feature)
+    assert insights["total"]["r2_score"] > 0.999
+    assert insights["big"]["r2_score"] > 0.99
+
+def test_collinear_one_hot_columns_match_linear_regression():
+    # The one-hot columns of a category sum to one, so the coefficients are not unique; the
+    # predictions, and with them R², are
+    df = _mixed_scales()
+    rng = np.random.default_rng(2)
+    df["region"] = rng.choice(["north", "south", "east"], len(df))
+    df["total"] += df["region"].map({"north": 5.0, "south": -2.0, "east": 0.0})
+    insights = perform_regression_analysis(df)
+    expected = _sklearn_regression(df)
+    for target, result in expected.items():
+        assert insights[target]["r2_score"] == pytest.approx(result["r2_score"], abs=1e-6), target
+        assert set(insights[target]["coefficients"]) == set(result["coefficients"])
+    coefficients = insights["total"]["coefficients"]
+    assert coefficients["region_north"] - coefficients["region_east"] == pytest.approx(5.0, abs=0.01)
+    assert coefficients["region_south"] - coefficients["region_east"] == pytest.approx(-2.0, abs=0.01)
+
+def test_constant_column():
+    df = _mixed_scales(rows=500)
+    df["constant"] = 7.0
+    insights = perform_regression_analysis(df)
+    assert insights["constant"]["r2_score"] == 1.0
+    assert insights["total"]["coefficients"]["constant"] == 0.0
+    assert insights["total"]["r2_score"] == pytest.approx(_sklearn_regression(df)["total"]["r2_score"], abs=1e-6)
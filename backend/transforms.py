@@ -0,0 +1,264 @@
+import logging
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from result_cache import hash_options
+
+logger = logging.getLogger(__name__)
+
+FILL_METHODS = ('none', 'mean', 'median', 'mode', 'constant', 'ffill', 'bfill', 'remove')
+SCALING_METHODS = ('none', 'standardization', 'normalization', 'robust', 'log')
+BINNING_METHODS = ('none', 'equal-width', 'equal-frequency')
+ENCODING_METHODS = ('none', 'one-hot', 'keep')
+DEFAULT_NUM_BINS = 5
+# One-hot encoding keeps the most frequent categories of a column, the rest share an "other" column
+ONEHOT_MAX_CATEGORIES = int(os.environ.get("ONEHOT_MAX_CATEGORIES", 50))
+# Missing categories are encoded as a category of their own
+MISSING_CATEGORY = "missing"
+
+def plan_key(column_options):
+    return hash_options(column_options)
+
+def _is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def _check_option(column, name, value, allowed):
+    if value not in allowed:
+        raise ValueError(f"Unknown {name} for column {column}: {value}")
+
+def _fillna(series, value):
+    # Categorical columns only take values among their categories
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+def _mode(series):
+    modes = series.mode()
+    return modes.iloc[0] if len(modes) else None
+
+class TransformPlan:
+    # Every column option fitted into arrays of per-column parameters. Numeric columns are
+    # filled, scaled and binned as one 2-D block; categorical columns are filled and one-hot
+    # encoded into a sparse block. Fitted once per dataset and column options, then re-applied
+    # as is, also to other uploads with the same columns.
+    def __init__(self, column_options, content_hash=None):
+        self.key = plan_key(column_options)
+        # The dataset version the parameters were fitted on, and its rows. Appends can move a
+        # row-wise plan on to later versions without refitting it.
+        self.content_hash = content_hash
+        self.fitted_rows = None
+        self.columns = [column for column, options in column_options.items() if options['include']]
+        self.remove_rows = []
+        self.numeric = []
+        # Per numeric column: value fills (NaN for none), pandas fills, scaling and bin edges
+        self.fill_values = np.empty(0)
+        self.pandas_fills = {}
+        self.center = np.empty(0)
+        self.scale = np.empty(0)
+        self.log_shift = {}
+        self.bin_edges = {}
+        # Per other column: (fill method, value) and one-hot categories
+        self.other_fills = {}
+        self.onehot = {}
+
+    @property
+    def row_wise(self):
+        # Forward and backward fills reach across rows; without them each row is transformed on
+        # its own, and appending rows leaves the earlier ones as they were
+        return not self.pandas_fills and all(method not in ('ffill', 'bfill') for method, _ in self.other_fills.values())
+
+    @classmethod
+    def fit(cls, df, column_options, content_hash=None):
+        plan = cls(column_options, content_hash)
+        plan.fitted_rows = len(df)
+        options = {column: column_options[column] for column in plan.columns}
+        for column, column_option in options.items():
+            _check_option(column, 'fill method', column_option.get('fillMethod', 'none'), FILL_METHODS)
+            _check_option(column, 'scaling', column_option.get('scaling', 'none'), SCALING_METHODS)
+            _check_option(column, 'binning', column_option.get('binning', 'none'), BINNING_METHODS)
+            _check_option(column, 'encoding', column_option.get('encoding', 'none'), ENCODING_METHODS)
+
+        # Rows are removed before anything else is fitted, so statistics describe the kept rows
+        plan.remove_rows = [column for column, column_option in options.items() if column_option.get('fillMethod') == 'remove']
+        df = plan._remove_rows(df[plan.columns])
+
+        numeric = [column for column in plan.columns if _is_numeric(df[column])]
+        plan._fit_numeric(df, numeric, options)
+        for column in plan.columns:
+            if column not in numeric:
+                plan._fit_other(df[column], options[column])
+        logger.info(f"Fitted transform plan for {len(plan.columns)} columns ({len(plan.numeric)} numeric, "
+                    f"{len(plan.onehot)} one-hot encoded)")
+        return plan
+
+    def _fit_numeric(self, df, numeric, options):
+        def wanted(column):
+            column_option = options[column]
+            return (column_option.get('fillMethod', 'none') not in ('none', 'remove')
+                    or column_option.get('scaling', 'none') != 'none' or column_option.get('binning', 'none') != 'none')
+
+        self.numeric = [column for column in numeric if wanted(column)]
+        block = df[self.numeric].to_numpy(dtype=np.float64, na_value=np.nan)
+        methods = [options[column].get('fillMethod', 'none') for column in self.numeric]
+        self.fill_values = np.full(len(self.numeric), np.nan)
+        with warnings.catch_warnings():
+            # All-missing columns have no statistics and stay missing
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for method, reduce in (('mean', np.nanmean), ('median', np.nanmedian)):
+                positions = [i for i, fill in enumerate(methods) if fill == method]
+                if positions and len(block):
+                    self.fill_values[positions] = reduce(block[:, positions], axis=0)
+        for i, (column, method) in enumerate(zip(self.numeric, methods)):
+            if method == 'mode':
+                mode = _mode(df[column])
+                self.fill_values[i] = np.nan if mode is None else mode
+            elif method == 'constant':
+                try:
+                    self.fill_values[i] = float(options[column].get('fillConstant'))
+                except (TypeError, ValueError):
+                    raise ValueError(f"Fill constant for numeric column {column} must be a number: "
+                                     f"{options[column].get('fillConstant')!r}")
+            elif method in ('ffill', 'bfill'):
+                self.pandas_fills[i] = method
+        block = self._fill_numeric(block)
+
+        # Scaling parameters are fitted on the filled values
+        self.center = np.zeros(len(self.numeric))
+        self.scale = np.ones(len(self.numeric))
+        scalings = [options[column].get('scaling', 'none') for column in self.numeric]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for method in ('standardization', 'normalization', 'robust', 'log'):
+                positions = [i for i, scaling in enumerate(scalings) if scaling == method]
+                if not positions or not len(block):
+                    continue
+                values = block[:, positions]
+                if method == 'standardization':
+                    center, scale = np.nanmean(values, axis=0), np.nanstd(values, axis=0)
+                elif method == 'normalization':
+                    center = np.nanmin(values, axis=0)
+                    scale = np.nanmax(values, axis=0) - center
+                elif method == 'robust':
+                    q1, center, q3 = np.nanpercentile(values, [25, 50, 75], axis=0)
+                    scale = q3 - q1
+                else:
+                    # log1p of values shifted so the smallest one is zero when there are negatives
+                    for position, minimum in zip(positions, np.nanmin(values, axis=0)):
+                        self.log_shift[position] = min(float(minimum), 0.0) if not np.isnan(minimum) else 0.0
+                    continue
+                # Constant columns are centred but not scaled, like scikit-learn's scalers
+                scale = np.where((scale == 0) | np.isnan(scale), 1.0, scale)
+                self.center[positions] = np.where(np.isnan(center), 0.0, center)
+                self.scale[positions] = scale
+        block = self._scale_numeric(block)
+
+        for i, column in enumerate(self.numeric):
+            method = options[column].get('binning', 'none')
+            if method == 'none':
+                continue
+            num_bins = int(options[column].get('numBins') or DEFAULT_NUM_BINS)
+            if num_bins < 1:
+                raise ValueError(f"Number of bins for column {column} must be positive: {num_bins}")
+            values = block[:, i][~np.isnan(block[:, i])]
+            if len(values) == 0:
+                continue
+            if method == 'equal-width':
+                edges = np.linspace(values.min(), values.max(), num_bins + 1)
+            else:
+                # Repeated values can make quantiles coincide, those bins are merged
+                edges = np.unique(np.quantile(values, np.linspace(0, 1, num_bins + 1)))
+            self.bin_edges[i] = edges
+
+    def _fit_other(self, series, column_option):
+        method = column_option.get('fillMethod', 'none')
+        if method in ('mean', 'median'):
+            logger.warning(f"Fill method {method} does not apply to non-numeric column {series.name}, leaving it as is")
+        elif method == 'mode':
+            self.other_fills[series.name] = (method, _mode(series))
+        elif method == 'constant':
+            constant = column_option.get('fillConstant')
+            if pd.api.types.is_datetime64_any_dtype(series):
+                constant = pd.Timestamp(constant)
+            self.other_fills[series.name] = (method, constant)
+        elif method in ('ffill', 'bfill'):
+            self.other_fills[series.name] = (method, None)
+        if column_option.get('encoding') == 'one-hot' and not pd.api.types.is_datetime64_any_dtype(series):
+            counts = _fillna(self._fill_other(series), MISSING_CATEGORY).astype(str).value_counts()
+            kept = sorted(counts.index[:ONEHOT_MAX_CATEGORIES])
+            self.onehot[series.name] = (kept, len(counts) > ONEHOT_MAX_CATEGORIES)
+
+    def _remove_rows(self, df):
+        if not self.remove_rows:
+            return df
+        return df[df[self.remove_rows].notna().all(axis=1)]
+
+    def _fill_numeric(self, block):
+        block = np.where(np.isnan(block), self.fill_values, block)
+        for i, method in self.pandas_fills.items():
+            series = pd.Series(block[:, i])
+            block[:, i] = (series.ffill() if method == 'ffill' else series.bfill()).to_numpy()
+        return block
+
+    def _scale_numeric(self, block):
+        for i, shift in self.log_shift.items():
+            with np.errstate(invalid='ignore'):
+                block[:, i] = np.log1p(block[:, i] - shift)
+        return (block - self.center) / self.scale
+
+    def _fill_other(self, series):
+        method, value = self.other_fills.get(series.name, ('none', None))
+        if method == 'ffill':
+            return series.ffill()
+        if method == 'bfill':
+            return series.bfill()
+        if value is None:
+            return series
+        return _fillna(series, value)
+
+    def _encode(self, series):
+        # Indicator columns as one sparse block, built from the category codes directly
+        kept, has_other = self.onehot[series.name]
+        codes = pd.Categorical(_fillna(self._fill_other(series), MISSING_CATEGORY).astype(str), categories=kept).codes
+        names = [f"{series.name}_{category}" for category in kept]
+        if has_other:
+            codes = np.where(codes < 0, len(kept), codes)
+            names.append(f"{series.name}_other")
+        # Categories first seen after fitting have no column when there is no "other" one
+        rows = np.flatnonzero(codes >= 0)
+        block = scipy.sparse.csc_matrix((np.ones(len(rows)), (rows, codes[rows])), shape=(len(series), len(names)))
+        return pd.DataFrame.sparse.from_spmatrix(block, index=series.index, columns=names)
+
+    def transform(self, df):
+        missing = [column for column in self.columns if column not in df.columns]
+        if missing:
+            raise ValueError(f"Columns missing for the transform plan: {missing}")
+        df = self._remove_rows(df[self.columns])
+        if not self.numeric and not self.other_fills and not self.onehot:
+            return df
+
+        numeric = {}
+        if self.numeric:
+            block = df[self.numeric].to_numpy(dtype=np.float64, na_value=np.nan)
+            block = self._scale_numeric(self._fill_numeric(block))
+            for i, edges in self.bin_edges.items():
+                binned = np.clip(np.searchsorted(edges[1:-1], block[:, i], side='right'), 0, max(len(edges) - 2, 0))
+                block[:, i] = np.where(np.isnan(block[:, i]), np.nan, binned)
+            numeric = dict(zip(self.numeric, block.T))
+
+        # Runs of untouched and transformed columns are assembled in the original column order
+        frames, columns = [], {}
+        for column in self.columns:
+            if column in self.onehot:
+                if columns:
+                    frames.append(pd.DataFrame(columns, index=df.index))
+                    columns = {}
+                frames.append(self._encode(df[column]))
+            elif column in numeric:
+                columns[column] = numeric[column]
+            else:
+                columns[column] = self._fill_other(df[column])
+        if columns:
+            frames.append(pd.DataFrame(columns, index=df.index))
+        return pd.concat(frames, axis=1) if len(frames) > 1 else frames[0]
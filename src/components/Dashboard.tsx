@@ -1,9 +1,9 @@
 'use client';
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import FileUpload from './FileUpload';
 import DataVisualizations from './DataVisualizations';
 import DataPreprocessing from './DataPreprocessing';
-import { preprocessData, AnalysisResult, FileInfo } from '../utils/api';
+import { runAnalysisJob, AnalysisJob, AnalysisResult, FileInfo } from '../utils/api';
 import ProgressBar from './ProgressBar';
 
 interface PreprocessingOptions {
@@ -21,17 +21,14 @@ const Dashboard: React.FC = () => {
   const [progress, setProgress] = useState(0);
   const [currentStep, setCurrentStep] = useState('');
 
-  const steps = [
-    { name: 'Uploading file', percentage: 20 },
-    { name: 'Processing data', percentage: 40 },
-    { name: 'Performing analysis', percentage: 60 },
-    { name: 'Generating visualizations', percentage: 80 },
-    { name: 'Finalizing results', percentage: 100 }
-  ];
+  const job = useRef<AnalysisJob | null>(null);
 
-  const updateProgress = (stepIndex: number) => {
-    setCurrentStep(steps[stepIndex].name);
-    setProgress(steps[stepIndex].percentage);
+  const stepNames: Record<string, string> = {
+    queued: 'Waiting for a free worker',
+    running: 'Starting analysis',
+    load: 'Loading data',
+    preprocess: 'Processing data',
+    done: 'Finalizing results',
   };
 
   const handleFileUpload = async (result: FileInfo) => {
@@ -49,18 +46,17 @@ const Dashboard: React.FC = () => {
     setLoading(true);
     setError(null);
     try {
-      updateProgress(1);  // Start with processing data
-      const preprocessedData = await preprocessData(fileInfo.filename, options);
-      updateProgress(2);  // Performing analysis
-      await new Promise(resolve => setTimeout(resolve, 1000));  // Simulate analysis time
-      updateProgress(3);  // Generating visualizations
-      await new Promise(resolve => setTimeout(resolve, 1000));  // Simulate visualization generation time
-      updateProgress(4);  // Finalizing results
-      setAnalysisResult(preprocessedData);
+      job.current = await runAnalysisJob(fileInfo.filename, options, event => {
+        const step = event.stage ?? event.status ?? '';
+        setCurrentStep(stepNames[step] ?? `Analyzing: ${step.replace(/_/g, ' ')}`);
+        setProgress(Math.round(event.progress * 100));
+      });
+      setAnalysisResult(await job.current.result);
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to preprocess data. Please try again.');
       console.error(err);
     } finally {
+      job.current = null;
       setLoading(false);
       setProgress(0);
       setCurrentStep('');
@@ -78,7 +74,12 @@ const Dashboard: React.FC = () => {
         {loading && (
           <div className="mt-4">
             <ProgressBar progress={progress} />
-            <p className="text-sm text-indigo-600 mt-2">{currentStep}</p>
+            <div className="flex items-center justify-between mt-2">
+              <p className="text-sm text-indigo-600">{currentStep}</p>
+              <button onClick={() => job.current?.cancel()} className="text-sm text-gray-600 hover:text-red-600">
+                Cancel
+              </button>
+            </div>
           </div>
         )}
         {error && <p className="mt-4 text-red-600">Error: {error}</p>}
@@ -99,7 +100,7 @@ const Dashboard: React.FC = () => {
         {analysisResult && (
           <div className="mt-8">
             <p className="text-green-600 mb-4">Analysis complete. Rendering visualizations...</p>
-            <DataVisualizations data={analysisResult} />
+            <DataVisualizations data={analysisResult} filename={fileInfo?.filename} />
           </div>
         )}
       </div>
@@ -15,9 +15,9 @@ interface PreprocessingOptions {
 
 interface ColumnOption {
   include: boolean;
-  fillMethod: 'none' | 'mean' | 'median' | 'mode' | 'constant' | 'ffill' | 'bfill';
+  fillMethod: 'none' | 'mean' | 'median' | 'mode' | 'constant' | 'ffill' | 'bfill' | 'remove';
   fillConstant?: string | number;
-  scaling: 'none' | 'standardization' | 'normalization' | 'log';
+  scaling: 'none' | 'standardization' | 'normalization' | 'robust' | 'log';
   encoding: 'none' | 'one-hot' | 'keep';
   binning: 'none' | 'equal-width' | 'equal-frequency';
   numBins?: number;
@@ -84,6 +84,7 @@ const DataPreprocessing: React.FC<DataPreprocessingProps> = ({ columns, missingV
             <option value="constant">Constant</option>
             <option value="ffill">Forward Fill</option>
             <option value="bfill">Backward Fill</option>
+            <option value="remove">Remove Rows</option>
           </select>
         </div>
         {options.fillMethod === 'constant' && (
@@ -109,6 +110,7 @@ const DataPreprocessing: React.FC<DataPreprocessingProps> = ({ columns, missingV
                 <option value="none">None</option>
                 <option value="standardization">Standardization</option>
                 <option value="normalization">Normalization</option>
+                <option value="robust">Robust</option>
                 <option value="log">Log Transform</option>
               </select>
             </div>
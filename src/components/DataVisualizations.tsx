@@ -11,9 +11,12 @@ import ScatterPlotSection from './visualizations/ScatterPlotSection';
 import PairwisePlotsSection from './visualizations/PairwisePlotsSection';
 import GeneralStatistics from './GeneralStatistics';
 import AIInsights from './charts/AIInsights';
+import { OutlierResult } from '../utils/api';
 
 interface DataVisualizationsProps {
   data: {
+    // Addresses the analysis on the server, for charts that fetch downsampled series
+    handle?: string;
     summary: Record<string, {
       type: 'numerical' | 'categorical' | 'datetime';
       [key: string]: any;
@@ -24,16 +27,18 @@ interface DataVisualizationsProps {
     pca_data?: Array<{ PC1: number; PC2: number }>;
     clusters?: number[];
     time_series_analysis?: Record<string, {
-      trend: number[];
-      seasonal: number[];
-      residual: number[];
-      adf_statistic: number;
-      adf_pvalue: number;
-      dates: string[];
+      trend?: number[];
+      seasonal?: number[];
+      residual?: number[];
+      period?: number;
+      adf_statistic?: number | null;
+      adf_pvalue?: number | null;
+      dates?: string[];
+      error?: string;
     }>;
     insights?: string[];
     recommended_visualizations?: [string, string][];
-    pca_result?: number[][];
+    pca_result?: Array<{ PC1: number; PC2: number }>;
     pca_explained_variance?: number[];
     general_statistics: {
       totalRows: number;
@@ -44,7 +49,7 @@ interface DataVisualizationsProps {
       missingValues: number;
       totalCells: number;
     };
-    outliers?: Record<string, number[]>;
+    outliers?: Record<string, OutlierResult>;
     feature_importance?: Record<string, Record<string, number>> | null;
     regression_insights?: Record<string, {
       r2_score: number;
@@ -52,9 +57,11 @@ interface DataVisualizationsProps {
       coefficients: Record<string, number>;
     }>;
   };
+  // The uploaded dataset, for charts that query it on the server
+  filename?: string;
 }
 
-const DataVisualizations: React.FC<DataVisualizationsProps> = ({ data }) => {
+const DataVisualizations: React.FC<DataVisualizationsProps> = ({ data, filename }) => {
   const [selectedVisualization, setSelectedVisualization] = useState<string>('summary');
   const [isLoading, setIsLoading] = useState<boolean>(false);
 
@@ -112,19 +119,19 @@ const DataVisualizations: React.FC<DataVisualizationsProps> = ({ data }) => {
         />;
       case 'clustering':
         return data.pca_data && data.clusters ? (
-          <ClusteringSection pca_data={data.pca_data} clusters={data.clusters} summary={data.summary} />
+          <ClusteringSection pca_data={data.pca_data} clusters={data.clusters} summary={data.summary} handle={data.handle} />
         ) : (
           <div className="text-gray-600">Clustering analysis is not available for the current dataset.</div>
         );
       case 'timeseries':
         return Object.keys(data.time_series_analysis || {}).length > 0 ? (
-          <TimeSeriesSection timeSeriesData={data.time_series_analysis || {}} />
+          <TimeSeriesSection timeSeriesData={data.time_series_analysis || {}} handle={data.handle} />
         ) : (
           <div className="text-gray-600">Time series analysis is not available for the current dataset.</div>
         );
       case 'outlier':
         return data.outliers && Object.keys(data.outliers).length > 0 ? (
-          <OutlierSection data={data.summary} outliers={data.outliers} />
+          <OutlierSection data={data.summary} outliers={data.outliers} filename={filename} />
         ) : (
           <div className="text-gray-600">Outlier detection is not available for the current dataset.</div>
         );
@@ -141,11 +148,11 @@ const DataVisualizations: React.FC<DataVisualizationsProps> = ({ data }) => {
           <div className="text-gray-600">Regression analysis is not available for the current dataset.</div>
         );
       case 'bar_chart':
-        return <BarChartSection data={data.summary} />;
+        return <BarChartSection data={data.summary} filename={filename} />;
       case 'scatter_plot':
         return <ScatterPlotSection data={data.summary} />;
       case 'pairwise_plots':
-        return <PairwisePlotsSection data={data.summary} />;
+        return <PairwisePlotsSection data={data.summary} filename={filename} />;
       default:
         return null;
     }
@@ -55,7 +55,7 @@ const FileUpload: React.FC<FileUploadProps> = ({ onUploadComplete }) => {
             type="file"
             ref={fileInputRef}
             onChange={handleFileChange}
-            accept=".csv,.xlsx,.json"
+            accept=".csv,.tsv,.xlsx,.json,.jsonl,.ndjson"
             className="hidden"
           />
           <button
@@ -1,20 +1,38 @@
 import React from 'react';
 import { ResponsiveContainer, ComposedChart, Bar, Scatter, XAxis, YAxis, Tooltip, Cell } from 'recharts';
 
+export interface BoxPlotStats {
+  q1: number;
+  median: number;
+  q3: number;
+  whiskerLow: number;
+  whiskerHigh: number;
+}
+
 interface BoxPlotProps {
   variable: string;
   data: number[];
   outliers: number[];
+  // Computed on the server over the whole column; otherwise the box is computed from data
+  stats?: BoxPlotStats;
 }
 
-const BoxPlot: React.FC<BoxPlotProps> = ({ variable, data, outliers }) => {
+const computeStats = (data: number[]): BoxPlotStats => {
   const sortedData = [...data].sort((a, b) => a - b);
   const q1 = sortedData[Math.floor(sortedData.length / 4)];
-  const median = sortedData[Math.floor(sortedData.length / 2)];
   const q3 = sortedData[Math.floor(sortedData.length * 3 / 4)];
   const iqr = q3 - q1;
-  const min = Math.max(q1 - 1.5 * iqr, sortedData[0]);
-  const max = Math.min(q3 + 1.5 * iqr, sortedData[sortedData.length - 1]);
+  return {
+    q1,
+    median: sortedData[Math.floor(sortedData.length / 2)],
+    q3,
+    whiskerLow: Math.max(q1 - 1.5 * iqr, sortedData[0]),
+    whiskerHigh: Math.min(q3 + 1.5 * iqr, sortedData[sortedData.length - 1]),
+  };
+};
+
+const BoxPlot: React.FC<BoxPlotProps> = ({ variable, data, outliers, stats }) => {
+  const { q1, median, q3, whiskerLow: min, whiskerHigh: max } = stats ?? computeStats(data);
 
   const boxPlotData = [{
     variable,
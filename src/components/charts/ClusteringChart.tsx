@@ -1,5 +1,6 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { ScatterChart, Scatter, XAxis, YAxis, ZAxis, Tooltip, Legend, ResponsiveContainer, LabelList } from 'recharts';
+import { fetchPcaDensity, ScatterDensity } from '../../utils/api';
 
 interface ClusteringChartProps {
   pca_data?: Array<{ PC1: number; PC2: number }>;
@@ -8,10 +9,63 @@ interface ClusteringChartProps {
     type: 'numerical' | 'categorical';
     [key: string]: any;
   }>;
+  // When set, each cluster's points are binned on the server instead of plotting every point
+  handle?: string;
 }
 
-const ClusteringChart: React.FC<ClusteringChartProps> = ({ pca_data, clusters, summary }) => {
+// Grid cells across the chart when a cluster has too many points to plot one by one
+const DENSITY_BINS = 100;
+
+interface PlotPoint {
+  PC1: number;
+  PC2: number;
+  cluster: number;
+  // Points the marker stands for
+  count: number;
+}
+
+// Points as they are, or one marker per non-empty grid cell at its centre
+function densityPoints(density: ScatterDensity, cluster: number): PlotPoint[] {
+  if (density.mode === 'points') {
+    return (density.x ?? []).map((x, index) => ({ PC1: x, PC2: density.y![index], cluster, count: 1 }));
+  }
+  const xEdges = density.x_edges ?? [];
+  const yEdges = density.y_edges ?? [];
+  const points: PlotPoint[] = [];
+  (density.counts ?? []).forEach((row, i) => row.forEach((count, j) => {
+    if (count > 0) {
+      points.push({ PC1: (xEdges[i] + xEdges[i + 1]) / 2, PC2: (yEdges[j] + yEdges[j + 1]) / 2, cluster, count });
+    }
+  }));
+  return points;
+}
+
+const ClusteringChart: React.FC<ClusteringChartProps> = ({ pca_data, clusters, summary, handle }) => {
   const [selectedCluster, setSelectedCluster] = useState<number | null>(null);
+  const [downsampled, setDownsampled] = useState<Record<number, PlotPoint[]> | null>(null);
+
+  useEffect(() => {
+    if (!handle || !clusters) {
+      setDownsampled(null);
+      return;
+    }
+    let cancelled = false;
+    const ids = Array.from(new Set(clusters));
+    Promise.all(ids.map(cluster => fetchPcaDensity(handle, { cluster, bins: DENSITY_BINS })))
+      .then(results => {
+        if (!cancelled) {
+          setDownsampled(Object.fromEntries(results.map((density, index) => [ids[index], densityPoints(density, ids[index])])));
+        }
+      })
+      .catch(error => {
+        // The points sent with the analysis are plotted instead
+        console.error('Downsampling error:', error);
+        if (!cancelled) setDownsampled(null);
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, [handle, clusters]);
 
   if (!pca_data || !clusters || pca_data.length !== clusters.length) {
     return <div>Insufficient data for clustering visualization</div>;
@@ -53,18 +107,24 @@ const ClusteringChart: React.FC<ClusteringChartProps> = ({ pca_data, clusters, s
         <ScatterChart margin={{ top: 20, right: 20, bottom: 20, left: 20 }}>
           <XAxis type="number" dataKey="PC1" name="Principal Component 1" />
           <YAxis type="number" dataKey="PC2" name="Principal Component 2" />
-          <ZAxis type="number" dataKey="cluster" name="cluster" />
+          {downsampled ? (
+            <ZAxis type="number" dataKey="count" name="points" range={[20, 200]} />
+          ) : (
+            <ZAxis type="number" dataKey="cluster" name="cluster" />
+          )}
           <Tooltip cursor={{ strokeDasharray: '3 3' }} />
           <Legend />
           {Array.from(new Set(clusters)).map((cluster, index) => (
             <Scatter
               key={`cluster-${cluster}`}
               name={`${clusterNames[index]} Group`}
-              data={data.filter(point => point.cluster === cluster)}
+              data={downsampled ? downsampled[cluster] ?? [] : data.filter(point => point.cluster === cluster)}
               fill={COLORS[index % COLORS.length]}
               onClick={() => setSelectedCluster(cluster)}
+              isAnimationActive={!downsampled}
             >
-              <LabelList dataKey="cluster" position="top" />
+              {/* Labelling thousands of binned markers would hide them */}
+              {!downsampled && <LabelList dataKey="cluster" position="top" />}
             </Scatter>
           ))}
         </ScatterChart>
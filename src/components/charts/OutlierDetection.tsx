@@ -1,18 +1,47 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { ResponsiveContainer, ScatterChart, Scatter, XAxis, YAxis, ZAxis, Tooltip, Cell } from 'recharts';
-import BoxPlot from './BoxPlot';
+import BoxPlot, { BoxPlotStats } from './BoxPlot';
+import { OutlierResult, queryGroupBy } from '../../utils/api';
 
 interface OutlierDetectionProps {
   data: Record<string, number[]>;
-  outliers: Record<string, number[]>;
+  outliers: Record<string, OutlierResult>;
+  filename?: string;
 }
 
 const COLORS = ['#8884d8', '#82ca9d', '#ffc658', '#ff7300', '#0088FE', '#00C49F'];
 
-const OutlierDetection: React.FC<OutlierDetectionProps> = ({ data, outliers }) => {
+const OutlierDetection: React.FC<OutlierDetectionProps> = ({ data, outliers, filename }) => {
   const [selectedVariables, setSelectedVariables] = useState<string[]>(
     Object.keys(data).slice(0, 2)
   );
+  const [boxStats, setBoxStats] = useState<Record<string, BoxPlotStats>>({});
+
+  // Quartiles and whiskers of the whole uploaded column, fetched once per selected variable
+  useEffect(() => {
+    if (!filename) return;
+    let cancelled = false;
+    selectedVariables.filter(variable => !(variable in boxStats)).forEach(variable => {
+      queryGroupBy(filename, [], { value: variable, aggregations: ['box'] })
+        .then(({ box }) => {
+          if (cancelled || !box || box.median[0] === null) return;
+          const stats = {
+            q1: box.q1[0] as number,
+            median: box.median[0] as number,
+            q3: box.q3[0] as number,
+            whiskerLow: box.whisker_low[0] as number,
+            whiskerHigh: box.whisker_high[0] as number,
+          };
+          setBoxStats(prev => ({ ...prev, [variable]: stats }));
+        })
+        .catch(error => console.error(`Computing the box plot of ${variable} failed:`, error));
+    });
+    return () => {
+      cancelled = true;
+    };
+    // boxStats only filters out variables that were already fetched
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [filename, selectedVariables]);
 
   const toggleVariable = (variable: string) => {
     setSelectedVariables(prev =>
@@ -27,7 +56,7 @@ const OutlierDetection: React.FC<OutlierDetectionProps> = ({ data, outliers }) =
   };
 
   const isOutlier = (value: number, variable: string) => {
-    return outliers[variable].includes(value);
+    return outliers[variable]?.values.includes(value) ?? false;
   };
 
   return (
@@ -50,7 +79,13 @@ const OutlierDetection: React.FC<OutlierDetectionProps> = ({ data, outliers }) =
       </div>
       <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
         {selectedVariables.map(variable => (
-          <BoxPlot key={variable} variable={variable} data={data[variable]} outliers={outliers[variable]} />
+          <BoxPlot
+            key={variable}
+            variable={variable}
+            data={data[variable]}
+            outliers={outliers[variable]?.values ?? []}
+            stats={boxStats[variable]}
+          />
         ))}
         {selectedVariables.length === 2 && (
           <div className="w-full h-64 col-span-1 md:col-span-2">
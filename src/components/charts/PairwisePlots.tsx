@@ -1,17 +1,40 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { ScatterChart, Scatter, XAxis, YAxis, ZAxis, Tooltip, Cell, ResponsiveContainer } from 'recharts';
+import { PairCountsResult, queryPairCounts } from '../../utils/api';
 
 interface PairwisePlotsProps {
-  data: Record<string, number[]>;
+  filename?: string;
+  variables: string[];
   maxPlots?: number;
+  bins?: number;
 }
 
-const COLORS = ['#8884d8', '#82ca9d', '#ffc658', '#ff7300', '#0088FE', '#00C49F'];
-
-const PairwisePlots: React.FC<PairwisePlotsProps> = ({ data, maxPlots = 6 }) => {
+const PairwisePlots: React.FC<PairwisePlotsProps> = ({ filename, variables, maxPlots = 6, bins = 20 }) => {
   const [selectedVariables, setSelectedVariables] = useState<string[]>(
-    Object.keys(data).slice(0, maxPlots)
+    variables.slice(0, maxPlots)
   );
+  const [pairCounts, setPairCounts] = useState<PairCountsResult | null>(null);
+  const [error, setError] = useState<string | null>(null);
+
+  // The server bins every selected pair over the whole dataset, the rows never reach the browser
+  useEffect(() => {
+    if (!filename || selectedVariables.length < 2) {
+      setPairCounts(null);
+      return;
+    }
+    let cancelled = false;
+    setError(null);
+    queryPairCounts(filename, selectedVariables, bins)
+      .then(result => {
+        if (!cancelled) setPairCounts(result);
+      })
+      .catch(err => {
+        if (!cancelled) setError(err instanceof Error ? err.message : 'Computing pairwise plots failed');
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, [filename, selectedVariables, bins]);
 
   const toggleVariable = (variable: string) => {
     setSelectedVariables(prev =>
@@ -21,15 +44,27 @@ const PairwisePlots: React.FC<PairwisePlotsProps> = ({ data, maxPlots = 6 }) =>
     );
   };
 
+  // One point per non-empty cell, at the cell's centre and sized by its count
   const prepareData = (xKey: string, yKey: string) => {
-    return data[xKey].map((x, i) => ({ x, y: data[yKey][i] }));
+    const pair = pairCounts?.pairs.find(p => p.x === xKey && p.y === yKey);
+    if (!pair || !pairCounts) return [];
+    const xEdges = pairCounts.edges[xKey];
+    const yEdges = pairCounts.edges[yKey];
+    return pair.counts.flatMap((row, i) =>
+      row.flatMap((count, j) =>
+        count > 0 ? [{ x: (xEdges[i] + xEdges[i + 1]) / 2, y: (yEdges[j] + yEdges[j + 1]) / 2, count }] : []
+      )
+    );
   };
 
+  const cellColor = (count: number, maxCount: number) =>
+    `rgba(136, 132, 216, ${0.25 + 0.75 * Math.sqrt(count / maxCount)})`;
+
   return (
     <div className="mb-8">
       <h3 className="text-xl font-semibold mb-2">Pairwise Plots</h3>
       <div className="mb-4">
-        {Object.keys(data).map(variable => (
+        {variables.map(variable => (
           <button
             key={variable}
             onClick={() => toggleVariable(variable)}
@@ -43,44 +78,50 @@ const PairwisePlots: React.FC<PairwisePlotsProps> = ({ data, maxPlots = 6 }) =>
           </button>
         ))}
       </div>
+      {error && <div className="text-red-600 mb-4">{error}</div>}
       <div className="grid grid-cols-2 md:grid-cols-3 gap-4">
         {selectedVariables.map((xVar, i) =>
-          selectedVariables.slice(i + 1).map((yVar, j) => (
-            <div key={`${xVar}-${yVar}`} className="w-full h-64">
-              <ResponsiveContainer width="100%" height="100%">
-                <ScatterChart margin={{ top: 20, right: 20, bottom: 40, left: 40 }}>
-                  <XAxis 
-                    type="number" 
-                    dataKey="x" 
-                    name={xVar} 
-                    label={{ value: xVar, position: 'bottom', offset: 20 }}
-                  />
-                  <YAxis 
-                    type="number" 
-                    dataKey="y" 
-                    name={yVar} 
-                    label={{ value: yVar, angle: -90, position: 'left', offset: 0 }}
-                  />
-                  <ZAxis range={[64, 144]} />
-                  <Tooltip 
-                    cursor={{ strokeDasharray: '3 3' }}
-                    formatter={(value: number, name: string) => [value.toFixed(2), name === 'x' ? xVar : yVar]}
-                  />
-                  <Scatter name={`${xVar} vs ${yVar}`} data={prepareData(xVar, yVar)}>
-                    {prepareData(xVar, yVar).map((entry, index) => (
-                      <Cell key={`cell-${index}`} fill={COLORS[index % COLORS.length]} />
-                    ))}
-                  </Scatter>
-                </ScatterChart>
-              </ResponsiveContainer>
-            </div>
-          ))
+          selectedVariables.slice(i + 1).map(yVar => {
+            const cells = prepareData(xVar, yVar);
+            const maxCount = Math.max(1, ...cells.map(cell => cell.count));
+            return (
+              <div key={`${xVar}-${yVar}`} className="w-full h-64">
+                <ResponsiveContainer width="100%" height="100%">
+                  <ScatterChart margin={{ top: 20, right: 20, bottom: 40, left: 40 }}>
+                    <XAxis 
+                      type="number" 
+                      dataKey="x" 
+                      name={xVar} 
+                      label={{ value: xVar, position: 'bottom', offset: 20 }}
+                    />
+                    <YAxis 
+                      type="number" 
+                      dataKey="y" 
+                      name={yVar} 
+                      label={{ value: yVar, angle: -90, position: 'left', offset: 0 }}
+                    />
+                    <ZAxis type="number" dataKey="count" name="Rows" range={[16, 196]} />
+                    <Tooltip 
+                      cursor={{ strokeDasharray: '3 3' }}
+                      formatter={(value: number, name: string) =>
+                        name === 'Rows' ? [value, name] : [value.toFixed(2), name]}
+                    />
+                    <Scatter name={`${xVar} vs ${yVar}`} data={cells}>
+                      {cells.map((entry, index) => (
+                        <Cell key={`cell-${index}`} fill={cellColor(entry.count, maxCount)} />
+                      ))}
+                    </Scatter>
+                  </ScatterChart>
+                </ResponsiveContainer>
+              </div>
+            );
+          })
         )}
       </div>
       <div className="mt-4">
         <h4 className="text-lg font-semibold mb-2">How to Use These Plots</h4>
         <ul className="list-disc pl-5">
-          <li>Each plot shows the relationship between two variables.</li>
+          <li>Each plot shows the relationship between two variables, with the rows counted in a grid: larger, darker points mean more rows.</li>
           <li>The variable name on the bottom is plotted on the x-axis.</li>
           <li>The variable name on the left is plotted on the y-axis.</li>
           <li>Use the buttons above to select which variables to include (up to {maxPlots}).</li>
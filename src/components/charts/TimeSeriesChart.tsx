@@ -1,42 +1,106 @@
-import React, { useState } from 'react';
-import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
+import React, { useEffect, useState } from 'react';
+import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer, ReferenceArea } from 'recharts';
+import { fetchComponentSeries, LineSeries, Viewport } from '../../utils/api';
 
 interface TimeSeriesData {
-  trend: number[];
-  seasonal: number[];
-  residual: number[];
-  adf_statistic: number;
-  adf_pvalue: number;
-  dates: string[];
+  trend?: number[];
+  seasonal?: number[];
+  residual?: number[];
+  period?: number;
+  adf_statistic?: number | null;
+  adf_pvalue?: number | null;
+  dates?: string[];
+  error?: string;
 }
 
 interface TimeSeriesChartProps {
   timeSeriesData: Record<string, TimeSeriesData>;
+  // When set, the components are downsampled on the server for the visible range instead of
+  // plotting every point
+  handle?: string;
 }
 
-const TimeSeriesChart: React.FC<TimeSeriesChartProps> = ({ timeSeriesData }) => {
+const COMPONENTS: LineSeries['component'][] = ['trend', 'seasonal', 'residual'];
+const COLORS: Record<LineSeries['component'], string> = { trend: '#8884d8', seasonal: '#82ca9d', residual: '#ffc658' };
+// Points requested per component, about one per horizontal pixel of the chart
+const PIXELS = 800;
+
+interface Downsampled {
+  xType: LineSeries['x_type'];
+  series: Record<string, Array<{ x: number; y: number }>>;
+}
+
+const TimeSeriesChart: React.FC<TimeSeriesChartProps> = ({ timeSeriesData, handle }) => {
   const [selectedSeries, setSelectedSeries] = useState(Object.keys(timeSeriesData)[0]);
+  const [viewport, setViewport] = useState<Viewport>({});
+  const [selection, setSelection] = useState<Viewport>({});
+  const [downsampled, setDownsampled] = useState<Downsampled | null>(null);
 
   const handleSeriesChange = (event: React.ChangeEvent<HTMLSelectElement>) => {
     setSelectedSeries(event.target.value);
+    setViewport({});
   };
 
   const currentSeries = timeSeriesData[selectedSeries];
+  const decomposed = Boolean(currentSeries?.trend && !currentSeries.error);
+
+  useEffect(() => {
+    if (!handle || !decomposed) {
+      setDownsampled(null);
+      return;
+    }
+    let cancelled = false;
+    Promise.all(COMPONENTS.map(component =>
+      fetchComponentSeries(handle, selectedSeries, component, { ...viewport, pixels: PIXELS })
+    ))
+      .then(results => {
+        if (cancelled) return;
+        setDownsampled({
+          xType: results[0].x_type,
+          series: Object.fromEntries(results.map(result => [
+            result.component, result.x.map((x, index) => ({ x, y: result.y[index] })),
+          ])),
+        });
+      })
+      .catch(error => {
+        // The points sent with the analysis are plotted instead
+        console.error('Downsampling error:', error);
+        if (!cancelled) setDownsampled(null);
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, [handle, selectedSeries, decomposed, viewport]);
+
+  // Dragging across the chart zooms into that range, which is fetched again at full detail
+  const finishSelection = () => {
+    if (selection.start !== undefined && selection.end !== undefined && selection.start !== selection.end) {
+      setViewport({ start: Math.min(selection.start, selection.end), end: Math.max(selection.start, selection.end) });
+    }
+    setSelection({});
+  };
 
   if (!currentSeries || !currentSeries.trend || !currentSeries.seasonal || !currentSeries.residual || !currentSeries.dates) {
     return (
       <div className="mb-8">
         <h3 className="text-xl font-semibold mb-2">Time Series Analysis</h3>
-        <p>No valid time series data available for the selected series.</p>
+        <p>{currentSeries?.error ?? 'No valid time series data available for the selected series.'}</p>
       </div>
     );
   }
 
+  const formatX = (value: number) =>
+    downsampled?.xType === 'datetime' ? new Date(value).toISOString().slice(0, 10) : String(value);
+
+  // Narrowed above; the map callback would lose the narrowing on the properties
+  const trend = currentSeries.trend;
+  const seasonal = currentSeries.seasonal;
+  const residual = currentSeries.residual;
   const data = currentSeries.dates.map((date, index) => ({
     date,
-    trend: currentSeries.trend[index] || 0,
-    seasonal: currentSeries.seasonal[index] || 0,
-    residual: currentSeries.residual[index] || 0,
+    trend: trend[index] || 0,
+    seasonal: seasonal[index] || 0,
+    residual: residual[index] || 0,
   }));
 
   return (
@@ -55,22 +119,69 @@ const TimeSeriesChart: React.FC<TimeSeriesChartProps> = ({ timeSeriesData }) =>
           ))}
         </select>
       </div>
-      <ResponsiveContainer width="100%" height={400}>
-        <LineChart data={data} margin={{ top: 5, right: 30, left: 20, bottom: 5 }}>
-          <CartesianGrid strokeDasharray="3 3" />
-          <XAxis dataKey="date" />
-          <YAxis />
-          <Tooltip />
-          <Legend />
-          <Line type="monotone" dataKey="trend" stroke="#8884d8" activeDot={{ r: 8 }} />
-          <Line type="monotone" dataKey="seasonal" stroke="#82ca9d" />
-          <Line type="monotone" dataKey="residual" stroke="#ffc658" />
-        </LineChart>
-      </ResponsiveContainer>
+      {downsampled ? (
+        <>
+          <div className="flex items-center justify-between mb-2 text-sm text-gray-600">
+            <span>Drag across the chart to zoom in.</span>
+            {viewport.start !== undefined && (
+              <button onClick={() => setViewport({})} className="text-indigo-600 hover:text-indigo-800">
+                Reset zoom
+              </button>
+            )}
+          </div>
+          <ResponsiveContainer width="100%" height={400}>
+            <LineChart
+              margin={{ top: 5, right: 30, left: 20, bottom: 5 }}
+              onMouseDown={(event: any) => event?.activeLabel !== undefined && setSelection({ start: Number(event.activeLabel) })}
+              onMouseMove={(event: any) =>
+                selection.start !== undefined && event?.activeLabel !== undefined &&
+                setSelection({ ...selection, end: Number(event.activeLabel) })
+              }
+              onMouseUp={finishSelection}
+            >
+              <CartesianGrid strokeDasharray="3 3" />
+              <XAxis type="number" dataKey="x" domain={['dataMin', 'dataMax']} tickFormatter={formatX} allowDataOverflow />
+              <YAxis />
+              <Tooltip labelFormatter={formatX} />
+              <Legend />
+              {COMPONENTS.map(component => (
+                <Line
+                  key={component}
+                  data={downsampled.series[component]}
+                  dataKey="y"
+                  name={component}
+                  type="monotone"
+                  stroke={COLORS[component]}
+                  dot={false}
+                  isAnimationActive={false}
+                />
+              ))}
+              {selection.start !== undefined && selection.end !== undefined && (
+                <ReferenceArea x1={selection.start} x2={selection.end} strokeOpacity={0.3} />
+              )}
+            </LineChart>
+          </ResponsiveContainer>
+        </>
+      ) : (
+        <ResponsiveContainer width="100%" height={400}>
+          <LineChart data={data} margin={{ top: 5, right: 30, left: 20, bottom: 5 }}>
+            <CartesianGrid strokeDasharray="3 3" />
+            <XAxis dataKey="date" />
+            <YAxis />
+            <Tooltip />
+            <Legend />
+            <Line type="monotone" dataKey="trend" stroke="#8884d8" activeDot={{ r: 8 }} />
+            <Line type="monotone" dataKey="seasonal" stroke="#82ca9d" />
+            <Line type="monotone" dataKey="residual" stroke="#ffc658" />
+          </LineChart>
+        </ResponsiveContainer>
+      )}
       <div className="mt-4">
+        {currentSeries.period !== undefined && <p>Seasonal period: {currentSeries.period} observations</p>}
         <p>ADF Statistic: {currentSeries.adf_statistic?.toFixed(4) ?? 'N/A'}</p>
         <p>ADF p-value: {currentSeries.adf_pvalue?.toFixed(4) ?? 'N/A'}</p>
-        {currentSeries.adf_pvalue !== undefined && (
+        {currentSeries.error && <p className="text-red-600">{currentSeries.error}</p>}
+        {currentSeries.adf_pvalue != null && (
           <p>
             {currentSeries.adf_pvalue < 0.05
               ? "The time series is stationary (suitable for forecasting models)."
@@ -1,27 +1,52 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import BarChart from '../charts/BarChart';
+import { queryGroupBy } from '../../utils/api';
 
 interface BarChartSectionProps {
   data: Record<string, {
     type: 'numerical' | 'categorical' | 'datetime';
     [key: string]: any;
   }>;
+  filename?: string;
 }
 
-const BarChartSection: React.FC<BarChartSectionProps> = ({ data }) => {
-  const categoricalData = Object.entries(data)
-    .filter(([_, colData]) => colData.type === 'categorical')
-    .reduce((acc, [colName, colData]) => {
-      acc[colName] = colData.top_values;
-      return acc;
-    }, {} as Record<string, Record<string, number>>);
+// Bars per chart, the largest categories
+const CATEGORY_LIMIT = 20;
+
+const BarChartSection: React.FC<BarChartSectionProps> = ({ data, filename }) => {
+  const categoricalColumns = Object.keys(data).filter(column => data[column].type === 'categorical');
+  const topValues = categoricalColumns.reduce((acc, column) => {
+    acc[column] = data[column].top_values;
+    return acc;
+  }, {} as Record<string, Record<string, number>>);
+
+  // Counts over the whole dataset come from the server; the summary's top values are shown until
+  // they arrive, or if the query fails
+  const [counts, setCounts] = useState<Record<string, Record<string, number>>>({});
+
+  useEffect(() => {
+    if (!filename) return;
+    let cancelled = false;
+    Object.keys(data).filter(column => data[column].type === 'categorical').forEach(column => {
+      queryGroupBy(filename, [column], { limit: CATEGORY_LIMIT })
+        .then(result => {
+          if (cancelled) return;
+          const columnCounts = Object.fromEntries(result.keys.map(([key], i) => [String(key), result.size[i]]));
+          setCounts(prev => ({ ...prev, [column]: columnCounts }));
+        })
+        .catch(error => console.error(`Counting ${column} failed:`, error));
+    });
+    return () => {
+      cancelled = true;
+    };
+  }, [filename, data]);
 
   return (
     <div>
       <h3 className="text-xl font-semibold mb-4">Bar Charts</h3>
-      <BarChart data={categoricalData} />
+      <BarChart data={{ ...topValues, ...counts }} />
     </div>
   );
 };
 
-export default BarChartSection;
\ No newline at end of file
+export default BarChartSection;
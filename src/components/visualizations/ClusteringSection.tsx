@@ -8,13 +8,14 @@ interface ClusteringSectionProps {
     type: 'numerical' | 'categorical' | 'datetime';
     [key: string]: any;
   }>;
+  handle?: string;
 }
 
-const ClusteringSection: React.FC<ClusteringSectionProps> = ({ pca_data, clusters, summary }) => {
+const ClusteringSection: React.FC<ClusteringSectionProps> = ({ pca_data, clusters, summary, handle }) => {
   return (
     <div>
       <h3 className="text-xl font-semibold mb-4">Clustering Analysis</h3>
-      <ClusteringChart pca_data={pca_data} clusters={clusters} summary={summary} />
+      <ClusteringChart pca_data={pca_data} clusters={clusters} summary={summary} handle={handle} />
     </div>
   );
 };
@@ -1,15 +1,17 @@
 import React from 'react';
 import OutlierDetection from '../charts/OutlierDetection';
+import { OutlierResult } from '../../utils/api';
 
 interface OutlierSectionProps {
   data: Record<string, {
     type: 'numerical' | 'categorical' | 'datetime';
     [key: string]: any;
   }>;
-  outliers: Record<string, number[]>;
+  outliers: Record<string, OutlierResult>;
+  filename?: string;
 }
 
-const OutlierSection: React.FC<OutlierSectionProps> = ({ data, outliers }) => {
+const OutlierSection: React.FC<OutlierSectionProps> = ({ data, outliers, filename }) => {
   const numericalData = Object.entries(data)
     .filter(([_, colData]) => colData.type === 'numerical')
     .reduce((acc, [colName, colData]) => {
@@ -20,7 +22,7 @@ const OutlierSection: React.FC<OutlierSectionProps> = ({ data, outliers }) => {
   return (
     <div>
       <h3 className="text-xl font-semibold mb-4">Outlier Detection</h3>
-      <OutlierDetection data={numericalData} outliers={outliers} />
+      <OutlierDetection data={numericalData} outliers={outliers} filename={filename} />
     </div>
   );
 };
@@ -6,20 +6,16 @@ interface PairwisePlotsSectionProps {
     type: 'numerical' | 'categorical' | 'datetime';
     [key: string]: any;
   }>;
+  filename?: string;
 }
 
-const PairwisePlotsSection: React.FC<PairwisePlotsSectionProps> = ({ data }) => {
-  const numericalData = Object.entries(data)
-    .filter(([_, colData]) => colData.type === 'numerical')
-    .reduce((acc, [colName, colData]) => {
-      acc[colName] = Object.values(colData).filter(val => typeof val === 'number');
-      return acc;
-    }, {} as Record<string, number[]>);
+const PairwisePlotsSection: React.FC<PairwisePlotsSectionProps> = ({ data, filename }) => {
+  const numericalColumns = Object.keys(data).filter(column => data[column].type === 'numerical');
 
   return (
     <div>
       <h3 className="text-xl font-semibold mb-4">Pairwise Plots</h3>
-      <PairwisePlots data={numericalData} />
+      <PairwisePlots filename={filename} variables={numericalColumns} />
     </div>
   );
 };
@@ -3,20 +3,23 @@ import TimeSeriesChart from '../charts/TimeSeriesChart';
 
 interface TimeSeriesSectionProps {
   timeSeriesData: Record<string, {
-    trend: number[];
-    seasonal: number[];
-    residual: number[];
-    adf_statistic: number;
-    adf_pvalue: number;
-    dates: string[];
+    trend?: number[];
+    seasonal?: number[];
+    residual?: number[];
+    period?: number;
+    adf_statistic?: number | null;
+    adf_pvalue?: number | null;
+    dates?: string[];
+    error?: string;
   }>;
+  handle?: string;
 }
 
-const TimeSeriesSection: React.FC<TimeSeriesSectionProps> = ({ timeSeriesData }) => {
+const TimeSeriesSection: React.FC<TimeSeriesSectionProps> = ({ timeSeriesData, handle }) => {
   return (
     <div>
       <h3 className="text-xl font-semibold mb-4">Time Series Analysis</h3>
-      <TimeSeriesChart timeSeriesData={timeSeriesData} />
+      <TimeSeriesChart timeSeriesData={timeSeriesData} handle={handle} />
     </div>
   );
 };
@@ -6,6 +6,12 @@ export interface FileInfo {
   columns: string[];
   dtypes: Record<string, string>;
   missing_values: Record<string, number>;
+  // Bytes in memory with pandas' default dtypes and with the inferred ones
+  memory_usage?: { before: number; after: number };
+}
+
+export interface AppendInfo extends FileInfo {
+  appended_rows: number;
 }
 
 export async function uploadFile(file: File): Promise<FileInfo> {
@@ -36,9 +42,82 @@ export async function uploadFile(file: File): Promise<FileInfo> {
   }
 }
 
+// Adds the rows of a file with the same columns to an uploaded dataset
+export async function appendRows(filename: string, file: File): Promise<AppendInfo> {
+  const formData = new FormData();
+  formData.append('file', file);
+
+  const response = await fetch(`${API_URL}/append/${encodeURIComponent(filename)}`, {
+    method: 'POST',
+    body: formData,
+  });
+  if (!response.ok) {
+    let errorMessage = `HTTP error! status: ${response.status}`;
+    try {
+      const errorBody = await response.json();
+      errorMessage = errorBody.detail || errorMessage;
+    } catch (e) {
+      console.error('Error parsing error response:', e);
+    }
+    throw new Error(errorMessage);
+  }
+  return response.json();
+}
+
+interface TypedBlock {
+  $block: 'float32' | 'float64' | 'int32';
+  shape: number[];
+  columns?: string[];
+  data: string;
+}
+
+const BLOCK_ARRAYS = {
+  float32: Float32Array,
+  float64: Float64Array,
+  int32: Int32Array,
+};
+
+function decodeBlock(block: TypedBlock): any[] {
+  const bytes = Uint8Array.from(atob(block.data), (char) => char.charCodeAt(0));
+  const values = Array.from(new BLOCK_ARRAYS[block.$block](bytes.buffer), (value) =>
+    Number.isFinite(value) ? value : null
+  );
+  const columns = block.columns;
+  if (!columns) {
+    return values;
+  }
+  return Array.from({ length: block.shape[0] }, (_, row) =>
+    Object.fromEntries(columns.map((column, col) => [column, values[row * columns.length + col]]))
+  );
+}
+
+function decodeColumnar(value: any): any {
+  if (Array.isArray(value)) {
+    return value.map(decodeColumnar);
+  }
+  if (value && typeof value === 'object') {
+    if ('$block' in value) {
+      return decodeBlock(value);
+    }
+    return Object.fromEntries(Object.entries(value).map(([key, item]) => [key, decodeColumnar(item)]));
+  }
+  return value;
+}
+
+// Columnar responses send long numeric lists as typed blocks; both formats send repeated sections as references
+export function decodeAnalysisResult(payload: Record<string, any>): AnalysisResult {
+  const result = decodeColumnar(payload);
+  Object.entries(result).forEach(([key, value]: [string, any]) => {
+    if (value && typeof value === 'object' && '$ref' in value) {
+      result[key] = result[value.$ref];
+    }
+  });
+  return result;
+}
+
 export async function preprocessData(filename: string, options: any): Promise<AnalysisResult> {
   try {
-    const requestBody = JSON.stringify({ filename, options });
+    const requestBody = JSON.stringify({ filename, options, responseFormat: 'columnar' });
     console.log('Preprocessing request:', requestBody);
 
     const response = await fetch(`${API_URL}/preprocess`, {
@@ -55,13 +134,316 @@ export async function preprocessData(filename: string, options: any): Promise<An
       throw new Error(`Data preprocessing failed: ${JSON.stringify(errorData)}`);
     }
 
-    return response.json();
+    return decodeAnalysisResult(await response.json());
   } catch (error) {
     console.error('Preprocessing error:', error);
     throw error;
   }
 }
+export interface LazyAnalysis
+  extends Pick<AnalysisResult, 'summary' | 'column_types' | 'general_statistics' | 'missing_values'> {
+  handle: string;
+  filename: string;
+  sections: Array<keyof AnalysisResult>;
+}
+
+export interface AnalysisSection<K extends keyof AnalysisResult> {
+  handle: string;
+  section: K;
+  data: AnalysisResult[K];
+  offset?: number;
+  limit?: number | null;
+  total?: number;
+}
+
+// Returns a handle and the cheap sections; each tab then fetches its own section
+export async function startAnalysis(filename: string, options: any): Promise<LazyAnalysis> {
+  const response = await fetch(`${API_URL}/preprocess`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ filename, options, lazy: true }),
+  });
+  if (!response.ok) {
+    const errorData = await response.json();
+    throw new Error(`Data preprocessing failed: ${JSON.stringify(errorData)}`);
+  }
+  return response.json();
+}
+
+// Per-row sections (pca_data, clusters, time_series_analysis, outliers) can be fetched a page at a time
+export async function fetchAnalysisSection<K extends keyof AnalysisResult>(
+  handle: string,
+  section: K,
+  page?: { offset: number; limit: number }
+): Promise<AnalysisSection<K>> {
+  const params = new URLSearchParams({ response_format: 'columnar' });
+  if (page) {
+    params.set('offset', String(page.offset));
+    params.set('limit', String(page.limit));
+  }
+  const response = await fetch(`${API_URL}/analysis/${handle}/${String(section)}?${params}`);
+  if (!response.ok) {
+    const errorData = await response.json();
+    throw new Error(`Fetching ${String(section)} failed: ${JSON.stringify(errorData)}`);
+  }
+  const payload = await response.json();
+  return { ...payload, data: decodeColumnar(payload.data) };
+}
+
+export interface BoxStats {
+  q1: (number | null)[];
+  median: (number | null)[];
+  q3: (number | null)[];
+  whisker_low: (number | null)[];
+  whisker_high: (number | null)[];
+  outliers: number[];
+}
+
+export interface GroupByResult {
+  filename: string;
+  by: string[];
+  value: string | null;
+  // One list of values (one per `by` column) for each group, largest groups first unless ordered by key
+  keys: any[][];
+  size: number[];
+  count?: number[];
+  sum?: (number | null)[];
+  mean?: (number | null)[];
+  min?: (number | null)[];
+  max?: (number | null)[];
+  std?: (number | null)[];
+  quantiles?: Record<string, (number | null)[]>;
+  box?: BoxStats;
+  total_groups: number;
+  other_size: number;
+  missing_keys: number;
+  value_type: 'number' | 'datetime' | null;
+}
+
+export interface HistogramResult {
+  filename: string;
+  column: string;
+  by: string | null;
+  edges: number[];
+  // One row per group when grouped
+  counts: number[] | number[][];
+  groups?: any[][];
+  group_sizes?: number[];
+  below: number;
+  above: number;
+  missing: number;
+  value_type: 'number' | 'datetime';
+}
+
+export interface PairCountsResult {
+  filename: string;
+  columns: string[];
+  edges: Record<string, number[]>;
+  types: Record<string, 'number' | 'datetime'>;
+  pairs: Array<{ x: string; y: string; counts: number[][]; total: number }>;
+}
+
+async function fetchQuery<T>(path: string, params: URLSearchParams): Promise<T> {
+  const response = await fetch(`${API_URL}/query/${path}?${params}`);
+  if (!response.ok) {
+    const errorData = await response.json();
+    throw new Error(`Query failed: ${JSON.stringify(errorData)}`);
+  }
+  return response.json();
+}
+
+// Aggregates computed on the server over the whole dataset, so charts don't need its rows
+export async function queryGroupBy(
+  filename: string,
+  by: string[],
+  options: { value?: string; aggregations?: string[]; quantiles?: number[]; order?: 'size' | 'key'; limit?: number } = {}
+): Promise<GroupByResult> {
+  const params = new URLSearchParams();
+  by.forEach(column => params.append('by', column));
+  (options.aggregations ?? ['count']).forEach(aggregation => params.append('aggregations', aggregation));
+  (options.quantiles ?? []).forEach(q => params.append('quantiles', String(q)));
+  if (options.value) params.set('value', options.value);
+  if (options.order) params.set('order', options.order);
+  if (options.limit !== undefined) params.set('limit', String(options.limit));
+  return fetchQuery<GroupByResult>(`groupby/${encodeURIComponent(filename)}`, params);
+}
+
+export async function queryHistogram(
+  filename: string,
+  column: string,
+  options: { bins?: number; min?: number; max?: number; edges?: number[]; by?: string; limit?: number } = {}
+): Promise<HistogramResult> {
+  const params = new URLSearchParams({ column });
+  if (options.bins !== undefined) params.set('bins', String(options.bins));
+  if (options.min !== undefined) params.set('min', String(options.min));
+  if (options.max !== undefined) params.set('max', String(options.max));
+  (options.edges ?? []).forEach(edge => params.append('edges', String(edge)));
+  if (options.by) params.set('by', options.by);
+  if (options.limit !== undefined) params.set('limit', String(options.limit));
+  return fetchQuery<HistogramResult>(`histogram/${encodeURIComponent(filename)}`, params);
+}
+
+// 2-D bin counts of every pair of the given numeric columns
+export async function queryPairCounts(filename: string, columns: string[], bins = 20): Promise<PairCountsResult> {
+  const params = new URLSearchParams({ bins: String(bins) });
+  columns.forEach(column => params.append('columns', column));
+  return fetchQuery<PairCountsResult>(`pairs/${encodeURIComponent(filename)}`, params);
+}
+
+export interface LineSeries {
+  handle: string;
+  column: string;
+  component: 'trend' | 'seasonal' | 'residual';
+  // Epoch milliseconds when x_type is 'datetime'
+  x: number[];
+  y: number[];
+  x_type: 'number' | 'datetime' | 'index';
+  viewport_points: number;
+  method: 'raw' | 'minmax' | 'lttb';
+}
+
+export interface ScatterDensity {
+  handle: string;
+  cluster: number | null;
+  total_points: number;
+  mode: 'points' | 'density';
+  // Points mode
+  x?: number[];
+  y?: number[];
+  // Density mode: counts[i][j] points between x_edges[i..i+1] and y_edges[j..j+1]
+  x_edges?: number[];
+  y_edges?: number[];
+  counts?: number[][];
+}
+
+export interface Viewport {
+  start?: number;
+  end?: number;
+}
+
+async function fetchLod<T>(handle: string, path: string, params: URLSearchParams): Promise<T> {
+  const response = await fetch(`${API_URL}/analysis/${handle}/lod/${path}?${params}`);
+  if (!response.ok) {
+    const errorData = await response.json();
+    throw new Error(`Downsampling failed: ${JSON.stringify(errorData)}`);
+  }
+  return response.json();
+}
+
+// A time series component of an analysis, downsampled on the server to about `pixels` points
+export async function fetchComponentSeries(
+  handle: string,
+  column: string,
+  component: LineSeries['component'],
+  options: Viewport & { pixels?: number; method?: 'minmax' | 'lttb' } = {}
+): Promise<LineSeries> {
+  const params = new URLSearchParams({ component });
+  if (options.start !== undefined) params.set('start', String(options.start));
+  if (options.end !== undefined) params.set('end', String(options.end));
+  if (options.pixels !== undefined) params.set('pixels', String(Math.max(1, Math.round(options.pixels))));
+  if (options.method) params.set('method', options.method);
+  return fetchLod<LineSeries>(handle, `line/${encodeURIComponent(column)}`, params);
+}
+
+// The PCA scores of an analysis, or of one cluster, as points or binned counts
+export async function fetchPcaDensity(
+  handle: string,
+  options: { cluster?: number; xMin?: number; xMax?: number; yMin?: number; yMax?: number; bins?: number } = {}
+): Promise<ScatterDensity> {
+  const params = new URLSearchParams();
+  if (options.cluster !== undefined) params.set('cluster', String(options.cluster));
+  if (options.xMin !== undefined) params.set('x_min', String(options.xMin));
+  if (options.xMax !== undefined) params.set('x_max', String(options.xMax));
+  if (options.yMin !== undefined) params.set('y_min', String(options.yMin));
+  if (options.yMax !== undefined) params.set('y_max', String(options.yMax));
+  if (options.bins !== undefined) params.set('bins', String(options.bins));
+  return fetchLod<ScatterDensity>(handle, 'scatter', params);
+}
+
+export interface JobEvent {
+  event: 'status' | 'progress';
+  job_id: string;
+  status?: 'queued' | 'running' | 'done' | 'failed' | 'cancelled';
+  stage?: string;
+  progress: number;
+  error?: string | null;
+}
+
+export interface AnalysisJob {
+  jobId: string;
+  result: Promise<AnalysisResult>;
+  cancel: () => Promise<void>;
+}
+
+export async function cancelJob(jobId: string): Promise<void> {
+  await fetch(`${API_URL}/jobs/${jobId}`, { method: 'DELETE' });
+}
+
+// Runs the analysis as a background job; onProgress receives every event the server streams
+export async function runAnalysisJob(
+  filename: string,
+  options: any,
+  onProgress?: (event: JobEvent) => void
+): Promise<AnalysisJob> {
+  const response = await fetch(`${API_URL}/jobs`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ filename, options }),
+  });
+  if (!response.ok) {
+    const errorData = await response.json();
+    throw new Error(`Starting analysis failed: ${JSON.stringify(errorData)}`);
+  }
+  const { job_id: jobId } = await response.json();
+
+  const result = new Promise<AnalysisResult>((resolve, reject) => {
+    const source = new EventSource(`${API_URL}/jobs/${jobId}/events`);
+    const handle = (message: MessageEvent) => {
+      const event: JobEvent = JSON.parse(message.data);
+      onProgress?.(event);
+      if (event.status === 'done') {
+        source.close();
+        fetch(`${API_URL}/jobs/${jobId}/result?response_format=columnar`)
+          .then(async resultResponse => {
+            if (!resultResponse.ok) {
+              throw new Error(`Fetching analysis failed: ${JSON.stringify(await resultResponse.json())}`);
+            }
+            resolve(decodeAnalysisResult(await resultResponse.json()));
+          })
+          .catch(reject);
+      } else if (event.status === 'failed' || event.status === 'cancelled') {
+        source.close();
+        reject(new Error(event.error ?? `Analysis ${event.status}`));
+      }
+    };
+    source.addEventListener('status', handle);
+    source.addEventListener('progress', handle);
+    source.onerror = () => {
+      source.close();
+      reject(new Error('Lost connection to the analysis job'));
+    };
+  });
+
+  return { jobId, result, cancel: () => cancelJob(jobId) };
+}
+
+export interface OutlierResult {
+  method: 'zscore' | 'iqr' | 'isolation_forest';
+  indices: number[];
+  values: number[];
+  num_outliers: number;
+  total: number;
+  lower: number | null;
+  upper: number | null;
+}
+
 export interface AnalysisResult {
+  // Addresses the result's sections and downsampled series on the server
+  handle?: string;
   summary: Record<string, {
     type: 'numerical' | 'categorical' | 'datetime';
     [key: string]: any;
@@ -72,17 +454,19 @@ export interface AnalysisResult {
   pca_data?: Array<{ PC1: number; PC2: number }>;
   clusters?: number[];
   time_series_analysis?: Record<string, {
-    trend: number[];
-    seasonal: number[];
-    residual: number[];
-    adf_statistic: number;
-    adf_pvalue: number;
-    dates: string[];
+    trend?: number[];
+    seasonal?: number[];
+    residual?: number[];
+    period?: number;
+    adf_statistic?: number | null;
+    adf_pvalue?: number | null;
+    dates?: string[];
+    error?: string;
   }>;
   insights?: string[];
   missing_values: Record<string, number>;
   recommended_visualizations?: [string, string][];
-  pca_result?: number[][];
+  pca_result?: Array<{ PC1: number; PC2: number }>;
   pca_explained_variance?: number[];
   general_statistics: {
     totalRows: number;
@@ -93,12 +477,29 @@ export interface AnalysisResult {
     missingValues: number;
     totalCells: number;
   };
-  outliers?: Record<string, number[]>;
+  outliers?: Record<string, OutlierResult>;
+  outlier_summary?: Record<string, {
+    num_outliers: number;
+    percentage: number;
+  }>;
   feature_importance?: Record<string, Record<string, number>> | null;
   regression_insights?: Record<string, {
     r2_score: number;
     mse: number;
     coefficients: Record<string, number>;
   }>;
+  approximations?: Record<string, {
+    total_rows: number;
+    sample_size: number;
+    method: string;
+    sample_rows?: number[];
+    [bound: string]: any;
+  }>;
+  timings?: Record<string, {
+    wall?: number;
+    cpu?: number;
+    queued?: number;
+    executor?: 'thread' | 'process';
+  }>;
   filename: string;
 }
\ No newline at end of file